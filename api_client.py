@@ -1,53 +1,352 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Optional
+
 import requests
-from typing import Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import profiling
+from diff import SnapshotDiff, diff_snapshots, save_diff
+from history import HISTORY_DIR, get_history, history_path
 from storage import save_to_file, read_from_file, is_file_fresh
 
 
 FAVORITE_CURRENCIES = ["USD", "EUR", "GBP", "RUB"]
+# Значение currencies для построения таблиц всех валют из одного ответа
+ALL_CURRENCIES = "all"
+# Поля ответа, которые не переносятся в производные таблицы
+DERIVED_SKIP_FIELDS = ('rates', 'etag', 'last_modified', 'source')
+
+API_URL = "https://open.er-api.com/v6/latest/{code}"
+# Таймауты соединения и чтения в секундах
+REQUEST_TIMEOUT = (5, 15)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+MAX_WORKERS = 8
+# На сколько секунд ответ 304 (или 200 с прежним временем публикации) продлевает свежесть курсов,
+# если в нём нет Cache-Control/Expires
+NOT_MODIFIED_TTL = 600
 
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
 
-def get_currency_rate(currency_code: str) -> Optional[Dict[str, Any]]:
+
+def create_session(max_workers: int = MAX_WORKERS, retries: int = MAX_RETRIES,
+                   backoff_factor: float = BACKOFF_FACTOR) -> requests.Session:
     """
-    Получает курсы валют для указанной валюты через API
+    Создаёт сессию с пулом соединений и ограниченным числом повторов
+    с экспоненциальной задержкой для сетевых ошибок и ответов 429/5xx
     """
-    URL = f"https://open.er-api.com/v6/latest/{currency_code}"
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
+def _record_fetch(currency_code: str, response: requests.Response, elapsed: float) -> None:
+    """
+    Учитывает в метриках время запроса, число повторов и объём загруженных данных
+    """
+    metrics.observe("currency_fetch_seconds", elapsed, currency=currency_code)
+    metrics.inc("currency_fetch_total", currency=currency_code, status=response.status_code)
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        metrics.inc("currency_fetch_retries_total", len(retries.history), currency=currency_code)
+    # Байты, полученные по сети (до распаковки gzip), а если недоступно — размер тела
     try:
-        response = requests.get(URL)
+        received = response.raw.tell() or len(response.content)
+    except (AttributeError, OSError):
+        received = len(response.content)
+    metrics.inc("currency_fetch_bytes_total", received, currency=currency_code)
+
+
+def get_session() -> requests.Session:
+    """
+    Возвращает общую для процесса сессию
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def not_modified_until(headers, now: Optional[float] = None) -> int:
+    """
+    До какого времени (unix) ответ 304 подтверждает прежние курсы:
+    по Cache-Control max-age, затем по Expires, иначе на NOT_MODIFIED_TTL секунд
+    """
+    if now is None:
+        now = time.time()
+    for directive in headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        value = value.strip('"')
+        if name.lower() == 'max-age' and value.isdigit():
+            return int(now) + int(value)
+    expires = headers.get('Expires')
+    if expires:
+        from email.utils import parsedate_to_datetime
+        try:
+            return int(parsedate_to_datetime(expires).timestamp())
+        except (TypeError, ValueError):
+            pass
+    return int(now) + NOT_MODIFIED_TTL
+
+
+def revalidated(previous: Dict[str, Any], until: int) -> Dict[str, Any]:
+    """
+    Прежний ответ, подтверждённый ответом 304: следующее обновление ожидается
+    не раньше until. Если срок не продлевается, возвращается сам previous.
+    """
+    if (previous.get('time_next_update_unix') or 0) >= until:
+        return previous
+    data = dict(previous)
+    data['time_next_update_unix'] = until
+    data['time_next_update_utc'] = time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(until))
+    return data
+
+
+def extend_if_unchanged(data: Dict[str, Any], previous: Optional[Dict[str, Any]],
+                        now: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Ответ 200 с прежним временем публикации после объявленного срока обновления:
+    провайдер опаздывает с новыми курсами. Срок свежести продлевается, как при ответе 304,
+    на NOT_MODIFIED_TTL секунд — иначе каждый запуск и сервис запрашивали бы курсы заново.
+    """
+    if now is None:
+        now = time.time()
+    if previous is None or data.get('time_last_update_unix') != previous.get('time_last_update_unix'):
+        return data
+    if (data.get('time_next_update_unix') or 0) > now:
+        return data
+    return revalidated(data, int(now) + NOT_MODIFIED_TTL)
+
+
+def get_currency_rate(currency_code: str, session: Optional[requests.Session] = None,
+                      base_url: str = API_URL, timeout=REQUEST_TIMEOUT,
+                      previous: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Получает курсы валют для указанной валюты через API.
+    Если передан предыдущий ответ, запрос делается условным (ETag/Last-Modified),
+    и при ответе 304 возвращается previous без повторной загрузки тела — с продлённым
+    по заголовкам ответа сроком свежести (см. not_modified_until).
+    """
+    URL = base_url.format(code=currency_code)
+    if session is None:
+        session = get_session()
+
+    headers = {}
+    if previous is not None:
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+
+    start = time.perf_counter()
+    try:
+        with profiling.phase("network"):
+            response = session.get(URL, timeout=timeout, headers=headers)
+        if metrics.ENABLED:
+            _record_fetch(currency_code, response, time.perf_counter() - start)
+        if response.status_code == 304 and previous is not None:
+            return revalidated(previous, not_modified_until(response.headers))
         if response.status_code != 200:
             print(f"Ошибка при запросе к API: {response.status_code}")
             return None
-        
-        data = response.json()
+
+        with profiling.phase("parse"):
+            if metrics.ENABLED:
+                with metrics.timer("currency_parse_seconds", source="api"):
+                    data = response.json()
+            else:
+                data = response.json()
+        if response.headers.get('ETag'):
+            data['etag'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            data['last_modified'] = response.headers['Last-Modified']
         return data
     except requests.exceptions.ConnectionError:
+        if metrics.ENABLED:
+            metrics.inc("currency_fetch_errors_total", currency=currency_code, reason="connection")
         print("Ошибка сети: не удается подключиться к API. Пожалуйста, проверьте подключение к интернету.")
         return None
     except requests.exceptions.Timeout:
+        if metrics.ENABLED:
+            metrics.inc("currency_fetch_errors_total", currency=currency_code, reason="timeout")
         print("Ошибка сети: превышено время ожидания запроса. Пожалуйста, проверьте подключение к интернету.")
         return None
     except requests.exceptions.RequestException as e:
+        if metrics.ENABLED:
+            metrics.inc("currency_fetch_errors_total", currency=currency_code, reason="request")
         print(f"Ошибка сети при запросе курсов валют: {e}")
         return None
     except ValueError:  # json.JSONDecodeError is subclass of ValueError
+        if metrics.ENABLED:
+            metrics.inc("currency_fetch_errors_total", currency=currency_code, reason="json")
         print("Ошибка при декодировании JSON ответа от API")
         return None
 
 
-def update_currency_rates(file_path: str = "currency_rate.json") -> None:
+def fetch_currency_rates(currencies: Iterable[str], session: Optional[requests.Session] = None,
+                         base_url: str = API_URL, timeout=REQUEST_TIMEOUT,
+                         max_workers: int = MAX_WORKERS,
+                         previous_data: Optional[Dict[str, Any]] = None,
+                         pool=None) -> Dict[str, Optional[Dict[str, Any]]]:
     """
-    Обновляет курсы валют, делая запросы к API для избранных валют
+    Параллельно запрашивает курсы для нескольких валют через общую сессию.
+    Если задан pool (providers.ProviderPool), каждая валюта запрашивается
+    у источников пула с дублированием запросов, а base_url не используется.
     """
+    currencies = list(currencies)
+    if session is None:
+        session = get_session()
+    if previous_data is None:
+        previous_data = {}
+    if not currencies:
+        return {}
+
+    if pool is not None:
+        def fetch(code):
+            return pool.fetch(code, previous_data.get(code))
+    else:
+        def fetch(code):
+            return get_currency_rate(code, session=session, base_url=base_url, timeout=timeout,
+                                     previous=previous_data.get(code))
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(currencies))) as executor:
+        results = executor.map(fetch, currencies)
+        return dict(zip(currencies, results))
+
+
+def derive_base_table(source: Dict[str, Any], base_code: str) -> Optional[Dict[str, Any]]:
+    """
+    Пересчитывает ответ API для другой базовой валюты делением курсов.
+    Производная таблица помечается полем derived_from с исходной базой.
+    Валидаторы исходного ответа (etag, last_modified) и source не копируются:
+    они относятся к запросу исходной базы и не должны уходить в запрос другой валюты.
+    """
+    rates = source['rates']
+    divisor = rates.get(base_code)
+    if not divisor:
+        return None
+
+    derived = {key: value for key, value in source.items() if key not in DERIVED_SKIP_FIELDS}
+    derived['base_code'] = base_code
+    derived['derived_from'] = source['base_code']
+    derived['rates'] = {code: rate / divisor for code, rate in rates.items()}
+    derived['rates'][base_code] = 1.0
+    return derived
+
+
+def fetch_single_source(currencies: Iterable[str], source_currency: str = "USD",
+                        base_url: str = API_URL,
+                        previous_data: Optional[Dict[str, Any]] = None,
+                        pool=None) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Запрашивает курсы одной базовой валюты и строит из них таблицы остальных
+    """
+    previous = (previous_data or {}).get(source_currency)
+    if previous is not None and previous.get('derived_from'):
+        previous = None
+    if pool is not None:
+        source = pool.fetch(source_currency, previous)
+    else:
+        source = get_currency_rate(source_currency, base_url=base_url, previous=previous)
+    if source is None:
+        return {source_currency: None}
+
+    if currencies == ALL_CURRENCIES:
+        currencies = list(source['rates'])
+
+    results = {}
+    for currency in currencies:
+        if currency == source['base_code']:
+            results[currency] = source
+        else:
+            results[currency] = derive_base_table(source, currency)
+    return results
+
+
+def update_currency_rates(file_path: str = "currency_rate.json",
+                          currencies: Optional[Iterable[str]] = None,
+                          base_url: str = API_URL, max_workers: int = MAX_WORKERS,
+                          single_fetch: bool = False, source_currency: str = "USD",
+                          history_dir: Optional[str] = HISTORY_DIR, pool=None,
+                          diff_file: Optional[str] = None) -> Optional[SnapshotDiff]:
+    """
+    Обновляет курсы валют, делая параллельные запросы к API для избранных валют.
+    В режиме single_fetch делается один запрос для source_currency, а таблицы
+    остальных валют (или всех, если currencies == ALL_CURRENCIES) вычисляются локально.
+    Каждый новый снимок дописывается в историю history_dir (относительный путь —
+    от каталога file_path; None — не сохранять).
+    Без явного base_url курсы запрашиваются через пул источников pool
+    (по умолчанию — общий пул providers.get_pool()); статистика источников
+    пула хранится рядом с file_path (providers.stats_path) и переживает запуск.
+    Возвращает разницу с предыдущим содержимым файла (None, если обновить не удалось);
+    если задан diff_file, разница записывается в него в JSON.
+    """
+    if currencies is None:
+        currencies = FAVORITE_CURRENCIES
+    if pool is None and base_url == API_URL:
+        from providers import get_pool
+        pool = get_pool()
+    if pool is not None:
+        from providers import stats_path
+        pool.load_stats(stats_path(file_path))
+
+    # Предыдущие ответы нужны для условных запросов
+    try:
+        previous_data = read_from_file(file_path)
+    except (FileNotFoundError, ValueError):
+        previous_data = {}
+
+    if single_fetch:
+        fetched = fetch_single_source(currencies, source_currency, base_url=base_url,
+                                      previous_data=previous_data, pool=pool)
+    elif currencies == ALL_CURRENCIES:
+        print("Загрузка всех таблиц возможна только в режиме single_fetch")
+        return None
+    else:
+        fetched = fetch_currency_rates(currencies, base_url=base_url, max_workers=max_workers,
+                                       previous_data=previous_data, pool=pool)
+    if pool is not None:
+        pool.save_stats(stats_path(file_path))
+
     all_data = {}
-    for currency in FAVORITE_CURRENCIES:
-        rate = get_currency_rate(currency)
+    now = time.time()
+    for currency, rate in fetched.items():
         if rate is not None:
-            all_data[currency] = rate
+            all_data[currency] = extend_if_unchanged(rate, previous_data.get(currency), now)
         else:
             print(f"Не удалось получить данные для валюты {currency}")
-    
-    if all_data:
+
+    if not all_data:
+        print("Не удалось обновить данные для каких-либо валют")
+        return None
+
+    if all_data == previous_data:
+        # Все ответы 304 без нового срока: файл не переписывается
+        print(f"Данные в {file_path} не изменились")
+    else:
         save_to_file(all_data, file_path)
+        if history_dir is not None:
+            get_history(history_path(file_path, history_dir)).append(all_data)
         print(f"Данные обновлены в {file_path}")
-    else:
-        print("Не удалось обновить данные для каких-либо валют")
\ No newline at end of file
+
+    diff = diff_snapshots(previous_data, all_data)
+    print(f"Изменения: {diff.summary()}")
+    if diff_file is not None:
+        save_diff(diff, diff_file)
+    return diff
@@ -0,0 +1,356 @@
+import csv
+import io
+import json
+import math
+import os
+import time
+from collections import deque
+from decimal import Decimal
+from itertools import chain, islice
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import metrics
+import profiling
+from constants import CHUNK_SIZE
+from money import PairConverter, RoundingRule, rule_for
+from rates import RateTable
+from storage import shared_code_index
+
+
+Row = Tuple[str, str, str]
+
+# Имена колонок заголовка CSV
+HEADER_COLUMNS = ("from", "to", "amount")
+
+
+def read_rows(stream: Iterable[str], fmt: str = "csv") -> Iterator[Row]:
+    """
+    Построчно читает записи (from, to, amount) из CSV или JSONL
+    """
+    if fmt == "jsonl":
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                # Дробные суммы читаются без потери точности
+                record = json.loads(line, parse_float=Decimal)
+                yield str(record.get("from", "")), str(record.get("to", "")), str(record.get("amount", ""))
+            except (ValueError, AttributeError):
+                yield "", "", line
+        return
+
+    reader = csv.reader(stream)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < 3:
+            row = row + [""] * (3 - len(row))
+        yield row[0], row[1], row[2]
+
+
+def iter_chunks(rows: Iterable[Row], chunk_size: int = CHUNK_SIZE) -> Iterator[List[Row]]:
+    """
+    Разбивает поток записей на блоки фиксированного размера
+    """
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _pair_rate(table: RateTable, pair: Tuple[str, str]) -> Tuple[Optional[float], str]:
+    """
+    Курс пары и текст ошибки, если курса нет
+    """
+    unknown = [code for code in pair if code not in table]
+    if unknown:
+        return None, f"Валюта {unknown[0]} недоступна"
+    rate = 1.0 if pair[0] == pair[1] else table.rate(*pair)
+    if rate is None:
+        return None, f"Не удалось найти путь для конвертации {pair[0]} в {pair[1]}"
+    return rate, ""
+
+
+def _record_chunk(start: float, results: List[Tuple[Any, str]]) -> None:
+    metrics.observe("batch_chunk_seconds", time.perf_counter() - start)
+    failed = sum(1 for result, _ in results if result is None)
+    metrics.inc("batch_rows_total", len(results) - failed, status="ok")
+    metrics.inc("batch_rows_total", failed, status="error")
+
+
+def convert_chunk(table: RateTable, chunk: List[Row]) -> List[Tuple[Optional[float], str]]:
+    """
+    Конвертирует блок записей. Курс каждой пары ищется в таблице один раз на блок,
+    после чего на запись остаётся одно умножение (без numpy блок не векторизуется).
+    Возвращает пары (результат, ошибка); при ошибке результат равен None.
+    nan, inf и суммы, результат которых не помещается во float, считаются ошибкой.
+    """
+    start = time.perf_counter() if metrics.ENABLED else 0.0
+    pair_rates: Dict[Tuple[str, str], Tuple[Optional[float], str]] = {}
+    results = []
+    for from_currency, to_currency, amount_str in chunk:
+        pair = (from_currency.strip().upper(), to_currency.strip().upper())
+        resolved = pair_rates.get(pair)
+        if resolved is None:
+            resolved = pair_rates[pair] = _pair_rate(table, pair)
+        rate, error = resolved
+
+        if rate is None:
+            results.append((None, error))
+            continue
+        try:
+            result = float(amount_str) * rate
+        except ValueError:
+            result = math.nan
+        if math.isfinite(result):
+            results.append((result, ""))
+        else:
+            results.append((None, f"'{amount_str}' не является допустимым числом"))
+
+    if metrics.ENABLED:
+        _record_chunk(start, results)
+    return results
+
+
+def convert_chunk_exact(table: RateTable, chunk: List[Row],
+                        rules: Optional[Dict[str, RoundingRule]] = None) -> List[Tuple[Optional[str], str]]:
+    """
+    Точно конвертирует блок записей в целочисленной арифметике (см. money.py).
+    Результат — десятичная строка, округлённая по правилу целевой валюты.
+    """
+    start = time.perf_counter() if metrics.ENABLED else 0.0
+    converters: Dict[Tuple[str, str], Tuple[Optional[PairConverter], str]] = {}
+    results = []
+    for from_currency, to_currency, amount_str in chunk:
+        pair = (from_currency.strip().upper(), to_currency.strip().upper())
+        resolved = converters.get(pair)
+        if resolved is None:
+            rate, error = _pair_rate(table, pair)
+            converter = None if rate is None else PairConverter(rate, rule_for(pair[1], rules))
+            resolved = converters[pair] = (converter, error)
+        converter, error = resolved
+
+        if converter is None:
+            results.append((None, error))
+            continue
+        try:
+            results.append((converter.convert(amount_str), ""))
+        except ValueError:
+            results.append((None, f"'{amount_str}' не является допустимым числом"))
+
+    if metrics.ENABLED:
+        _record_chunk(start, results)
+    return results
+
+
+def format_results(chunk: List[Row], results: List[Tuple[Any, str]], fmt: str = "csv",
+                   exact: bool = False) -> str:
+    """
+    Форматирует блок записей с результатами: к каждой записи добавляются result и error
+    """
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(
+            (*row, "" if result is None else result if exact else f"{result:.4f}", error)
+            for row, (result, error) in zip(chunk, results)
+        )
+        return buffer.getvalue()
+
+    lines = []
+    for (from_currency, to_currency, amount_str), (result, error) in zip(chunk, results):
+        # Точный результат записывается строкой, чтобы не терять знаки при чтении JSON
+        record = {"from": from_currency, "to": to_currency, "amount": amount_str,
+                  "result": None if result is None else result if exact else round(result, 4)}
+        if error:
+            record["error"] = error
+        lines.append(json.dumps(record, ensure_ascii=False))
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def _is_header(row: Row) -> bool:
+    """
+    Заголовок CSV — строка с именами колонок from, to, amount. Строка с другими
+    именами считается заголовком, только если в ней нет кодов валют и числа суммы:
+    запись с ошибочной суммой остаётся записью (с ошибкой в результате).
+    """
+    if tuple(field.strip().lower() for field in row) == HEADER_COLUMNS:
+        return True
+    if any(len(code.strip()) == 3 and code.strip().isalpha() for code in row[:2]):
+        return False
+    try:
+        float(row[2])
+    except ValueError:
+        return True
+    return False
+
+
+def _split_header(chunk: List[Row]) -> Tuple[Optional[Row], List[Row]]:
+    """
+    Отделяет строку заголовка CSV (см. _is_header)
+    """
+    if chunk and _is_header(chunk[0]):
+        return chunk[0], chunk[1:]
+    return None, chunk
+
+
+def convert_batch(table: RateTable, input_stream: TextIO, output_stream: TextIO,
+                  fmt: str = "csv", chunk_size: int = CHUNK_SIZE, exact: bool = False,
+                  rules: Optional[Dict[str, RoundingRule]] = None) -> Tuple[int, int]:
+    """
+    Потоково конвертирует записи из input_stream и пишет результаты в output_stream.
+    В памяти одновременно находится не больше одного блока.
+    exact — точная конвертация с округлением по правилам валют (rules)
+    вместо вычислений с плавающей точкой.
+    Возвращает количество обработанных записей и количество ошибок.
+    """
+    total = 0
+    errors = 0
+    first_chunk = fmt == "csv"
+    for chunk in iter_chunks(read_rows(input_stream, fmt), chunk_size):
+        if first_chunk:
+            first_chunk = False
+            header, chunk = _split_header(chunk)
+            if header is not None:
+                csv.writer(output_stream, lineterminator="\n").writerow([*header, "result", "error"])
+        with profiling.phase("resolve"):
+            results = convert_chunk_exact(table, chunk, rules) if exact else convert_chunk(table, chunk)
+        with profiling.phase("format"):
+            output_stream.write(format_results(chunk, results, fmt, exact))
+        total += len(chunk)
+        errors += sum(1 for result, _ in results if result is None)
+    return total, errors
+
+
+class SharedRateTable:
+    """
+    Матрица кросс-курсов, опубликованная в разделяемой памяти.
+    Рабочие процессы читают курсы из общего блока, не разбирая файл курсов
+    и не получая таблицу через pickle.
+    """
+
+    def __init__(self, codes: Tuple[str, ...], matrix: memoryview):
+        self.codes = codes
+        self.index = shared_code_index(codes)
+        self.matrix = matrix
+
+    def __contains__(self, currency_code: str) -> bool:
+        return currency_code in self.index
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        rate = self.matrix[self.index[from_currency] * len(self.codes) + self.index[to_currency]]
+        if math.isnan(rate):
+            return None
+        return rate
+
+
+# Состояние рабочего процесса: разделяемая память, таблица и параметры конвертации
+_worker: Optional[Tuple[Any, SharedRateTable, str, bool,
+                        Optional[Dict[str, RoundingRule]]]] = None
+
+
+def _init_worker(memory_name: str, codes: Tuple[str, ...], fmt: str, exact: bool,
+                 rules: Optional[Dict[str, RoundingRule]]) -> None:
+    global _worker
+    from multiprocessing import shared_memory
+
+    memory = shared_memory.SharedMemory(name=memory_name)
+    matrix = memory.buf[:len(codes) ** 2 * 8].cast('d')
+    _worker = (memory, SharedRateTable(codes, matrix), fmt, exact, rules)
+
+
+def _convert_lines(lines: List[str]) -> Tuple[str, int, int]:
+    """
+    Разбирает, конвертирует и форматирует блок строк в рабочем процессе
+    """
+    _, table, fmt, exact, rules = _worker
+    chunk = list(read_rows(lines, fmt))
+    results = convert_chunk_exact(table, chunk, rules) if exact else convert_chunk(table, chunk)
+    errors = sum(1 for result, _ in results if result is None)
+    return format_results(chunk, results, fmt, exact), len(chunk), errors
+
+
+def iter_line_chunks(stream: TextIO, chunk_size: int = CHUNK_SIZE, fmt: str = "csv") -> Iterator[List[str]]:
+    """
+    Разбивает входной поток на блоки строк без разбора.
+    Запись CSV с переводом строки внутри кавычек не разрывается между блоками.
+    """
+    while True:
+        lines = list(islice(stream, chunk_size))
+        if not lines:
+            return
+        if fmt == "csv":
+            quotes = sum(line.count('"') for line in lines)
+            while quotes % 2:
+                line = next(stream, None)
+                if line is None:
+                    break
+                lines.append(line)
+                quotes += line.count('"')
+        yield lines
+
+
+def convert_batch_parallel(table: RateTable, input_stream: TextIO, output_stream: TextIO,
+                           fmt: str = "csv", chunk_size: int = CHUNK_SIZE, exact: bool = False,
+                           rules: Optional[Dict[str, RoundingRule]] = None,
+                           workers: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Пакетная конвертация в пуле процессов. Блоки строк разбираются и конвертируются
+    в рабочих процессах, матрица курсов публикуется один раз через shared_memory.
+    Результаты записываются в порядке входных данных; в работе одновременно
+    не больше двух блоков на процесс.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or not len(table):
+        return convert_batch(table, input_stream, output_stream, fmt, chunk_size, exact, rules)
+
+    # Пул процессов нужен только здесь, поэтому модули импортируются лениво
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    total = 0
+    errors = 0
+    if fmt == "csv":
+        # Заголовок обрабатывается здесь, чтобы рабочие процессы получали только записи
+        first_line = next(input_stream, "")
+        while first_line and not first_line.strip():
+            first_line = next(input_stream, "")
+        header, _ = _split_header(list(read_rows([first_line], fmt)))
+        if header is not None:
+            csv.writer(output_stream, lineterminator="\n").writerow([*header, "result", "error"])
+        elif first_line:
+            input_stream = chain([first_line], input_stream)
+
+    size = len(table.codes) ** 2 * 8
+    memory = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        memory.buf[:size] = memoryview(table.matrix).cast('B')
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(memory.name, table.codes, fmt, exact, rules)) as pool:
+            pending: Deque[Any] = deque()
+
+            def write_oldest() -> None:
+                nonlocal total, errors
+                # Рабочие процессы не профилируются: здесь видно только ожидание их результатов
+                with profiling.phase("workers"):
+                    text, count, failed = pending.popleft().result()
+                output_stream.write(text)
+                total += count
+                errors += failed
+
+            for lines in iter_line_chunks(input_stream, chunk_size, fmt):
+                pending.append(pool.submit(_convert_lines, lines))
+                if len(pending) >= workers * 2:
+                    write_oldest()
+            while pending:
+                write_oldest()
+    finally:
+        memory.close()
+        memory.unlink()
+    return total, errors
@@ -0,0 +1,496 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Коды, которые всегда есть в сгенерированных данных (основные валюты идут первыми)
+KNOWN_CODES = ("USD", "EUR", "GBP", "RUB", "JPY", "CHF", "CNY", "AED")
+
+# Загрузка снимка в отдельном процессе: время загрузки и пиковый RSS процесса
+COLD_LOAD_SCRIPT = """
+import json, resource, sys, time
+sys.path.insert(0, {here!r})
+import storage
+backend, path = sys.argv[1], sys.argv[2]
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if backend == "json":
+    data = storage.read_from_file(path)
+    rate = data["EUR"]["rates"]["JPY"]
+else:
+    snapshot = storage.read_binary(path)
+    rate = snapshot.rate("EUR", "JPY")
+elapsed = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"seconds": elapsed, "maxrss_kb": peak, "delta_rss_kb": peak - baseline}}))
+"""
+
+
+def bench_cold_load(json_path: str, repeat: int = 5) -> Dict[str, Any]:
+    """
+    Сравнивает холодную загрузку снимка из JSON и из бинарного формата (mmap)
+    """
+    import storage
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bin_path = os.path.join(tmp_dir, "currency_rate.bin")
+        with contextlib.redirect_stdout(sys.stderr):
+            storage.save_binary(storage.read_from_file(json_path), bin_path)
+        script = COLD_LOAD_SCRIPT.format(here=HERE)
+
+        for backend, path in (("json", json_path), ("binary", bin_path)):
+            runs = []
+            for _ in range(repeat):
+                output = subprocess.run([sys.executable, "-c", script, backend, path],
+                                        check=True, capture_output=True, text=True).stdout
+                runs.append(json.loads(output))
+            results[backend] = {
+                "file_bytes": os.path.getsize(path),
+                "seconds_min": min(run["seconds"] for run in runs),
+                "seconds_median": sorted(run["seconds"] for run in runs)[len(runs) // 2],
+                "maxrss_kb": max(run["maxrss_kb"] for run in runs),
+                "delta_rss_kb": max(run["delta_rss_kb"] for run in runs),
+            }
+    return results
+
+
+def generate_rates(n_bases: int, n_currencies: int, seed: int = 0,
+                   timestamp: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Генерирует данные в формате currency_rate.json: n_bases таблиц по n_currencies валют
+    """
+    rng = random.Random(seed)
+    codes = list(KNOWN_CODES)
+    for letters in itertools.product(string.ascii_uppercase, repeat=3):
+        if len(codes) >= n_currencies:
+            break
+        code = "".join(letters)
+        if code not in KNOWN_CODES:
+            codes.append(code)
+    codes = codes[:max(n_currencies, len(KNOWN_CODES))]
+
+    # Стоимость каждой валюты в единицах USD
+    values = {code: math.exp(rng.uniform(-5, 5)) for code in codes}
+    values["USD"] = 1.0
+    if timestamp is None:
+        timestamp = int(time.time())
+
+    data = {}
+    for base_code in codes[:n_bases]:
+        data[base_code] = {
+            "result": "success",
+            "provider": "https://www.exchangerate-api.com",
+            "documentation": "https://www.exchangerate-api.com/docs/free",
+            "terms_of_use": "https://www.exchangerate-api.com/terms",
+            "time_last_update_unix": timestamp,
+            "time_last_update_utc": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(timestamp)),
+            "time_next_update_unix": timestamp + 86400,
+            "time_next_update_utc": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(timestamp + 86400)),
+            "time_eol_unix": 0,
+            "base_code": base_code,
+            "rates": {code: round(values[base_code] / values[code], 6) for code in codes},
+        }
+    return data
+
+
+def measure(func: Callable[[], Any], repeat: int, number: int = 1) -> Dict[str, float]:
+    """
+    Запускает func number раз в каждом из repeat замеров; время — на один вызов
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    timings.sort()
+    return {"seconds_min": timings[0], "seconds_median": timings[len(timings) // 2]}
+
+
+def bench_load(json_path: str, shapes: List[Tuple[int, int]], repeat: int) -> Dict[str, Any]:
+    """
+    Время загрузки снимка (разбор JSON и построение таблицы кросс-курсов)
+    для реального файла и сгенерированных файлов N базовых валют x M валют
+    """
+    import storage
+    from snapshot import Snapshot
+
+    files = [("real", json_path)]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_bases, n_currencies in shapes:
+            path = os.path.join(tmp_dir, f"rates_{n_bases}x{n_currencies}.json")
+            with contextlib.redirect_stdout(io.StringIO()):
+                storage.save_to_file(generate_rates(n_bases, n_currencies), path)
+            files.append((f"{n_bases}x{n_currencies}", path))
+
+        for name, path in files:
+            bin_path = os.path.join(tmp_dir, f"{name}.bin")
+            data = storage.read_from_file(path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                storage.save_binary(data, bin_path)
+
+            def load_binary():
+                storage.read_binary(bin_path).close()
+
+            results[name] = {
+                "file_bytes": os.path.getsize(path),
+                "read_json": measure(lambda: storage.read_from_file(path), repeat),
+                "read_binary": measure(load_binary, repeat),
+                "snapshot": measure(lambda: Snapshot(storage.read_from_file(path)), repeat),
+            }
+    return results
+
+
+def bench_incremental(json_path: str, repeat: int, fractions: Tuple[float, ...] = (0.01, 0.05, 0.2)) -> Dict[str, Any]:
+    """
+    Обновление снимка по разнице с предыдущим (diff_snapshots и RateTable.updated)
+    против построения таблицы кросс-курсов заново, при изменении доли котировок
+    """
+    import random
+    import storage
+    from diff import diff_snapshots
+    from rates import RateTable
+
+    data = storage.read_from_file(json_path)
+    old = storage.RateData.from_dict(data)
+    table = RateTable(old)
+    rng = random.Random(0)
+    results = {}
+    for fraction in fractions:
+        changed = {base: dict(payload, rates={code: rate * 1.001 if code != base and rng.random() < fraction else rate
+                                              for code, rate in payload['rates'].items()})
+                   for base, payload in data.items()}
+        new = storage.RateData.from_dict(changed)
+        diff = diff_snapshots(old, new)
+        results[str(fraction)] = {
+            "changed_quotes": len(diff),
+            "diff": measure(lambda: diff_snapshots(old, new), repeat),
+            "incremental": measure(lambda: table.updated(new, diff_snapshots(old, new)), repeat),
+            "full": measure(lambda: RateTable(new), repeat),
+        }
+    return results
+
+
+def conversion_cases(data: Dict[str, Any]) -> Dict[str, Tuple[str, str]]:
+    """
+    Пары валют для каждой ветки бывшего convert_currency:
+    основная/неосновная валюта источника и назначения и одинаковые валюты
+    """
+    main = [code for code, payload in data.items() if 'rates' in payload]
+    others = sorted({code for code in data[main[0]]['rates'] if code not in data})
+    cases = {"same_currency": (main[0], main[0])}
+    if len(main) > 1:
+        cases["main_to_main"] = (main[0], main[1])
+    if others:
+        cases["main_to_other"] = (main[-1], others[0])
+        cases["other_to_main"] = (others[0], main[-1])
+    if len(others) > 1:
+        cases["other_to_other"] = (others[0], others[-1])
+    return cases
+
+
+def bench_convert(json_path: str, repeat: int, number: int = 100000) -> Dict[str, Any]:
+    """
+    Задержка конвертации одной пары через Converter для каждой ветки
+    """
+    import storage
+    from converter import Converter
+    from snapshot import Snapshot
+
+    data = storage.read_from_file(json_path)
+    converter = Converter(Snapshot(data))
+    results = {}
+    for name, (from_currency, to_currency) in conversion_cases(data).items():
+        results[name] = {"pair": f"{from_currency}/{to_currency}",
+                         **measure(lambda: converter.convert(from_currency, to_currency, 100.0), repeat, number)}
+    return results
+
+
+def bench_batch(json_path: str, rows: int, repeat: int) -> Dict[str, Any]:
+    """
+    Пропускная способность пакетной конвертации (CSV в памяти)
+    с плавающей точкой, в точном режиме и в пуле процессов по числу ядер
+    """
+    import storage
+    from batch import convert_batch, convert_batch_parallel
+    from rates import RateTable
+
+    data = storage.read_from_file(json_path)
+    table = RateTable(data)
+    rng = random.Random(0)
+    codes = table.codes
+    text = "".join(f"{rng.choice(codes)},{rng.choice(codes)},{rng.uniform(0, 10000):.2f}\n" for _ in range(rows))
+
+    timing = measure(lambda: convert_batch(table, io.StringIO(text), io.StringIO()), repeat)
+    exact = measure(lambda: convert_batch(table, io.StringIO(text), io.StringIO(), exact=True), repeat)
+    workers = os.cpu_count() or 1
+    parallel = measure(lambda: convert_batch_parallel(table, io.StringIO(text), io.StringIO(), workers=workers),
+                       repeat)
+    return {
+        "rows": rows,
+        **timing,
+        "rows_per_second": rows / timing["seconds_min"],
+        "exact": {**exact, "rows_per_second": rows / exact["seconds_min"]},
+        "parallel": {"workers": workers, **parallel, "rows_per_second": rows / parallel["seconds_min"]},
+    }
+
+
+class FakeProvider:
+    """
+    Локальный HTTP-сервер, отвечающий как open.er-api.com
+    (/v6/latest/<код>) с настраиваемой задержкой. Поддерживает keep-alive
+    и условные запросы (ETag → 304); failures — сколько первых запросов
+    каждой валюты получают 503 (для проверки повторов), headers — дополнительные
+    заголовки ответов 200 и 304 (например, Cache-Control).
+    """
+
+    def __init__(self, data: Dict[str, Any], latency: float = 0.0, failures: int = 0,
+                 headers: Optional[Dict[str, str]] = None):
+        self.data = data
+        self.latency = latency
+        self.failures = failures
+        self.headers = headers or {}
+        self.requests = 0
+        self.not_modified = 0
+        # Адреса клиентов: по одному на TCP-соединение
+        self.connections = set()
+        self._failed: Dict[str, int] = {}
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                provider.requests += 1
+                provider.connections.add(self.client_address)
+                time.sleep(provider.latency)
+                code = self.path.rstrip("/").rsplit("/", 1)[-1].upper()
+                payload = provider.data.get(code)
+                etag = None
+                if provider._failed.get(code, 0) < provider.failures:
+                    provider._failed[code] = provider._failed.get(code, 0) + 1
+                    body = b"{}"
+                    self.send_response(503)
+                elif payload is None:
+                    body = json.dumps({"result": "error", "error-type": "unsupported-code"}).encode()
+                    self.send_response(404)
+                else:
+                    body = json.dumps(payload).encode()
+                    etag = f'"{zlib.crc32(body):08x}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        provider.not_modified += 1
+                        body = b""
+                        self.send_response(304)
+                    else:
+                        self.send_response(200)
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                    for name, value in provider.headers.items():
+                        self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/v6/latest/{{code}}"
+
+    def __enter__(self) -> "FakeProvider":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def bench_refresh(latency: float, repeat: int, n_bases: int = 4) -> Dict[str, Any]:
+    """
+    Время обновления курсов через api_client против локального фейкового провайдера
+    """
+    try:
+        import api_client
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    data = generate_rates(n_bases, 166)
+    currencies = list(data)
+    results = {"latency": latency, "bases": n_bases}
+    with FakeProvider(data, latency) as provider, tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "currency_rate.json")
+        modes = {
+            "concurrent": dict(currencies=currencies),
+            "single_fetch": dict(currencies=currencies, single_fetch=True),
+        }
+        for name, kwargs in modes.items():
+            provider.requests = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                timing = measure(lambda: api_client.update_currency_rates(
+                    path, base_url=provider.url, history_dir=None, **kwargs), repeat)
+            results[name] = {**timing, "requests_per_refresh": provider.requests / repeat}
+
+        # Основной источник в 10 раз медленнее резервного: запрос дублируется через 2 × latency
+        import providers
+        with FakeProvider(data, latency * 10) as slow:
+            pool = providers.ProviderPool([providers.ErApiProvider(slow.url, "slow"),
+                                           providers.ErApiProvider(provider.url, "fast")],
+                                          hedge_after=latency * 2)
+            with contextlib.redirect_stdout(io.StringIO()):
+                # Первое обновление — до накопления статистики, остальные — в порядке по задержке
+                first = measure(lambda: api_client.update_currency_rates(
+                    path, currencies=currencies, history_dir=None, pool=pool), 1)
+                timing = measure(lambda: api_client.update_currency_rates(
+                    path, currencies=currencies, history_dir=None, pool=pool), repeat)
+            results["hedged"] = {**timing, "first_refresh_seconds": first["seconds_min"],
+                                 "order": [p.name for p in pool.ordered()]}
+    return results
+
+
+# Бюджет импорта модулей при запуске одной команды cli.py, в миллисекундах
+STARTUP_BUDGET_MS = 15
+STARTUP_COMMANDS = (("convert", "USD", "EUR", "100"), ("info", "EUR"), ("list",))
+
+
+def parse_importtime(stderr: str) -> Tuple[Dict[str, float], List[str]]:
+    """
+    Разбирает вывод -X importtime: модули верхнего уровня с накопленным временем (мс)
+    и имена всех импортированных модулей
+    """
+    imports = {}
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.append(name.strip())
+        if not name.startswith("  "):
+            imports[name.strip()] = int(cumulative) / 1000
+    return imports, modules
+
+
+def bench_startup(repeat: int) -> Dict[str, Any]:
+    """
+    Время запуска разовых команд cli.py со свежими курсами: время процесса
+    и время импорта модулей сверх пустого интерпретатора (-X importtime)
+    """
+    env = dict(os.environ)
+    # Байткод должен кэшироваться, как при обычной установке
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    cli_path = os.path.join(HERE, "cli.py")
+
+    def run(args: List[str], cwd: str) -> Tuple[float, Dict[str, float], List[str]]:
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=cwd, env=env,
+                                 check=True, capture_output=True, text=True)
+        return (time.perf_counter() - start, *parse_importtime(process.stderr))
+
+    results = {"budget_ms": STARTUP_BUDGET_MS}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with open(os.path.join(tmp_dir, "currency_rate.json"), "w", encoding="utf-8") as file:
+            json.dump(generate_rates(4, 166), file)
+        _, baseline, _ = run(["-c", "pass"], tmp_dir)
+
+        for command in STARTUP_COMMANDS:
+            run([cli_path, *command], tmp_dir)  # прогрев кэша байткода
+            walls, import_times, imports, modules = [], [], {}, []
+            for _ in range(repeat):
+                wall, imports, modules = run([cli_path, *command], tmp_dir)
+                imports = {name: ms for name, ms in imports.items() if name not in baseline}
+                walls.append(wall)
+                import_times.append(sum(imports.values()))
+            import_ms = min(import_times)
+            results[" ".join(command)] = {
+                "wall_seconds_min": min(walls),
+                "import_ms_min": import_ms,
+                "within_budget": import_ms <= STARTUP_BUDGET_MS,
+                "requests_imported": "requests" in modules,
+                "heaviest": dict(sorted(imports.items(), key=lambda item: -item[1])[:5]),
+            }
+    return results
+
+
+BENCHMARKS = ("cold_load", "load", "incremental", "convert", "batch", "refresh", "startup")
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки конвертера валют")
+    parser.add_argument("--rates", default=os.path.join(HERE, "currency_rate.json"),
+                        help="Файл с курсами для замеров")
+    parser.add_argument("--only", help=f"Через запятую: {', '.join(BENCHMARKS)} (по умолчанию все)")
+    parser.add_argument("--repeat", type=int, default=5, help="Количество повторов")
+    parser.add_argument("--shapes", default="4x166,32x166,166x166",
+                        help="Размеры сгенерированных файлов: базовые x валюты через запятую")
+    parser.add_argument("--rows", type=int, default=200000, help="Количество записей для пакетного замера")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Задержка фейкового провайдера в секундах")
+    parser.add_argument("--bases", type=int, default=4, help="Количество базовых валют при обновлении")
+    parser.add_argument("-o", "--output", help="Файл для результатов в JSON (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    selected = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"неизвестные бенчмарки: {', '.join(unknown)}")
+    shapes = [tuple(int(part) for part in shape.split("x")) for shape in args.shapes.split(",") if shape]
+
+    sys.path.insert(0, HERE)
+    results = {
+        "meta": {
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rates": args.rates,
+            "repeat": args.repeat,
+        },
+    }
+    if "cold_load" in selected:
+        results["cold_load"] = bench_cold_load(args.rates, args.repeat)
+    if "load" in selected:
+        results["load"] = bench_load(args.rates, shapes, args.repeat)
+    if "incremental" in selected:
+        results["incremental"] = bench_incremental(args.rates, args.repeat)
+    if "convert" in selected:
+        results["convert"] = bench_convert(args.rates, args.repeat)
+    if "batch" in selected:
+        results["batch"] = bench_batch(args.rates, args.rows, args.repeat)
+    if "refresh" in selected:
+        results["refresh"] = bench_refresh(args.latency, args.repeat, args.bases)
+    if "startup" in selected:
+        results["startup"] = bench_startup(args.repeat)
+
+    text = json.dumps(results, indent=4, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import json
+import math
+import os
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from storage import RateData, atomic_write
+
+
+# Длина префиксов в индексе подсказок; код валюты целиком (3 символа) проверяется по списку кодов
+PREFIX_LENGTH = 2
+SUGGESTION_LIMIT = 10
+CATALOG_VERSION = 1
+
+
+class CurrencyCatalog:
+    """
+    Справочник валют снимка, построенный один раз: отсортированные коды,
+    таблицы, в которых котируется каждая валюта, и индекс префиксов для подсказок
+    при неверно введённом коде
+    """
+
+    __slots__ = ("codes", "tables", "prefixes")
+
+    def __init__(self, codes: Iterable[str], tables: Dict[str, Tuple[str, ...]],
+                 prefixes: Optional[Dict[str, Tuple[str, ...]]] = None):
+        self.codes: Tuple[str, ...] = tuple(codes)
+        # код -> базовые валюты таблиц, где он есть (сама валюта первой, если у неё есть таблица)
+        self.tables = tables
+        if prefixes is None:
+            index: Dict[str, List[str]] = {}
+            for code in self.codes:
+                for length in range(1, PREFIX_LENGTH + 1):
+                    index.setdefault(code[:length], []).append(code)
+            prefixes = {prefix: tuple(codes) for prefix, codes in index.items()}
+        self.prefixes = prefixes
+
+    @classmethod
+    def from_data(cls, data: RateData) -> "CurrencyCatalog":
+        containing: Dict[str, List[str]] = {code: [] for code in data.codes}
+        for base in data.tables:
+            containing[base].append(base)
+        for base, table in data.tables.items():
+            for code, rate in zip(table.codes, table.rates):
+                if code != base and not math.isnan(rate):
+                    containing[code].append(base)
+        return cls(data.codes, {code: tuple(bases) for code, bases in containing.items()})
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __contains__(self, currency_code: str) -> bool:
+        return currency_code in self.tables
+
+    def containing(self, currency_code: str) -> Tuple[str, ...]:
+        """
+        Базовые валюты таблиц, содержащих валюту
+        """
+        return self.tables.get(currency_code, ())
+
+    def suggest(self, text: str, limit: int = SUGGESTION_LIMIT) -> List[str]:
+        """
+        Коды, похожие на введённый: с самым длинным совпадающим префиксом
+        """
+        query = text.strip().upper()
+        for length in range(min(len(query), PREFIX_LENGTH), 0, -1):
+            matches = self.prefixes.get(query[:length])
+            if not matches:
+                continue
+            if len(query) > length:
+                longer = [code for code in matches if code.startswith(query)]
+                if longer:
+                    return longer[:limit]
+            return list(matches[:limit])
+        return []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "codes": list(self.codes),
+            "tables": {code: list(bases) for code, bases in self.tables.items()},
+            "prefixes": {prefix: list(codes) for prefix, codes in self.prefixes.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CurrencyCatalog":
+        return cls(data["codes"], {code: tuple(bases) for code, bases in data["tables"].items()},
+                   {prefix: tuple(codes) for prefix, codes in data["prefixes"].items()})
+
+
+def catalog_path(file_path: str) -> str:
+    """
+    Файл справочника рядом с файлом курсов: currency_rate.json -> currency_rate.catalog.json
+    """
+    root, _ = os.path.splitext(file_path)
+    return root + ".catalog.json"
+
+
+def save_catalog(catalog: CurrencyCatalog, file_path: str, key: Tuple[int, int]) -> bool:
+    """
+    Сохраняет справочник для файла курсов file_path. key — (mtime_ns, размер) файла курсов,
+    по которому был построен справочник. Запись атомарная; ошибки записи не критичны.
+    """
+    payload = {"version": CATALOG_VERSION, "source": list(key), **catalog.to_dict()}
+    try:
+        with atomic_write(catalog_path(file_path), sync=False) as file:
+            json.dump(payload, file, ensure_ascii=False, separators=(",", ":"))
+        return True
+    except OSError:
+        return False
+
+
+def load_catalog(file_path: str, key: Tuple[int, int]) -> Optional[CurrencyCatalog]:
+    """
+    Читает сохранённый справочник, если он построен по текущей версии файла курсов (key)
+    """
+    try:
+        with open(catalog_path(file_path), "r", encoding="utf-8") as file:
+            payload = json.load(file)
+        if payload.get("version") != CATALOG_VERSION or tuple(payload.get("source", ())) != tuple(key):
+            return None
+        return CurrencyCatalog.from_dict(payload)
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
@@ -1,412 +1,127 @@
 import argparse
-import json
+import contextlib
 import sys
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-
-import os
-from datetime import datetime, timedelta
+import profiling
+from converter import (Converter, ConverterError, ConversionPathError, CurrencyInfo, CurrencyNotFoundError,
+                       historical_rate)
+from snapshot import get_cache, load_snapshot, wait_for_refreshes
 
 
 def load_currency_data() -> Dict[str, Any]:
     """
-    Загружает данные о валютах из файла currency_rate.json
-    Если файл есть и моложе 24 часов — читает из файла, иначе — обновляет.
+    Загружает данные о валютах из файла currency_rate.json.
+    Команды CLI её больше не используют (они работают со снимком через load_snapshot);
+    оставлена для совместимости с внешними скриптами.
     """
-    file_path = "currency_rate.json"
-    
-    # Проверяем, существует ли файл и моложе ли он 24 часов
-    from storage import is_file_fresh, read_from_file
-    if is_file_fresh(file_path):
-        # Читаем из файла
-        try:
-            return read_from_file()
-        except json.JSONDecodeError:
-            print("Ошибка: файл currency_rate.json содержит некорректные данные.")
-            print("Файл будет обновлен.")
-        except FileNotFoundError:
-            print("Файл currency_rate.json не найден. Обновляем данные...")
+    return load_snapshot().data.to_dict()
+
+
+def print_error(error: ConverterError) -> None:
+    """
+    Выводит ошибку конвертера; для недоступной валюты — со списком доступных
+    """
+    if isinstance(error, CurrencyNotFoundError):
+        print(f"Валюта {error.currency_code} недоступна.")
+        if error.suggestions:
+            print(f"Возможно, вы имели в виду: {', '.join(error.suggestions)}")
+        print(f"Доступные валюты: {', '.join(error.available)}")
+    elif isinstance(error, ConversionPathError):
+        print(error)
     else:
-        print("Файл currency_rate.json старше 24 часов. Обновляем данные...")
-    
-    # Обновляем данные
-    try:
-        from api_client import update_currency_rates
-        update_currency_rates()
-        
-        # После обновления читаем файл
-        return read_from_file()
-    except ImportError:
-        print("Ошибка: не удалось импортировать функции обновления курсов валют из api_client.py")
-        print("Пожалуйста, убедитесь, что все необходимые модули установлены.")
-        return {}
-    except Exception as e:
-        print(f"Ошибка при обновлении данных: {str(e)}")
-        print("Пожалуйста, проверьте подключение к интернету и повторите попытку.")
-        return {}
+        print(f"Ошибка: {error}")
 
 
-def get_currency_info(currency_code: str) -> None:
+def get_currency_info(currency_code: str) -> bool:
     """
     Показывает информацию о конкретной валюте
     """
-    data = load_currency_data()
-    
-    # Валидация кода валюты
-    all_currencies = set()
-    for curr in data.keys():
-        all_currencies.add(curr)
-        if 'rates' in data[curr]:
-            for rate_curr in data[curr]['rates'].keys():
-                all_currencies.add(rate_curr)
-    
-    currency_code_upper = currency_code.upper()
-    if currency_code_upper not in all_currencies:
-        print(f"Валюта {currency_code} недоступна.")
-        print(f"Доступные валюты: {', '.join(sorted(list(all_currencies)))}")
-        return
-    
-    # Проверяем, есть ли валюта в основных или в доступных
-    found = False
-    currency_data = None
-    is_main_currency = False
-    
-    # Сначала проверяем основные валюты
-    if currency_code_upper in data:
-        currency_data = data[currency_code_upper]
-        is_main_currency = True
-        found = True
-    else:
-        # Ищем валюту среди всех доступных валют
-        for main_curr in data:
-            if 'rates' in data[main_curr] and currency_code_upper in data[main_curr]['rates']:
-                # Создаем "виртуальную" информацию о валюте
-                # Для этого находим основную валюту, в которой представлена целевая валюта
-                currency_data = data[main_curr]
-                is_main_currency = False
-                found = True
-                break
-    
-    if not found:
-        print(f"Валюта {currency_code} недоступна.")
-        print(f"Доступные валюты: {', '.join(sorted(list(all_currencies)))}")
-        return
+    try:
+        with profiling.phase("load"):
+            converter = Converter.load()
+        with profiling.phase("resolve"):
+            info = converter.currency_info(currency_code)
+    except ConverterError as e:
+        print_error(e)
+        return False
     
-    print(f"Информация о валюте {currency_code_upper}:")
+    with profiling.phase("format"):
+        print_currency_info(info)
+    return True
+
+
+def print_currency_info(info: CurrencyInfo) -> None:
+    print(f"Информация о валюте {info.code}:")
     print("-" * 50)
-    
-    if is_main_currency:
-        print(f"Код: {currency_code_upper}")
-        print(f"Базовая валюта: {currency_data['base_code']}")
-        print(f"Провайдер: {currency_data['provider']}")
-        print(f"Последнее обновление: {currency_data['time_last_update_utc']}")
-        print(f"Следующее обновление: {currency_data['time_next_update_utc']}")
-        
-        # Показываем курсы базовых валют к выбранной валюте
-        rates = currency_data['rates']
-        print("\nКотировки базовых валют к выбранной валюте:")
-        
-        # Базовые валюты, которые мы хотим отобразить
-        base_currencies = ["USD", "EUR", "GBP", "RUB"]
-        
-        for base_curr in base_currencies:
-            if base_curr in rates:
-                rate = rates[base_curr]
-                print(f" 1 {base_curr} = {rate} {currency_code_upper}")
-            else:
-                # Если напрямую нет курса, вычисляем через базовую валюту
-                base_code = currency_data['base_code']
-                if base_code in rates and base_curr in data:
-                    # Получаем курс базовой валюты к целевой валюте
-                    base_to_target = rates[base_code]
-                    # Получаем курс базовой валюты к базе базовой валюты
-                    base_curr_rates = data[base_curr]['rates']
-                    base_curr_to_base = base_curr_rates[base_code]
-                    
-                    # Рассчитываем курс: base_curr к target
-                    rate = base_to_target / base_curr_to_base
-                    print(f"  1 {base_curr} = {rate} {currency_code_upper}")
-    else:
-        print(f"Код: {currency_code_upper}")
+    print(f"Код: {info.code}")
+    if not info.is_main:
         print("Информация о валюте доступна в качестве целевой валюты")
-        print(f"Базовая валюта: {currency_data['base_code']}")
-        print(f"Провайдер: {currency_data['provider']}")
-        print(f"Последнее обновление: {currency_data['time_last_update_utc']}")
-        print(f"Следующее обновление: {currency_data['time_next_update_utc']}")
-        
-        # Показываем курсы базовых валют к выбранной валюте
-        rates = currency_data['rates']
-        print(f"\nКотировки базовых валют к {currency_code_upper}:")
-        
-        # Базовые валюты, которые мы хотим отобразить
-        base_currencies = ["USD", "EUR", "GBP", "RUB"]
-        
-        for base_curr in base_currencies:
-            if currency_code_upper in rates and base_curr in rates:
-                # Прямой курс базовой валюты к целевой
-                base_to_target_rate = rates[currency_code_upper]
-                base_to_base_curr_rate = rates[base_curr]
-                # Рассчитываем курс: 1 base_curr = X currency_code_upper
-                rate = base_to_base_curr_rate / base_to_target_rate
-                print(f"  1 {base_curr} = {rate} {currency_code_upper}")
-            elif base_curr == currency_code_upper:
-                print(f"  1 {base_curr} = 1.0 {currency_code_upper}")
-            else:
-                # Пытаемся вычислить через базовую валюту
-                base_code = currency_data['base_code']
-                if base_curr in data and currency_code_upper in data and currency_code_upper in data[base_code]['rates']:
-                    # Получаем курс базовой валюты к целевой валюте
-                    base_to_target = 1 / data[base_code]['rates'][currency_code_upper]
-                    # Получаем курс базовой валюты к базе базовой валюты
-                    if base_curr in data and base_code in data[base_curr]['rates']:
-                        base_curr_to_base = data[base_curr]['rates'][base_code]
-                        # Рассчитываем курс: base_curr к target
-                        rate = base_curr_to_base * base_to_target
-                        print(f"  1 {base_curr} = {rate} {currency_code_upper}")
-                    elif base_curr == base_code:
-                        print(f"  1 {base_curr} = {base_to_target} {currency_code_upper}")
-                elif currency_code_upper in data and base_curr in data[base_code]['rates'] and currency_code_upper in data[base_curr]['rates']:
-                    # Пытаемся использовать обе валюты через их отношения к базовой валюте
-                    base_to_base_curr_rate = data[base_code]['rates'][base_curr]
-                    base_to_target_rate = data[base_code]['rates'][currency_code_upper]
-                    rate = base_to_base_curr_rate / base_to_target_rate
-                    print(f"  1 {base_curr} = {rate} {currency_code_upper}")
-
-
-def list_currencies() -> None:
+    print(f"Базовая валюта: {info.base_code}")
+    print(f"Провайдер: {info.provider}")
+    print(f"Последнее обновление: {info.time_last_update_utc}")
+    print(f"Следующее обновление: {info.time_next_update_utc}")
+    
+    # Показываем курсы базовых валют к выбранной валюте
+    print(f"\nКотировки базовых валют к {info.code}:")
+    for base_curr, rate in info.quotes.items():
+        print(f"  1 {base_curr} = {rate} {info.code}")
+
+
+def list_currencies() -> bool:
     """
     Показывает список доступных валют
     """
-    data = load_currency_data()
+    with profiling.phase("load"):
+        currencies = Converter.load().currencies
     
-    # Собираем все уникальные валюты из всех источников
-    all_currencies = set()
+    with profiling.phase("format"):
+        print("Доступные валюты:")
+        print("-" * 50)
+        for currency in currencies:
+            print(f"{currency}")
     
-    # Добавляем основные валюты (ключи словаря)
-    for currency in data.keys():
-        all_currencies.add(currency)
-        
-        # Добавляем все валюты из rates
-        currency_data = data[currency]
-        if 'rates' in currency_data:
-            for rate_currency in currency_data['rates'].keys():
-                all_currencies.add(rate_currency)
-    
-    print("Доступные валюты:")
-    print("-" * 50)
-    sorted_currencies = sorted(list(all_currencies))
-    for currency in sorted_currencies:
-        print(f"{currency}")
-    
-    print(f"\nВсего валют: {len(sorted_currencies)}")
+        print(f"\nВсего валют: {len(currencies)}")
+    return bool(currencies)
 
 
-def convert_currency(from_currency: str, to_currency: str, amount: float) -> None:
+def convert_currency(from_currency: str, to_currency: str, amount: float, as_of=None) -> bool:
     """
-    Конвертирует сумму из одной валюты в другую
+    Конвертирует сумму из одной валюты в другую.
+    as_of (дата ГГГГ-ММ-ДД, datetime или unix-время) — конвертация по курсам
+    из истории на указанный момент.
     """
-    data = load_currency_data()
-    
     from_currency = from_currency.upper()
     to_currency = to_currency.upper()
     
-    # Валидация кодов валют
-    all_currencies = set()
-    for curr in data.keys():
-        all_currencies.add(curr)
-        if 'rates' in data[curr]:
-            for rate_curr in data[curr]['rates'].keys():
-                all_currencies.add(rate_curr)
-    
-    if from_currency not in all_currencies:
-        print(f"Валюта {from_currency} недоступна.")
-        print(f"Доступные валюты: {', '.join(sorted(list(all_currencies)))}")
-        return
-    
-    if to_currency not in all_currencies:
-        print(f"Валюта {to_currency} недоступна.")
-        print(f"Доступные валюты: {', '.join(sorted(list(all_currencies)))}")
-        return
-    
-    if from_currency == to_currency:
-        print(f"{amount} {from_currency} = {amount:.4f} {to_currency}")
-        return
-    
-    # Проверяем, является ли from_currency основной валютой
-    if from_currency in data:
-        rates_data_from = data[from_currency]
-        base_code_from = rates_data_from['base_code']
-        from_rates = rates_data_from['rates']
-        
-        # Проверяем, является ли to_currency основной валютой
-        if to_currency in data:
-            rates_data_to = data[to_currency]
-            base_code_to = rates_data_to['base_code']
-            to_rates = rates_data_to['rates']
-            
-            # Если прямой курс доступен
-            if to_currency in from_rates:
-                rate = from_rates[to_currency]
-                result = amount * rate
-                print(f"{amount} {from_currency} = {result:.4f} {to_currency}")
-                return
-            
-            # Проверяем, можно ли получить курс через базовую валюту
-            # Если обе валюты имеют общий базовый код
-            if base_code_from == base_code_to:
-                # Конвертируем через общую базовую валюту
-                # 1. Сначала конвертируем from_currency в базовую валюту
-                if from_currency == base_code_from:
-                    base_amount = amount
-                else:
-                    # from_currency к базовой валюте
-                    base_amount = amount / from_rates[from_currency]
-                
-                # 2. Затем конвертируем базовую валюту в to_currency
-                if to_currency == base_code_to:
-                    result = base_amount
-                else:
-                    # базовая валюта к to_currency
-                    result = base_amount * to_rates[to_currency]
-                    
-                print(f"{amount} {from_currency} = {result:.4f} {to_currency}")
-                return
-            
-            # Если базовые валюты разные, нужно использовать обе для пересчета
-            # 1. Конвертируем from_currency в его базовую валюту
-            if from_currency == base_code_from:
-                base_amount = amount
-            else:
-                base_amount = amount / from_rates[from_currency]
-            
-            # 2. Конвертируем базовую валюту from в базовую валюту to
-            # Для этого нужно знать курс base_code_from к base_code_to
-            if base_code_from == rates_data_to['base_code']:
-                # base_code_from к base_code_to уже есть
-                intermediate_amount = base_amount * to_rates[base_code_from]
-            elif base_code_to == rates_data_from['base_code']:
-                # base_code_to к base_code_from уже есть, обращаем курс
-                intermediate_amount = base_amount / from_rates[base_code_to]
-            else:
-                # Обе базовые валюты разные, используем третью валюту как промежуточную
-                # Используем USD как промежуточную валюту, если она есть
-                if 'USD' in from_rates and 'USD' in to_rates:
-                    usd_amount = base_amount * from_rates['USD']
-                    result = usd_amount / to_rates['USD']
-                    print(f"{amount} {from_currency} = {result:.4f} {to_currency}")
-                    return
-                else:
-                    # Используем другую промежуточную валюту, доступную в обеих таблицах
-                    common_currencies = set(from_rates.keys()) & set(to_rates.keys())
-                    if common_currencies:
-                        intermediate_curr = list(common_currencies)[0]
-                        intermediate_amount = base_amount * from_rates[intermediate_curr]
-                        result = intermediate_amount / to_rates[intermediate_curr]
-                        print(f"{amount} {from_currency} = {result:.4f} {to_currency}")
-                        return
-                    else:
-                        print(f"Не удалось найти путь для конвертации {from_currency} в {to_currency}")
-                        return
-            
-            # 3. Конвертируем базовую валюту to в целевую валюту
-            if to_currency == base_code_to:
-                final_result = intermediate_amount
-            else:
-                final_result = intermediate_amount * to_rates[to_currency]
-            
-            print(f"{amount} {from_currency} = {final_result:.4f} {to_currency}")
-            return
+    try:
+        if as_of is None:
+            with profiling.phase("load"):
+                converter = Converter.load()
+            with profiling.phase("validate"):
+                converter.validate(from_currency)
+                converter.validate(to_currency)
+            with profiling.phase("resolve"):
+                result = converter.convert(from_currency, to_currency, amount)
         else:
-            # to_currency не является основной валютой, но доступна в rates
-            # Ищем основную валюту, в которой представлена to_currency
-            base_curr_data = None
-            for main_curr in data:
-                if 'rates' in data[main_curr] and to_currency in data[main_curr]['rates']:
-                    base_curr_data = data[main_curr]
-                    break
-            
-            if base_curr_data is None:
-                print(f"Не удалось найти путь для конвертации {from_currency} в {to_currency}")
-                return
-            
-            # Сначала конвертируем from_currency в базовую валюту base_curr_data
-            if from_currency == base_curr_data['base_code']:
-                base_amount = amount
-            elif from_currency in from_rates:
-                base_amount = amount / from_rates[from_currency]
-            else:
-                print(f"Не удалось найти путь для конвертации {from_currency} в {to_currency}")
-                return
-            
-            # Затем конвертируем из базовой валюты в to_currency
-            if to_currency in base_curr_data['rates']:
-                result = base_amount * base_curr_data['rates'][to_currency]
-                print(f"{amount} {from_currency} = {result:.4f} {to_currency}")
-                return
-            else:
-                print(f"Не удалось найти путь для конвертации {from_currency} в {to_currency}")
-                return
-    else:
-        # from_currency не является основной валютой, но доступна в rates
-        # Ищем основную валюту, в которой представлена from_currency
-        base_curr_data_from = None
-        for main_curr in data:
-            if 'rates' in data[main_curr] and from_currency in data[main_curr]['rates']:
-                base_curr_data_from = data[main_curr]
-                break
-        
-        if base_curr_data_from is None:
-            print(f"Не удалось найти путь для конвертации {from_currency} в {to_currency}")
-            return
-        
-        # Конвертируем from_currency в базовую валюту
-        base_rate_from = base_curr_data_from['rates'][from_currency]
-        base_amount = amount / base_rate_from
-        
-        # Теперь конвертируем базовую валюту в to_currency
-        if to_currency in data:
-            # to_currency - основная валюта
-            to_rates = data[to_currency]['rates']
-            if base_curr_data_from['base_code'] in to_rates:
-                result = base_amount * to_rates[base_curr_data_from['base_code']]
-                print(f"{amount} {from_currency} = {result:.4f} {to_currency}")
-                return
-            else:
-                print(f"Не удалось найти путь для конвертации {from_currency} в {to_currency}")
-                return
+            with profiling.phase("resolve"):
+                result = amount * historical_rate(from_currency, to_currency, as_of)
+    except ConverterError as e:
+        print_error(e)
+        return False
+    except ValueError as e:
+        print(f"Ошибка: {e}")
+        return False
+    
+    with profiling.phase("format"):
+        if as_of is None:
+            print(f"{amount} {from_currency} = {result:.4f} {to_currency}")
         else:
-            # to_currency тоже не основная валюта
-            base_curr_data_to = None
-            for main_curr in data:
-                if 'rates' in data[main_curr] and to_currency in data[main_curr]['rates']:
-                    base_curr_data_to = data[main_curr]
-                    break
-            
-            if base_curr_data_to is None:
-                print(f"Не удалось найти путь для конвертации {from_currency} в {to_currency}")
-                return
-            
-            # Конвертируем базовую валюту из from в базовую валюту to
-            if base_curr_data_from['base_code'] == base_curr_data_to['base_code']:
-                # Та же базовая валюта
-                if to_currency in base_curr_data_to['rates']:
-                    result = base_amount * base_curr_data_to['rates'][to_currency]
-                    print(f"{amount} {from_currency} = {result:.4f} {to_currency}")
-                    return
-            else:
-                # Разные базовые валюты, используем промежуточную валюту
-                if base_curr_data_to['base_code'] in base_curr_data_from['rates']:
-                    intermediate_amount = base_amount * base_curr_data_from['rates'][base_curr_data_to['base_code']]
-                    if to_currency in base_curr_data_to['rates']:
-                        result = intermediate_amount * base_curr_data_to['rates'][to_currency]
-                        print(f"{amount} {from_currency} = {result:.4f} {to_currency}")
-                        return
-                else:
-                    print(f"Не удалось найти путь для конвертации {from_currency} в {to_currency}")
-                    return
+            print(f"{amount} {from_currency} = {result:.4f} {to_currency} (по курсу на {as_of})")
+    return True
 
 
-def update_currency_rates():
+def update_currency_rates(pool=None, diff_file: Optional[str] = None) -> bool:
     """
     Обновляет курсы валют, вызывая функцию из api_client.py
     """
@@ -414,14 +129,19 @@ def update_currency_rates():
         # Импортируем функцию обновления курсов валют
         from api_client import update_currency_rates
         print("Обновление курсов валют...")
-        update_currency_rates()
+        if update_currency_rates(pool=pool, diff_file=diff_file) is None:
+            # Ни одна таблица не получена — сообщение об ошибке уже выведено
+            return False
+        get_cache().invalidate()
         print("Курсы валют успешно обновлены!")
+        return True
     except ImportError:
         print("Ошибка: не удалось импортировать функцию обновления курсов валют из api_client.py")
         print("Пожалуйста, убедитесь, что все необходимые модули установлены.")
     except Exception as e:
         print(f"Ошибка при обновлении курсов валют: {str(e)}")
         print("Пожалуйста, проверьте подключение к интернету и повторите попытку.")
+    return False
 
 
 def interactive_menu():
@@ -447,21 +167,7 @@ def interactive_menu():
         elif choice == "1":
             currency = input("Введите код валюты (например, USD): ").strip()
             if currency:
-                # Валидация кода валюты
-                data = load_currency_data()
-                all_currencies = set()
-                for curr in data.keys():
-                    all_currencies.add(curr)
-                    if 'rates' in data[curr]:
-                        for rate_curr in data[curr]['rates'].keys():
-                            all_currencies.add(rate_curr)
-                
-                currency_upper = currency.upper()
-                if currency_upper not in all_currencies:
-                    print(f"Валюта {currency} недоступна.")
-                    print(f"Доступные валюты: {', '.join(sorted(list(all_currencies)))}")
-                else:
-                    get_currency_info(currency)
+                get_currency_info(currency)
             else:
                 print("Код валюты не может быть пустым!")
         elif choice == "2":
@@ -474,28 +180,10 @@ def interactive_menu():
             if from_curr and to_curr and amount_str:
                 try:
                     amount = float(amount_str)
-                    # Валидация кодов валют
-                    data = load_currency_data()
-                    all_currencies = set()
-                    for curr in data.keys():
-                        all_currencies.add(curr)
-                        if 'rates' in data[curr]:
-                            for rate_curr in data[curr]['rates'].keys():
-                                all_currencies.add(rate_curr)
-                    
-                    from_curr_upper = from_curr.upper()
-                    to_curr_upper = to_curr.upper()
-                    
-                    if from_curr_upper not in all_currencies:
-                        print(f"Валюта {from_curr} недоступна.")
-                        print(f"Доступные валюты: {', '.join(sorted(list(all_currencies)))}")
-                    elif to_curr_upper not in all_currencies:
-                        print(f"Валюта {to_curr} недоступна.")
-                        print(f"Доступные валюты: {', '.join(sorted(list(all_currencies)))}")
-                    else:
-                        convert_currency(from_curr, to_curr, amount)
                 except ValueError:
                     print(f"Ошибка: '{amount_str}' не является допустимым числом.")
+                else:
+                    convert_currency(from_curr, to_curr, amount)
             else:
                 print("Все поля должны быть заполнены!")
         elif choice == "4":
@@ -504,10 +192,319 @@ def interactive_menu():
             print("Неверный выбор! Пожалуйста, введите число от 0 до 4.")
 
 
-def main():
-    # Запускаем интерактивное меню
-    interactive_menu()
+def parse_amount_arg(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' не является допустимым числом")
+
+
+def parse_positive_int_arg(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' не является целым числом")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"значение должно быть не меньше 1, получено {number}")
+    return number
+
+
+def convert_command(args: argparse.Namespace) -> int:
+    return 0 if convert_currency(args.from_currency, args.to_currency, args.amount, args.as_of) else 1
+
+
+def info_command(args: argparse.Namespace) -> int:
+    return 0 if get_currency_info(args.code) else 1
+
+
+def list_command(args: argparse.Namespace) -> int:
+    return 0 if list_currencies() else 1
+
+
+def update_command(args: argparse.Namespace) -> int:
+    pool = None
+    if args.providers is not None or args.hedge_after is not None:
+        import providers
+        names = args.providers.split(",") if args.providers else providers.DEFAULT_PROVIDERS
+        try:
+            pool = providers.create_pool([name.strip() for name in names],
+                                         providers.HEDGE_AFTER if args.hedge_after is None else args.hedge_after)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return 1
+    return 0 if update_currency_rates(pool, args.diff) else 1
+
+
+def convert_batch_command(args: argparse.Namespace) -> int:
+    """
+    Пакетная конвертация записей из файла или stdin
+    """
+    from batch import convert_batch_parallel
+    from money import load_rules
+
+    rules = None
+    if args.rounding_rules:
+        try:
+            rules = load_rules(args.rounding_rules)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка в правилах округления: {e}", file=sys.stderr)
+            return 1
+
+    fmt = args.format
+    if fmt is None:
+        fmt = "jsonl" if args.input and args.input.endswith(".jsonl") else "csv"
+
+    # Служебные сообщения загрузки не должны попадать в поток результатов,
+    # поэтому курсы обновляются синхронно, а не в фоне
+    with contextlib.redirect_stdout(sys.stderr), profiling.phase("load"):
+        table = load_snapshot(stale_while_revalidate=False).table
+    if not len(table):
+        print("Ошибка: нет данных о курсах валют.", file=sys.stderr)
+        return 1
+
+    try:
+        input_stream = open(args.input, "r", encoding="utf-8", newline="") if args.input else sys.stdin
+    except OSError as e:
+        print(f"Ошибка при открытии файла: {e}", file=sys.stderr)
+        return 1
+    try:
+        output_stream = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    except OSError as e:
+        print(f"Ошибка при открытии файла: {e}", file=sys.stderr)
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        return 1
+
+    try:
+        total, errors = convert_batch_parallel(table, input_stream, output_stream, fmt, args.chunk_size,
+                                               args.exact or rules is not None, rules, args.workers or None)
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if output_stream is not sys.stdout:
+            output_stream.close()
+
+    print(f"Обработано записей: {total}, с ошибками: {errors}", file=sys.stderr)
+    return 0
+
+
+def aggregate_command(args: argparse.Namespace) -> int:
+    """
+    Итоги проводок по ключам в отчётной валюте
+    """
+    from ledger import Ledger, read_entries, write_totals
+    from money import load_rules
+
+    rules = None
+    if args.rounding_rules:
+        try:
+            rules = load_rules(args.rounding_rules)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка в правилах округления: {e}", file=sys.stderr)
+            return 1
+
+    fmt = args.format
+    if fmt is None:
+        fmt = "jsonl" if args.input and args.input.endswith(".jsonl") else "csv"
+
+    with contextlib.redirect_stdout(sys.stderr), profiling.phase("load"):
+        table = load_snapshot(stale_while_revalidate=False).table
+    if not len(table):
+        print("Ошибка: нет данных о курсах валют.", file=sys.stderr)
+        return 1
+    if args.to.upper() not in table:
+        print(f"Валюта {args.to.upper()} недоступна.", file=sys.stderr)
+        return 1
+
+    ledger = Ledger()
+    try:
+        input_stream = open(args.input, "r", encoding="utf-8", newline="") if args.input else sys.stdin
+    except OSError as e:
+        print(f"Ошибка при открытии файла: {e}", file=sys.stderr)
+        return 1
+    try:
+        with profiling.phase("read"):
+            ledger.add_entries(read_entries(input_stream, fmt, args.key, args.currency_column, args.amount_column))
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+
+    totals = ledger.revalue(table, args.to, rules)
+    try:
+        output_stream = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    except OSError as e:
+        print(f"Ошибка при открытии файла: {e}", file=sys.stderr)
+        return 1
+    try:
+        # Итоги пересчитываются по мере записи
+        with profiling.phase("revalue"):
+            write_totals(totals, output_stream, fmt, args.key)
+    finally:
+        if output_stream is not sys.stdout:
+            output_stream.close()
+
+    print(f"Обработано проводок: {ledger.rows}, с ошибками: {ledger.errors}, ключей: {len(ledger.groups)}",
+          file=sys.stderr)
+    return 0
+
+
+def serve_command(args: argparse.Namespace) -> int:
+    """
+    Запуск долгоживущего сервиса конвертации
+    """
+    import asyncio
+    import metrics
+    from server import serve
+
+    # Сервис всегда собирает метрики и отдаёт их на /metrics
+    metrics.enable()
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.rates_file))
+    except KeyboardInterrupt:
+        print("Сервис остановлен.")
+    except OSError as e:
+        print(f"Ошибка запуска сервиса: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Создаёт парсер аргументов командной строки
+    """
+    from constants import AMOUNT_COLUMN, CHUNK_SIZE, CURRENCY_COLUMN, FORMATS, KEY_COLUMN, PATH_POLICIES
+
+    parser = argparse.ArgumentParser(description="Конвертер валют")
+    parser.add_argument("--stale-while-revalidate", action="store_true",
+                        help="Отвечать из последних сохранённых курсов, обновляя их в фоне")
+    parser.add_argument("--path-policy", choices=PATH_POLICIES,
+                        help="Выбор пути пересчёта: hops — меньше котировок (по умолчанию), "
+                             "fresh — самая свежая таблица")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Собирать метрики и записать их при выходе (.json — JSON, иначе формат Prometheus)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Профилировать команду (cProfile, tracemalloc, время этапов) и записать отчёт "
+                             "при выходе (.json — JSON, иначе текст; статистика cProfile — в FILE.pstats)")
+    subparsers = parser.add_subparsers(dest="command")
+
+    convert_parser = subparsers.add_parser("convert", help="Конвертировать сумму из одной валюты в другую")
+    convert_parser.add_argument("from_currency", metavar="FROM", help="Исходная валюта")
+    convert_parser.add_argument("to_currency", metavar="TO", help="Целевая валюта")
+    convert_parser.add_argument("amount", type=parse_amount_arg, help="Сумма")
+    convert_parser.add_argument("--as-of", metavar="DATE",
+                                help="Конвертировать по курсам из истории на дату (ГГГГ-ММ-ДД)")
+    convert_parser.set_defaults(handler=convert_command)
+
+    info_parser = subparsers.add_parser("info", help="Информация о валюте")
+    info_parser.add_argument("code", help="Код валюты")
+    info_parser.set_defaults(handler=info_command)
+
+    list_parser = subparsers.add_parser("list", help="Список доступных валют")
+    list_parser.set_defaults(handler=list_command)
+
+    update_parser = subparsers.add_parser("update", help="Обновить курсы валют")
+    update_parser.add_argument("--providers", metavar="NAMES",
+                               help="Источники курсов через запятую в порядке предпочтения "
+                                    "(по умолчанию er-api,exchangerate-api-v4)")
+    update_parser.add_argument("--hedge-after", type=float, metavar="SECONDS",
+                               help="Через сколько секунд без ответа дублировать запрос следующему источнику")
+    update_parser.add_argument("--diff", metavar="FILE",
+                               help="Записать изменения курсов относительно прежнего снимка в JSON-файл")
+    update_parser.set_defaults(handler=update_command)
+
+    batch_parser = subparsers.add_parser(
+        "convert-batch", help="Пакетная конвертация записей (from, to, amount) из CSV/JSONL"
+    )
+    batch_parser.add_argument("input", nargs="?", help="Входной файл (по умолчанию stdin)")
+    batch_parser.add_argument("-o", "--output", help="Выходной файл (по умолчанию stdout)")
+    batch_parser.add_argument("-f", "--format", choices=FORMATS,
+                              help="Формат входных и выходных данных (по умолчанию по расширению, иначе csv)")
+    batch_parser.add_argument("--chunk-size", type=parse_positive_int_arg, default=CHUNK_SIZE,
+                              help=f"Количество записей в блоке (по умолчанию {CHUNK_SIZE})")
+    batch_parser.add_argument("--exact", action="store_true",
+                              help="Точная конвертация в целых числах с округлением по правилам валют")
+    batch_parser.add_argument("--rounding-rules", metavar="FILE",
+                              help="JSON с правилами округления по валютам (включает --exact)")
+    batch_parser.add_argument("-j", "--workers", type=int, default=1,
+                              help="Число процессов (по умолчанию 1, 0 — по числу ядер)")
+    batch_parser.set_defaults(handler=convert_batch_command)
+
+    aggregate_parser = subparsers.add_parser(
+        "aggregate", help="Итоги проводок (ключ, валюта, сумма) по ключам в отчётной валюте"
+    )
+    aggregate_parser.add_argument("input", nargs="?", help="Входной файл (по умолчанию stdin)")
+    aggregate_parser.add_argument("--to", required=True, help="Отчётная валюта")
+    aggregate_parser.add_argument("-o", "--output", help="Выходной файл (по умолчанию stdout)")
+    aggregate_parser.add_argument("-f", "--format", choices=FORMATS,
+                                  help="Формат входных и выходных данных (по умолчанию по расширению, иначе csv)")
+    aggregate_parser.add_argument("--key", default=KEY_COLUMN,
+                                  help=f"Колонка ключа группировки (по умолчанию {KEY_COLUMN})")
+    aggregate_parser.add_argument("--currency-column", default=CURRENCY_COLUMN,
+                                  help=f"Колонка валюты (по умолчанию {CURRENCY_COLUMN})")
+    aggregate_parser.add_argument("--amount-column", default=AMOUNT_COLUMN,
+                                  help=f"Колонка суммы (по умолчанию {AMOUNT_COLUMN})")
+    aggregate_parser.add_argument("--rounding-rules", metavar="FILE",
+                                  help="JSON с правилами округления по валютам")
+    aggregate_parser.set_defaults(handler=aggregate_command)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Запустить сервис конвертации (HTTP или Unix-сокет) с курсами в памяти"
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Адрес (по умолчанию 127.0.0.1)")
+    serve_parser.add_argument("--port", type=int, default=8080, help="Порт (по умолчанию 8080)")
+    serve_parser.add_argument("--unix", help="Путь к Unix-сокету вместо TCP-порта")
+    serve_parser.add_argument("--rates-file", default="currency_rate.json",
+                              help="Файл курсов (по умолчанию currency_rate.json; .bin — бинарный формат с mmap)")
+    serve_parser.set_defaults(handler=serve_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.stale_while_revalidate:
+        import snapshot
+        snapshot.STALE_WHILE_REVALIDATE = True
+    if args.path_policy:
+        import rates
+        rates.PATH_POLICY = args.path_policy
+    if not args.metrics and not args.profile:
+        return run_command(args)
+
+    if args.metrics:
+        import metrics
+        metrics.enable()
+    if args.profile:
+        profiling.start()
+    try:
+        return run_command(args)
+    finally:
+        if args.profile:
+            try:
+                profiling.dump(args.profile)
+            except OSError as e:
+                print(f"Ошибка при записи профиля: {e}", file=sys.stderr)
+        if args.metrics:
+            try:
+                metrics.dump(args.metrics)
+            except OSError as e:
+                print(f"Ошибка при записи метрик: {e}", file=sys.stderr)
+
+
+def run_command(args: argparse.Namespace) -> int:
+    if args.command is None:
+        # Без подкоманды запускаем интерактивное меню
+        interactive_menu()
+        status = 0
+    else:
+        status = args.handler(args)
+    if args.stale_while_revalidate:
+        # Ответ уже выведен; фоновое обновление нужно довести до записи файла,
+        # иначе выход процесса прервёт его и курсы останутся устаревшими
+        if not wait_for_refreshes():
+            print("Фоновое обновление курсов не завершилось вовремя", file=sys.stderr)
+    return status
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,15 @@
+# Значения по умолчанию, нужные парсеру командной строки. Вынесены отдельно,
+# чтобы разбор аргументов не импортировал batch, ledger и rates ради констант
+
+# Пакетная конвертация: записей в блоке и поддерживаемые форматы
+CHUNK_SIZE = 10000
+FORMATS = ("csv", "jsonl")
+
+# Колонки проводок для агрегации
+KEY_COLUMN = "account"
+CURRENCY_COLUMN = "currency"
+AMOUNT_COLUMN = "amount"
+
+# Выбор пути пересчёта: "hops" — наименьшее число котировок (при равенстве —
+# самая свежая таблица), "fresh" — самая свежая таблица, содержащая обе валюты
+PATH_POLICIES = ("hops", "fresh")
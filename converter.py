@@ -0,0 +1,218 @@
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import metrics
+from catalog import CurrencyCatalog
+from rates import Hop
+from snapshot import Snapshot, load_snapshot
+
+
+BASE_CURRENCIES = ["USD", "EUR", "GBP", "RUB"]
+
+
+class ConverterError(Exception):
+    """
+    Базовая ошибка конвертера
+    """
+
+
+class RatesUnavailableError(ConverterError):
+    """
+    Нет данных о курсах валют (на указанный момент)
+    """
+
+
+class CurrencyNotFoundError(ConverterError, KeyError):
+    """
+    Код валюты отсутствует в снимке курсов
+    """
+
+    def __init__(self, currency_code: str, available: List[str], suggestions: Optional[List[str]] = None):
+        super().__init__(f"Валюта {currency_code} недоступна")
+        self.currency_code = currency_code
+        self.available = available
+        # Похожие коды из справочника валют
+        self.suggestions = suggestions or []
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+
+class ConversionPathError(ConverterError):
+    """
+    Для пары валют нет пути пересчёта
+    """
+
+    def __init__(self, from_currency: str, to_currency: str):
+        super().__init__(f"Не удалось найти путь для конвертации {from_currency} в {to_currency}")
+        self.from_currency = from_currency
+        self.to_currency = to_currency
+
+
+class CurrencyInfo(NamedTuple):
+    """
+    Информация о валюте
+    """
+    code: str
+    is_main: bool
+    base_code: str
+    provider: str
+    time_last_update_utc: str
+    time_next_update_utc: str
+    quotes: Dict[str, float]
+
+
+def historical_rate(from_currency: str, to_currency: str, as_of, history_dir: Optional[str] = None,
+                    file_path: str = "currency_rate.json") -> float:
+    """
+    Курс пары из истории снимков на момент as_of. История ищется рядом с файлом
+    курсов file_path (history_dir — другой каталог истории).
+    """
+    from history import HISTORY_DIR, get_history, history_path, snapshot_rate
+
+    from_code = from_currency.upper()
+    to_code = to_currency.upper()
+    snapshot = get_history(history_path(file_path, history_dir or HISTORY_DIR)).snapshot_at(as_of)
+    if snapshot is None:
+        raise RatesUnavailableError(f"Нет сохранённых курсов на {as_of}")
+    for code in (from_code, to_code):
+        if snapshot.code_index(code) < 0:
+            codes = snapshot.codes
+            raise CurrencyNotFoundError(code, codes, CurrencyCatalog(codes, {}).suggest(code))
+    rate = snapshot_rate(snapshot, from_code, to_code)
+    if rate is None:
+        raise ConversionPathError(from_code, to_code)
+    return rate
+
+
+class Converter:
+    """
+    Конвертер валют поверх загруженного снимка курсов.
+    Возвращает числа и записи, об ошибках сообщает исключениями ConverterError.
+    """
+
+    def __init__(self, snapshot: Snapshot, previous: Optional["Converter"] = None):
+        self.snapshot = snapshot
+        self.table = snapshot.table
+        # Кэш currency_info. Конвертер нового снимка, обновлённого по разнице
+        # с предыдущим, забирает из кэша previous записи, которых разница не коснулась.
+        self._info: Dict[str, CurrencyInfo] = {}
+        if (previous is not None and snapshot.diff is not None and self.table.changed is not None
+                and snapshot.diff_base == previous.snapshot.version):
+            updated = set(snapshot.diff.tables_updated)
+            self._info = {code: info for code, info in previous._info.items()
+                          if info.base_code not in updated
+                          and not any(self.table.rate_changed(base, code) for base in info.quotes)}
+
+    @classmethod
+    def load(cls, file_path: str = "currency_rate.json",
+             stale_while_revalidate: Optional[bool] = None) -> "Converter":
+        """
+        Создаёт конвертер по актуальному снимку (с обновлением устаревших курсов)
+        """
+        return cls(load_snapshot(stale_while_revalidate, file_path))
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def __contains__(self, currency_code: str) -> bool:
+        return currency_code.upper() in self.table
+
+    @property
+    def currencies(self) -> List[str]:
+        """
+        Отсортированный список кодов доступных валют
+        """
+        return list(self.snapshot.catalog.codes)
+
+    def validate(self, currency_code: str) -> str:
+        """
+        Проверяет код валюты и возвращает его в верхнем регистре
+        """
+        code = currency_code.upper()
+        if code not in self.table.index:
+            if not len(self.table):
+                raise RatesUnavailableError("Нет данных о курсах валют")
+            catalog = self.snapshot.catalog
+            raise CurrencyNotFoundError(code, list(catalog.codes), catalog.suggest(code))
+        return code
+
+    def rate(self, from_currency: str, to_currency: str, as_of=None) -> float:
+        """
+        Курс: сколько единиц to_currency в одной единице from_currency.
+        as_of — курс из истории на указанный момент.
+        """
+        if as_of is not None:
+            source = self.snapshot.source
+            return historical_rate(from_currency, to_currency, as_of,
+                                   file_path=source[0] if source is not None else "currency_rate.json")
+
+        from_code = self.validate(from_currency)
+        to_code = self.validate(to_currency)
+        if from_code == to_code:
+            return 1.0
+        rate = self.table.rate(from_code, to_code)
+        if rate is None:
+            raise ConversionPathError(from_code, to_code)
+        return rate
+
+    def path(self, from_currency: str, to_currency: str) -> List[Hop]:
+        """
+        Путь пересчёта, по которому получен курс пары: шаги с таблицей и котировкой
+        """
+        from_code = self.validate(from_currency)
+        to_code = self.validate(to_currency)
+        path = self.table.path(from_code, to_code)
+        if path is None:
+            raise ConversionPathError(from_code, to_code)
+        return path
+
+    def convert(self, from_currency: str, to_currency: str, amount: float, as_of=None) -> float:
+        """
+        Конвертирует сумму из одной валюты в другую
+        """
+        if not metrics.ENABLED:
+            return amount * self.rate(from_currency, to_currency, as_of)
+
+        start = time.perf_counter()
+        try:
+            result = amount * self.rate(from_currency, to_currency, as_of)
+        except ConverterError as e:
+            metrics.inc("conversions_total", status=type(e).__name__)
+            raise
+        metrics.observe("conversion_seconds", time.perf_counter() - start,
+                        mode="historical" if as_of is not None else "current")
+        metrics.inc("conversions_total", status="ok")
+        return result
+
+    def currency_info(self, currency_code: str) -> CurrencyInfo:
+        """
+        Метаданные таблицы валюты (или первой таблицы, где она есть)
+        и котировки базовых валют к ней
+        """
+        code = self.validate(currency_code)
+        info = self._info.get(code)
+        if info is not None:
+            return info
+        tables = self.snapshot.data.tables
+        is_main = code in tables
+        # Таблица самой валюты или первая, где она котируется
+        currency_table = tables[self.snapshot.catalog.containing(code)[0]]
+
+        quotes = {}
+        for base_curr in BASE_CURRENCIES:
+            if base_curr in self.table.index:
+                rate = 1.0 if base_curr == code else self.table.rate(base_curr, code)
+                if rate is not None:
+                    quotes[base_curr] = rate
+
+        info = self._info[code] = CurrencyInfo(
+            code=code,
+            is_main=is_main,
+            base_code=currency_table.base_code,
+            provider=currency_table.provider,
+            time_last_update_utc=currency_table.time_last_update_utc,
+            time_next_update_utc=currency_table.time_next_update_utc,
+            quotes=quotes,
+        )
+        return info
@@ -0,0 +1,202 @@
+import json
+import math
+from typing import Dict, Any, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+from storage import RateData, last_update_time
+
+
+# Котировка до и после обновления; None — котировки не было (или не стало)
+Change = Tuple[Optional[float], Optional[float]]
+
+
+class PairChange(NamedTuple):
+    """
+    Изменение котировки code в таблице base
+    """
+    base: str
+    code: str
+    old: Optional[float]
+    new: Optional[float]
+
+    @property
+    def move(self) -> Optional[float]:
+        """
+        Относительное изменение курса (new / old - 1); None, если котировка появилась или пропала
+        """
+        if not self.old or self.new is None:
+            return None
+        return self.new / self.old - 1
+
+
+class SnapshotDiff:
+    """
+    Разница между двумя снимками курсов: изменившиеся котировки по таблицам,
+    добавленные и удалённые валюты и таблицы, таблицы с новым временем публикации.
+    Неизменившиеся котировки в разницу не попадают.
+    """
+
+    __slots__ = ("time_from", "time_to", "added", "removed", "tables_added", "tables_removed",
+                 "tables_updated", "changes")
+
+    def __init__(self, time_from: Optional[int] = None, time_to: Optional[int] = None,
+                 added: Optional[List[str]] = None, removed: Optional[List[str]] = None,
+                 tables_added: Optional[List[str]] = None, tables_removed: Optional[List[str]] = None,
+                 tables_updated: Optional[List[str]] = None,
+                 changes: Optional[Dict[str, Dict[str, Change]]] = None):
+        self.time_from = time_from
+        self.time_to = time_to
+        self.added = added or []
+        self.removed = removed or []
+        self.tables_added = tables_added or []
+        self.tables_removed = tables_removed or []
+        self.tables_updated = tables_updated or []
+        # базовая валюта -> код -> (старый курс, новый курс)
+        self.changes = changes or {}
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.tables_added or self.tables_removed
+                    or self.tables_updated or self.changes)
+
+    def __len__(self) -> int:
+        """
+        Число изменившихся котировок
+        """
+        return sum(len(quotes) for quotes in self.changes.values())
+
+    def pairs(self) -> Iterator[PairChange]:
+        for base, quotes in self.changes.items():
+            for code, (old, new) in quotes.items():
+                yield PairChange(base, code, old, new)
+
+    @property
+    def structural(self) -> bool:
+        """
+        Изменился ли граф курсов: набор валют или таблиц либо наличие котировок в таблицах
+        """
+        if self.added or self.removed or self.tables_added or self.tables_removed:
+            return True
+        return any(not old or not new for quotes in self.changes.values() for old, new in quotes.values())
+
+    def touched(self) -> Set[str]:
+        """
+        Валюты, затронутые разницей: обе валюты каждой изменившейся котировки,
+        добавленные и удалённые валюты
+        """
+        codes = set(self.added) | set(self.removed) | set(self.tables_added) | set(self.tables_removed)
+        for base, quotes in self.changes.items():
+            codes.add(base)
+            codes.update(quotes)
+        return codes
+
+    def summary(self) -> str:
+        parts = [f"изменилось котировок: {len(self)}"]
+        if self.added:
+            parts.append(f"добавлены валюты: {', '.join(self.added)}")
+        if self.removed:
+            parts.append(f"удалены валюты: {', '.join(self.removed)}")
+        if self.tables_added:
+            parts.append(f"добавлены таблицы: {', '.join(self.tables_added)}")
+        if self.tables_removed:
+            parts.append(f"удалены таблицы: {', '.join(self.tables_removed)}")
+        return "; ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Компактное представление для JSON: по каждой котировке [старый, новый, изменение]
+        """
+        changes = {}
+        for base, quotes in self.changes.items():
+            changes[base] = {code: [old, new, PairChange(base, code, old, new).move]
+                             for code, (old, new) in quotes.items()}
+        return {
+            "from": self.time_from,
+            "to": self.time_to,
+            "added": self.added,
+            "removed": self.removed,
+            "tables_added": self.tables_added,
+            "tables_removed": self.tables_removed,
+            "tables_updated": self.tables_updated,
+            "changes": changes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SnapshotDiff":
+        changes = {base: {code: (values[0], values[1]) for code, values in quotes.items()}
+                   for base, quotes in data.get("changes", {}).items()}
+        return cls(data.get("from"), data.get("to"), data.get("added"), data.get("removed"),
+                   data.get("tables_added"), data.get("tables_removed"), data.get("tables_updated"), changes)
+
+
+def _as_data(data: Union[Dict[str, Any], RateData, None]) -> RateData:
+    if isinstance(data, RateData):
+        return data
+    return RateData.from_dict(data or {})
+
+
+def diff_snapshots(old: Union[Dict[str, Any], RateData, None], new: Union[Dict[str, Any], RateData],
+                   tolerance: float = 0.0) -> SnapshotDiff:
+    """
+    Сравнивает два снимка. Котировка считается изменившейся, если относительное
+    изменение больше tolerance (0 — любое изменение). Таблицы с одинаковым набором
+    валют и курсами сравниваются целиком, без обхода котировок.
+    """
+    old = _as_data(old)
+    new = _as_data(new)
+    old_codes = set(old.codes)
+    new_codes = set(new.codes)
+
+    changes: Dict[str, Dict[str, Change]] = {}
+    updated = []
+    for base, table in new.tables.items():
+        previous = old.tables.get(base)
+        if previous is None:
+            continue
+        if previous.time_last_update_unix != table.time_last_update_unix:
+            updated.append(base)
+        if previous.codes == table.codes:
+            # NaN с одинаковым битовым представлением — сравнение байтов учитывает и отсутствие котировок
+            if previous.rates.tobytes() == table.rates.tobytes():
+                continue
+            pairs = zip(table.codes, previous.rates, table.rates)
+        else:
+            pairs = ((code, previous.rate(code), table.rate(code))
+                     for code in sorted(set(previous.codes) | set(table.codes)))
+
+        quotes = {}
+        for code, old_rate, new_rate in pairs:
+            if old_rate is not None and math.isnan(old_rate):
+                old_rate = None
+            if new_rate is not None and math.isnan(new_rate):
+                new_rate = None
+            if old_rate == new_rate:
+                continue
+            if old_rate and new_rate and abs(new_rate / old_rate - 1) <= tolerance:
+                continue
+            quotes[code] = (old_rate, new_rate)
+        if quotes:
+            changes[base] = quotes
+
+    return SnapshotDiff(
+        time_from=last_update_time(old),
+        time_to=last_update_time(new),
+        added=sorted(new_codes - old_codes),
+        removed=sorted(old_codes - new_codes),
+        tables_added=[base for base in new.tables if base not in old.tables],
+        tables_removed=[base for base in old.tables if base not in new.tables],
+        tables_updated=updated,
+        changes=changes,
+    )
+
+
+def save_diff(diff: SnapshotDiff, file_path: str) -> None:
+    """
+    Записывает разницу в JSON-файл для внешних потребителей
+    """
+    with open(file_path, "w", encoding="utf-8") as file:
+        json.dump(diff.to_dict(), file, ensure_ascii=False)
+        file.write("\n")
+
+
+def read_diff(file_path: str) -> SnapshotDiff:
+    with open(file_path, "r", encoding="utf-8") as file:
+        return SnapshotDiff.from_dict(json.load(file))
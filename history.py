@@ -0,0 +1,229 @@
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_right
+from datetime import date, datetime, time as dt_time, timezone
+from typing import Dict, Any, Iterable, List, Optional, Union
+
+from rates import pair_rate
+from storage import BinarySnapshot, atomic_write, encode_binary, file_lock
+
+
+# Каталог истории; относительный путь отсчитывается от каталога файла курсов (history_path)
+HISTORY_DIR = "history"
+DATA_FILE = "rates.dat"
+INDEX_FILE = "index.dat"
+# Запись индекса: время снимка (unix), смещение и длина снимка в файле данных
+INDEX_ENTRY = struct.Struct("<qQQ")
+
+AsOf = Union[int, float, str, date, datetime]
+
+
+def history_path(file_path: str, history_dir: str = HISTORY_DIR) -> str:
+    """
+    Каталог истории для файла курсов file_path: относительный history_dir — рядом
+    с файлом курсов, а не в текущем каталоге
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), history_dir)
+
+
+def snapshot_time(data: Dict[str, Any]) -> Optional[int]:
+    """
+    Время снимка — самая поздняя публикация курсов среди его таблиц (unix)
+    """
+    times = [payload['time_last_update_unix'] for payload in data.values()
+             if isinstance(payload, dict) and payload.get('time_last_update_unix')]
+    return max(times) if times else None
+
+
+def parse_as_of(as_of: AsOf) -> float:
+    """
+    Приводит момент времени к unix-времени. Дата без времени (или строка
+    ГГГГ-ММ-ДД) означает конец этого дня по UTC.
+    """
+    if isinstance(as_of, (int, float)):
+        return float(as_of)
+    if isinstance(as_of, str):
+        text = as_of.strip()
+        try:
+            as_of = date.fromisoformat(text) if len(text) == 10 else datetime.fromisoformat(text)
+        except ValueError:
+            raise ValueError(f"'{text}' не является датой в формате ГГГГ-ММ-ДД")
+    if isinstance(as_of, datetime):
+        if as_of.tzinfo is None:
+            as_of = as_of.replace(tzinfo=timezone.utc)
+        return as_of.timestamp()
+    return datetime.combine(as_of, dt_time.max, tzinfo=timezone.utc).timestamp()
+
+
+class RateHistory:
+    """
+    Хранилище истории снимков курсов, пополняемое только дописыванием.
+    Снимки лежат подряд в rates.dat в бинарном формате storage.encode_binary,
+    а index.dat хранит отсортированные по времени записи (время, смещение, длина).
+    Поиск снимка на момент времени — бинарный поиск по индексу.
+    Курс пары вычисляется прямо по массивам курсов снимка (rates.pair_rate) —
+    по тем же путям пересчёта, что и для текущих курсов, без таблицы всех пар.
+    """
+
+    def __init__(self, directory: str = HISTORY_DIR):
+        self.directory = directory
+        self.data_path = os.path.join(directory, DATA_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.timestamps = array('q')
+        self._offsets = array('Q')
+        self._lengths = array('Q')
+        self._index_size = -1
+        self._mmap: Optional[mmap.mmap] = None
+        self._snapshots: Dict[int, BinarySnapshot] = {}
+
+    def _load_index(self) -> None:
+        """
+        Перечитывает индекс, если он изменился с прошлого чтения
+        """
+        try:
+            size = os.path.getsize(self.index_path)
+        except FileNotFoundError:
+            size = 0
+        if size == self._index_size:
+            return
+
+        timestamps, offsets, lengths = array('q'), array('Q'), array('Q')
+        if size:
+            with open(self.index_path, "rb") as file:
+                raw = file.read(size - size % INDEX_ENTRY.size)
+            for timestamp, offset, length in INDEX_ENTRY.iter_unpack(raw):
+                timestamps.append(timestamp)
+                offsets.append(offset)
+                lengths.append(length)
+        self.timestamps, self._offsets, self._lengths = timestamps, offsets, lengths
+        self._index_size = size
+        self._snapshots.clear()
+
+    def __len__(self) -> int:
+        self._load_index()
+        return len(self.timestamps)
+
+    def append(self, data: Dict[str, Any]) -> bool:
+        """
+        Дописывает снимок в историю. Снимок с уже сохранённым временем пропускается.
+        """
+        timestamp = snapshot_time(data)
+        if timestamp is None:
+            return False
+        os.makedirs(self.directory, exist_ok=True)
+
+        with file_lock(os.path.join(self.directory, "history.lock")):
+            self._load_index()
+            position = bisect_right(self.timestamps, timestamp)
+            if position and self.timestamps[position - 1] == timestamp:
+                return False
+
+            encoded = encode_binary(data)
+            with open(self.data_path, "ab") as file:
+                # Снимки выравниваются по 8 байт, чтобы массивы курсов читались напрямую
+                offset = file.tell()
+                padding = -offset % 8
+                file.write(b"\0" * padding)
+                file.write(encoded)
+                file.flush()
+                os.fsync(file.fileno())
+            entry = INDEX_ENTRY.pack(timestamp, offset + padding, len(encoded))
+
+            if position == len(self.timestamps):
+                with open(self.index_path, "ab") as file:
+                    file.write(entry)
+                    file.flush()
+                    os.fsync(file.fileno())
+            else:
+                # Снимок старше последнего: индекс переписывается целиком с сохранением порядка
+                entries = [INDEX_ENTRY.pack(*row) for row in zip(self.timestamps, self._offsets, self._lengths)]
+                entries.insert(position, entry)
+                with atomic_write(self.index_path, "wb") as file:
+                    file.write(b"".join(entries))
+        return True
+
+    def _snapshot(self, i: int) -> BinarySnapshot:
+        snapshot = self._snapshots.get(i)
+        if snapshot is not None:
+            return snapshot
+
+        end = self._offsets[i] + self._lengths[i]
+        if self._mmap is None or len(self._mmap) < end:
+            # Файл данных вырос: отображаем его заново (старые снимки держат прежний mmap)
+            with open(self.data_path, "rb") as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)[self._offsets[i]:end]
+        snapshot = BinarySnapshot(buffer, f"{self.data_path}@{self._offsets[i]}")
+        self._snapshots[i] = snapshot
+        return snapshot
+
+    def _position(self, timestamp: float) -> int:
+        return bisect_right(self.timestamps, int(timestamp)) - 1
+
+    def snapshot_at(self, as_of: AsOf) -> Optional[BinarySnapshot]:
+        """
+        Возвращает последний снимок, опубликованный не позже as_of
+        """
+        self._load_index()
+        i = self._position(parse_as_of(as_of))
+        if i < 0:
+            return None
+        return self._snapshot(i)
+
+    def rate(self, from_currency: str, to_currency: str, as_of: AsOf) -> Optional[float]:
+        """
+        Курс пары на момент as_of; None, если снимка или курса нет
+        """
+        snapshot = self.snapshot_at(as_of)
+        if snapshot is None:
+            return None
+        return snapshot_rate(snapshot, from_currency.upper(), to_currency.upper())
+
+    def rates_as_of(self, from_currency: str, to_currency: str,
+                    timestamps: Iterable[AsOf]) -> List[Optional[float]]:
+        """
+        Курсы пары для столбца моментов времени (as-of join).
+        Курс каждого снимка вычисляется один раз.
+        """
+        self._load_index()
+        from_currency = from_currency.upper()
+        to_currency = to_currency.upper()
+        by_snapshot: Dict[int, Optional[float]] = {}
+        results = []
+        for as_of in timestamps:
+            i = self._position(parse_as_of(as_of))
+            if i < 0:
+                results.append(None)
+                continue
+            if i not in by_snapshot:
+                by_snapshot[i] = snapshot_rate(self._snapshot(i), from_currency, to_currency)
+            results.append(by_snapshot[i])
+        return results
+
+
+def snapshot_rate(snapshot: BinarySnapshot, from_currency: str, to_currency: str) -> Optional[float]:
+    """
+    Курс пары в снимке истории; None, если валюты нет или нет пути пересчёта
+    """
+    i = snapshot.code_index(from_currency)
+    j = snapshot.code_index(to_currency)
+    if i < 0 or j < 0:
+        return None
+    return pair_rate(snapshot.route_tables(), i, j)
+
+
+_histories: Dict[str, RateHistory] = {}
+
+
+def get_history(directory: str = HISTORY_DIR) -> RateHistory:
+    """
+    Общая для процесса история в каталоге directory: индекс и отображение файла
+    данных не перечитываются на каждый запрос
+    """
+    directory = os.path.abspath(directory)
+    history = _histories.get(directory)
+    if history is None:
+        history = _histories.setdefault(directory, RateHistory(directory))
+    return history
@@ -0,0 +1,205 @@
+import csv
+import json
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+from constants import AMOUNT_COLUMN, CURRENCY_COLUMN, KEY_COLUMN
+from money import RATE_DECIMALS, RoundingRule, format_units, parse_amount, rate_units, round_div, rule_for
+from rates import RateTable
+
+
+Entry = Tuple[str, str, str]
+
+
+class LedgerTotal(NamedTuple):
+    """
+    Итог по ключу в отчётной валюте. total — десятичная строка, None при ошибке.
+    """
+    key: str
+    currency: str
+    total: Optional[str]
+    rows: int
+    error: str
+
+
+def read_entries(stream: Iterable[str], fmt: str = "csv", key_column: str = KEY_COLUMN,
+                 currency_column: str = CURRENCY_COLUMN,
+                 amount_column: str = AMOUNT_COLUMN) -> Iterator[Entry]:
+    """
+    Построчно читает проводки (ключ, валюта, сумма) из CSV с заголовком или JSONL.
+    Если колонки ключа нет, все проводки относятся к одному ключу "".
+    """
+    if fmt == "jsonl":
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line, parse_float=str, parse_int=str)
+                yield (str(record.get(key_column, "")), str(record.get(currency_column, "")),
+                       str(record.get(amount_column, "")))
+            except (ValueError, AttributeError):
+                yield "", "", line
+        return
+
+    for record in csv.DictReader(stream):
+        yield (record.get(key_column) or "", record.get(currency_column) or "",
+               record.get(amount_column) or "")
+
+
+class Ledger:
+    """
+    Накопитель остатков: суммы складываются точно, в целых числах,
+    отдельно для каждой пары (ключ, валюта). Память зависит от числа таких пар,
+    а не от числа проводок, поэтому вход читается потоково.
+    """
+
+    def __init__(self):
+        # ключ -> валюта -> [мантисса суммы, знаков после запятой, число проводок]
+        self.groups: Dict[str, Dict[str, List[int]]] = {}
+        self.rows = 0
+        self.errors = 0
+        # (отчётная валюта, правило) -> курсы и итоги последнего пересчёта
+        self._revalued: Dict[Tuple[str, RoundingRule],
+                             Tuple[Dict[str, Tuple[Optional[int], str]], Dict[str, LedgerTotal]]] = {}
+
+    def add(self, key: str, currency_code: str, amount: str) -> bool:
+        """
+        Добавляет проводку; False, если сумма не является числом
+        """
+        try:
+            mantissa, decimals = parse_amount(amount)
+        except ValueError:
+            self.errors += 1
+            return False
+
+        currencies = self.groups.get(key)
+        if currencies is None:
+            currencies = self.groups[key] = {}
+        code = currency_code.strip().upper()
+        group = currencies.get(code)
+        if group is None:
+            group = currencies[code] = [0, decimals, 0]
+        if decimals > group[1]:
+            group[0] *= 10 ** (decimals - group[1])
+            group[1] = decimals
+        elif decimals < group[1]:
+            mantissa *= 10 ** (group[1] - decimals)
+        group[0] += mantissa
+        group[2] += 1
+        self.rows += 1
+        return True
+
+    def add_entries(self, entries: Iterable[Entry]) -> "Ledger":
+        for key, currency_code, amount in entries:
+            self.add(key, currency_code, amount)
+        return self
+
+    def revalue(self, table: RateTable, to_currency: str,
+                rules: Optional[Dict[str, RoundingRule]] = None) -> Iterator[LedgerTotal]:
+        """
+        Пересчитывает остатки в отчётную валюту. Курс каждой валюты ищется один раз,
+        сумма каждой группы (ключ, валюта) умножается на курс один раз, а итог по ключу
+        округляется по правилу отчётной валюты после сложения.
+
+        Итоги запоминаются: при повторном пересчёте (например, после обновления курсов)
+        итог ключа берётся из прошлого пересчёта, если у ключа не появилось новых
+        проводок и не изменился курс ни одной из его валют.
+        """
+        to_code = to_currency.strip().upper()
+        rule = rule_for(to_code, rules)
+        previous_rates, previous_totals = self._revalued.get((to_code, rule), ({}, {}))
+        rates: Dict[str, Tuple[Optional[int], str]] = {}
+        totals: Dict[str, LedgerTotal] = {}
+
+        for key in sorted(self.groups):
+            currencies = self.groups[key]
+            for code in currencies:
+                if code not in rates:
+                    rates[code] = _currency_rate(table, code, to_code)
+
+            previous = previous_totals.get(key)
+            if (previous is not None and previous.rows == sum(group[2] for group in currencies.values())
+                    and all(rates[code] == previous_rates.get(code) for code in currencies)):
+                total = previous
+            else:
+                total = _revalue_key(key, currencies, rates, to_code, rule)
+            totals[key] = total
+            yield total
+
+        self._revalued[(to_code, rule)] = (rates, totals)
+
+
+def _revalue_key(key: str, currencies: Dict[str, List[int]], rates: Dict[str, Tuple[Optional[int], str]],
+                 to_code: str, rule: RoundingRule) -> LedgerTotal:
+    """
+    Итог одного ключа в отчётной валюте
+    """
+    total = 0
+    scale = 0
+    rows = 0
+    errors = []
+    for code, (mantissa, decimals, count) in currencies.items():
+        rows += count
+        rate, error = rates[code]
+        if rate is None:
+            errors.append(error)
+            continue
+
+        # Приводим слагаемые к общему масштабу 10^-scale
+        value = mantissa * rate
+        value_scale = decimals + RATE_DECIMALS
+        if value_scale > scale:
+            total *= 10 ** (value_scale - scale)
+            scale = value_scale
+        elif value_scale < scale:
+            value *= 10 ** (scale - value_scale)
+        total += value
+
+    if errors:
+        return LedgerTotal(key, to_code, None, rows, "; ".join(sorted(errors)))
+    if scale > rule.decimals:
+        units = round_div(total, 10 ** (scale - rule.decimals), rule.rounding)
+    else:
+        units = total * 10 ** (rule.decimals - scale)
+    return LedgerTotal(key, to_code, format_units(units, rule.decimals), rows, "")
+
+
+def _currency_rate(table: RateTable, from_code: str, to_code: str) -> Tuple[Optional[int], str]:
+    """
+    Курс валюты к отчётной в единицах 10^-RATE_DECIMALS и текст ошибки, если курса нет
+    """
+    for code in (from_code, to_code):
+        if code not in table:
+            return None, f"Валюта {code} недоступна"
+    rate = 1.0 if from_code == to_code else table.rate(from_code, to_code)
+    if rate is None:
+        return None, f"Не удалось найти путь для конвертации {from_code} в {to_code}"
+    return rate_units(rate), ""
+
+
+def aggregate(table: RateTable, entries: Iterable[Entry], to_currency: str,
+              rules: Optional[Dict[str, RoundingRule]] = None) -> List[LedgerTotal]:
+    """
+    Суммирует проводки по ключам в отчётной валюте
+    """
+    return list(Ledger().add_entries(entries).revalue(table, to_currency, rules))
+
+
+def write_totals(totals: Iterable[LedgerTotal], output_stream: TextIO, fmt: str = "csv",
+                 key_column: str = KEY_COLUMN) -> None:
+    """
+    Записывает итоги в CSV (с заголовком) или JSONL
+    """
+    if fmt == "jsonl":
+        for total in totals:
+            record = {key_column: total.key, "currency": total.currency, "total": total.total,
+                      "rows": total.rows}
+            if total.error:
+                record["error"] = total.error
+            output_stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return
+
+    writer = csv.writer(output_stream, lineterminator="\n")
+    writer.writerow([key_column, "currency", "total", "rows", "error"])
+    writer.writerows((total.key, total.currency, "" if total.total is None else total.total,
+                      total.rows, total.error) for total in totals)
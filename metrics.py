@@ -0,0 +1,217 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import contextlib
+
+
+# Метрики собираются только после enable(); места вызова проверяют ENABLED
+# до любой другой работы, поэтому выключенные метрики почти ничего не стоят
+ENABLED = False
+
+# Границы корзин гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.000001, 0.00001, 0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[Labels, float]] = {}
+_gauges: Dict[str, Dict[Labels, float]] = {}
+_histograms: Dict[str, Dict[Labels, List[float]]] = {}
+_gauge_callbacks: Dict[str, Callable[[], Optional[float]]] = {}
+_help: Dict[str, str] = {
+    "currency_fetch_seconds": "Время запроса курсов одной валюты к API",
+    "currency_fetch_total": "Запросы курсов к API по HTTP-статусу ответа",
+    "currency_fetch_retries_total": "Повторы запросов курсов к API",
+    "currency_fetch_errors_total": "Неудачные запросы курсов к API по причине",
+    "currency_fetch_bytes_total": "Байты, загруженные из API",
+    "currency_parse_seconds": "Время разбора JSON с курсами",
+    "provider_fetch_seconds": "Время ответа источника курсов",
+    "provider_fetch_total": "Запросы к источникам курсов по результату",
+    "provider_hedged_total": "Дублирующие запросы к резервным источникам",
+    "snapshot_cache_hits_total": "Снимки, отданные из памяти",
+    "snapshot_cache_misses_total": "Снимки, перечитанные из файла",
+    "snapshot_loads_total": "Загрузки снимка по источнику",
+    "snapshot_age_seconds": "Возраст снимка с момента публикации курсов",
+    "conversions_total": "Конвертации по результату",
+    "conversion_seconds": "Время одной конвертации",
+    "batch_rows_total": "Записи пакетной конвертации по результату",
+    "batch_chunk_seconds": "Время конвертации одного блока записей",
+    "http_requests_total": "Запросы к сервису по пути и статусу",
+    "http_request_seconds": "Время обработки запроса сервисом",
+}
+
+
+def enable() -> None:
+    global ENABLED
+    ENABLED = True
+
+
+def disable() -> None:
+    global ENABLED
+    ENABLED = False
+
+
+def reset() -> None:
+    """
+    Сбрасывает все собранные значения
+    """
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def describe(name: str, text: str) -> None:
+    """
+    Задаёт описание метрики для экспорта
+    """
+    _help[name] = text
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels: Any) -> None:
+    """
+    Увеличивает счётчик
+    """
+    key = _labels(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    """
+    Устанавливает значение датчика
+    """
+    with _lock:
+        _gauges.setdefault(name, {})[_labels(labels)] = value
+
+
+def gauge_callback(name: str, callback: Callable[[], Optional[float]]) -> None:
+    """
+    Датчик, значение которого вычисляется в момент экспорта
+    """
+    _gauge_callbacks[name] = callback
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    """
+    Добавляет наблюдение в гистограмму: счётчики корзин, сумма и количество
+    """
+    key = _labels(labels)
+    position = bisect_left(DEFAULT_BUCKETS, value)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        buckets = series.get(key)
+        if buckets is None:
+            buckets = series[key] = [0] * (len(DEFAULT_BUCKETS) + 1) + [0.0]
+        buckets[position] += 1
+        buckets[-1] += value
+
+
+@contextlib.contextmanager
+def _timer(name: str, labels: Dict[str, Any]) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timer(name: str, **labels: Any):
+    """
+    Контекстный менеджер, замеряющий время блока в гистограмму name.
+    При выключенных метриках возвращает пустой контекст.
+    """
+    if not ENABLED:
+        return contextlib.nullcontext()
+    return _timer(name, labels)
+
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+def _collect_gauges() -> Dict[str, Dict[Labels, float]]:
+    gauges = {name: dict(series) for name, series in _gauges.items()}
+    for name, callback in _gauge_callbacks.items():
+        value = callback()
+        if value is not None:
+            gauges.setdefault(name, {})[()] = value
+    return gauges
+
+
+def export_prometheus() -> str:
+    """
+    Экспорт в текстовом формате Prometheus
+    """
+    lines = []
+    with _lock:
+        counters = {name: dict(series) for name, series in _counters.items()}
+        histograms = {name: {key: list(buckets) for key, buckets in series.items()}
+                      for name, series in _histograms.items()}
+    gauges = _collect_gauges()
+
+    for kind, family in (("counter", counters), ("gauge", gauges)):
+        for name in sorted(family):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(family[name].items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for name in sorted(histograms):
+        if name in _help:
+            lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, buckets in sorted(histograms[name].items()):
+            cumulative = 0
+            for bound, count in zip(DEFAULT_BUCKETS + (float("inf"),), buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {buckets[-1]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def export_json() -> Dict[str, Any]:
+    """
+    Экспорт в виде словаря для JSON
+    """
+    def series_list(series: Dict[Labels, Any], convert: Callable[[Any], Any]) -> List[Dict[str, Any]]:
+        return [{"labels": dict(labels), "value": convert(value)} for labels, value in sorted(series.items())]
+
+    def histogram_value(buckets: List[float]) -> Dict[str, Any]:
+        return {
+            "buckets": {repr(bound): count for bound, count in zip(DEFAULT_BUCKETS, buckets)},
+            "overflow": buckets[len(DEFAULT_BUCKETS)],
+            "count": sum(buckets[:-1]),
+            "sum": buckets[-1],
+        }
+
+    with _lock:
+        counters = {name: series_list(series, float) for name, series in _counters.items()}
+        histograms = {name: series_list(series, histogram_value) for name, series in _histograms.items()}
+    gauges = {name: series_list(series, float) for name, series in _collect_gauges().items()}
+    return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+
+def dump(file_path: str) -> None:
+    """
+    Записывает метрики в файл: .json — JSON, иначе текстовый формат Prometheus
+    """
+    if file_path.endswith(".json"):
+        text = json.dumps(export_json(), indent=4, ensure_ascii=False) + "\n"
+    else:
+        text = export_prometheus()
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.write(text)
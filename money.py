@@ -0,0 +1,181 @@
+import json
+from decimal import (Decimal, InvalidOperation, localcontext, ROUND_CEILING, ROUND_DOWN, ROUND_FLOOR,
+                     ROUND_HALF_DOWN, ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_UP)
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+# Курс хранится как целое число единиц 10^-RATE_DECIMALS
+RATE_DECIMALS = 12
+DEFAULT_DECIMALS = 2
+
+# Число знаков после запятой для валют, отличающихся от DEFAULT_DECIMALS (ISO 4217)
+CURRENCY_DECIMALS = {
+    "BIF": 0, "CLP": 0, "DJF": 0, "GNF": 0, "ISK": 0, "JPY": 0, "KMF": 0, "KRW": 0,
+    "PYG": 0, "RWF": 0, "UGX": 0, "VND": 0, "VUV": 0, "XAF": 0, "XOF": 0, "XPF": 0,
+    "BHD": 3, "IQD": 3, "JOD": 3, "KWD": 3, "LYD": 3, "OMR": 3, "TND": 3,
+    "CLF": 4,
+}
+
+ROUNDING_MODES = (ROUND_HALF_EVEN, ROUND_HALF_UP, ROUND_HALF_DOWN, ROUND_UP, ROUND_DOWN,
+                  ROUND_CEILING, ROUND_FLOOR)
+
+_POWERS = [10 ** i for i in range(64)]
+
+
+class RoundingRule(NamedTuple):
+    """
+    Правило округления суммы в валюте: число знаков и режим округления decimal
+    """
+    decimals: int
+    rounding: str = ROUND_HALF_EVEN
+
+
+def default_rule(currency_code: str) -> RoundingRule:
+    return RoundingRule(CURRENCY_DECIMALS.get(currency_code, DEFAULT_DECIMALS))
+
+
+def load_rules(file_path: str) -> Dict[str, RoundingRule]:
+    """
+    Читает правила округления из JSON вида
+    {"JPY": {"decimals": 0, "rounding": "ROUND_HALF_UP"}, "*": {"decimals": 2}}.
+    Ключ "*" задаёт правило для валют, не указанных явно.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        raw = json.load(file)
+    if not isinstance(raw, dict):
+        raise ValueError(f"Файл {file_path} должен содержать JSON-объект")
+
+    rules = {}
+    for code, spec in raw.items():
+        if not isinstance(spec, dict):
+            raise ValueError(f"Правило для {code} должно быть объектом {{decimals, rounding}}")
+        decimals = spec.get("decimals", CURRENCY_DECIMALS.get(code.upper(), DEFAULT_DECIMALS))
+        rounding = spec.get("rounding", ROUND_HALF_EVEN)
+        if not isinstance(decimals, int) or not 0 <= decimals <= RATE_DECIMALS:
+            raise ValueError(f"Недопустимое число знаков для {code}: {decimals}")
+        if rounding not in ROUNDING_MODES:
+            raise ValueError(f"Неизвестный режим округления для {code}: {rounding}")
+        rules[code.upper()] = RoundingRule(decimals, rounding)
+    return rules
+
+
+def rule_for(currency_code: str, rules: Optional[Dict[str, RoundingRule]] = None) -> RoundingRule:
+    """
+    Правило округления валюты с учётом пользовательских правил
+    """
+    if rules:
+        rule = rules.get(currency_code) or rules.get("*")
+        if rule is not None:
+            return rule
+    return default_rule(currency_code)
+
+
+def rate_units(rate: float) -> int:
+    """
+    Переводит курс в целое число единиц 10^-RATE_DECIMALS (округление к чётному).
+    Курс берётся по кратчайшему десятичному представлению числа.
+    """
+    return int(Decimal(repr(rate)).scaleb(RATE_DECIMALS).quantize(Decimal(1), ROUND_HALF_EVEN))
+
+
+def parse_amount(text: str) -> Tuple[int, int]:
+    """
+    Точно разбирает десятичную сумму в пару (мантисса, число знаков после запятой)
+    """
+    text = text.strip()
+    whole, dot, fraction = text.partition(".")
+    digits = whole.lstrip("+-")
+    if digits.isdigit() and (not fraction or fraction.isdigit()) and len(whole) - len(digits) <= 1:
+        mantissa = int(digits + fraction)
+        return (-mantissa if whole.startswith("-") else mantissa), len(fraction)
+
+    # Экспоненциальная и прочая запись — через Decimal
+    try:
+        value = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"'{text}' не является допустимым числом")
+    if not value.is_finite():
+        raise ValueError(f"'{text}' не является допустимым числом")
+    sign, value_digits, exponent = value.as_tuple()
+    mantissa = int("".join(map(str, value_digits)))
+    if exponent > 0:
+        mantissa *= 10 ** exponent
+        exponent = 0
+    return (-mantissa if sign else mantissa), -exponent
+
+
+def round_div(numerator: int, divisor: int, rounding: str = ROUND_HALF_EVEN) -> int:
+    """
+    Целочисленное деление с округлением по правилам decimal (divisor > 0)
+    """
+    quotient, remainder = divmod(abs(numerator), divisor)
+    if remainder:
+        negative = numerator < 0
+        twice = remainder * 2
+        if rounding == ROUND_HALF_EVEN:
+            up = twice > divisor or (twice == divisor and quotient & 1)
+        elif rounding == ROUND_HALF_UP:
+            up = twice >= divisor
+        elif rounding == ROUND_HALF_DOWN:
+            up = twice > divisor
+        elif rounding == ROUND_UP:
+            up = True
+        elif rounding == ROUND_DOWN:
+            up = False
+        elif rounding == ROUND_CEILING:
+            up = not negative
+        else:  # ROUND_FLOOR
+            up = negative
+        if up:
+            quotient += 1
+    return -quotient if numerator < 0 else quotient
+
+
+def format_units(units: int, decimals: int) -> str:
+    """
+    Форматирует целое число единиц 10^-decimals как десятичную строку
+    """
+    if not decimals:
+        return str(units)
+    digits = str(abs(units)).rjust(decimals + 1, "0")
+    return f"{'-' if units < 0 else ''}{digits[:-decimals]}.{digits[-decimals:]}"
+
+
+class PairConverter:
+    """
+    Точная конвертация сумм для одной пары валют в целочисленной арифметике.
+    Курс и правило округления целевой валюты подготавливаются один раз.
+    """
+
+    __slots__ = ("rate", "rule")
+
+    def __init__(self, rate: float, rule: RoundingRule):
+        self.rate = rate_units(rate)
+        self.rule = rule
+
+    def convert_units(self, mantissa: int, decimals: int) -> int:
+        """
+        Сумма mantissa * 10^-decimals в целевой валюте, в единицах 10^-rule.decimals
+        """
+        shift = decimals + RATE_DECIMALS - self.rule.decimals
+        product = mantissa * self.rate
+        if shift <= 0:
+            return product * 10 ** -shift
+        divisor = _POWERS[shift] if shift < 64 else 10 ** shift
+        return round_div(product, divisor, self.rule.rounding)
+
+    def convert(self, amount: str) -> str:
+        mantissa, decimals = parse_amount(amount)
+        return format_units(self.convert_units(mantissa, decimals), self.rule.decimals)
+
+
+def decimal_reference(amount: str, rate: float, rule: RoundingRule) -> Decimal:
+    """
+    Эталонная конвертация на Decimal: сумма, умноженная на курс
+    (округлённый до RATE_DECIMALS знаков), с округлением по правилу валюты
+    """
+    with localcontext() as context:
+        context.prec = 1000
+        rate_value = Decimal(repr(rate)).quantize(Decimal(1).scaleb(-RATE_DECIMALS), ROUND_HALF_EVEN)
+        return (Decimal(amount.strip()) * rate_value).quantize(Decimal(1).scaleb(-rule.decimals),
+                                                               rule.rounding)
@@ -0,0 +1,150 @@
+import contextlib
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+# Профилирование включается только start(); выключенное не импортирует cProfile
+# и tracemalloc, а phase() возвращает пустой контекст
+ENABLED = False
+
+# Сколько функций и мест выделения памяти попадает в отчёт
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 15
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+_profiler = None
+_started_at = 0.0
+# этап -> [число входов, суммарное время в секундах]; порядок — порядок первого входа
+_phases: Dict[str, List[float]] = {}
+# этапы замеряются и из потоков загрузки курсов и пакетной конвертации
+_phases_lock = threading.Lock()
+
+
+def start() -> None:
+    """
+    Запускает cProfile и tracemalloc и начинает учёт времени по этапам
+    """
+    global ENABLED, _profiler, _started_at
+    import cProfile
+    import tracemalloc
+
+    with _phases_lock:
+        _phases.clear()
+    tracemalloc.start()
+    _profiler = cProfile.Profile()
+    _started_at = time.perf_counter()
+    ENABLED = True
+    _profiler.enable()
+
+
+@contextlib.contextmanager
+def _phase(name: str) -> Iterator[None]:
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        with _phases_lock:
+            phase = _phases.get(name)
+            if phase is None:
+                phase = _phases[name] = [0, 0.0]
+            phase[0] += 1
+            phase[1] += elapsed
+
+
+def phase(name: str):
+    """
+    Контекстный менеджер, добавляющий время блока к этапу name.
+    Этапы могут быть вложенными (например, parse внутри load).
+    """
+    if not ENABLED:
+        return _NULL_CONTEXT
+    return _phase(name)
+
+
+def stop() -> Optional[Dict[str, Any]]:
+    """
+    Останавливает профилирование и возвращает отчёт: время по этапам,
+    пик и крупнейшие места выделения памяти, функции по суммарному времени
+    """
+    global ENABLED
+    if not ENABLED:
+        return None
+    _profiler.disable()
+    wall = time.perf_counter() - _started_at
+    ENABLED = False
+
+    # Модули для отчёта импортируются после остановки, чтобы не попасть в профиль
+    import tracemalloc
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    tracemalloc.stop()
+    allocations = [{"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_bytes": stat.size, "count": stat.count}
+                   for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]]
+
+    import pstats
+    stats = pstats.Stats(_profiler)
+    functions = []
+    for (file_name, line, function), (primitive, calls, own, cumulative, _) in sorted(
+            stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]:
+        functions.append({"function": f"{file_name}:{line}({function})", "calls": calls,
+                          "primitive_calls": primitive, "tottime": own, "cumtime": cumulative})
+
+    with _phases_lock:
+        phases = [{"phase": name, "calls": int(calls), "seconds": seconds}
+                  for name, (calls, seconds) in _phases.items()]
+    report = {
+        "wall_seconds": wall,
+        "phases": phases,
+        "memory": {"current_bytes": current, "peak_bytes": peak, "top": allocations},
+        "functions": functions,
+    }
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """
+    Отчёт в текстовом виде
+    """
+    lines = [f"Общее время: {report['wall_seconds']:.6f} с", "", "Этапы (вложенные учитываются и во внешних):"]
+    for phase_stat in report["phases"]:
+        lines.append(f"  {phase_stat['phase']:<12} {phase_stat['calls']:>8} {phase_stat['seconds']:>12.6f} с")
+
+    memory = report["memory"]
+    lines += ["", f"Память: пик {memory['peak_bytes']} байт, в конце {memory['current_bytes']} байт",
+              "Крупнейшие места выделения памяти:"]
+    for allocation in memory["top"]:
+        lines.append(f"  {allocation['size_bytes']:>12} байт {allocation['count']:>8}  {allocation['location']}")
+
+    lines += ["", "Функции по суммарному времени (ncalls, tottime, cumtime):"]
+    for function in report["functions"]:
+        calls = function["calls"] if function["calls"] == function["primitive_calls"] else \
+            f"{function['calls']}/{function['primitive_calls']}"
+        lines.append(f"  {calls:>10} {function['tottime']:>10.6f} {function['cumtime']:>10.6f}  {function['function']}")
+    return "\n".join(lines) + "\n"
+
+
+def dump(file_path: str) -> None:
+    """
+    Останавливает профилирование и записывает отчёт: .json — JSON, иначе текст.
+    Полная статистика cProfile сохраняется рядом в file_path + ".pstats"
+    (читается pstats и внешними просмотрщиками).
+    """
+    report = stop()
+    if report is None:
+        return
+    _profiler.dump_stats(file_path + ".pstats")
+    if file_path.endswith(".json"):
+        text = json.dumps(report, indent=4, ensure_ascii=False) + "\n"
+    else:
+        text = format_report(report)
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.write(text)
@@ -0,0 +1,350 @@
+import abc
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, Any, Iterable, List, Optional
+
+import requests
+
+import metrics
+from api_client import API_URL, REQUEST_TIMEOUT, get_currency_rate, get_session
+from storage import atomic_write
+
+
+# Если основной источник не ответил за это время (в секундах), запрос дублируется следующему
+HEDGE_AFTER = 1.0
+# Вес нового замера в скользящем среднем задержки
+LATENCY_ALPHA = 0.3
+# Штраф к оценке источника за каждую последнюю ошибку подряд, в секундах
+ERROR_PENALTY = 5.0
+
+V4_API_URL = "https://api.exchangerate-api.com/v4/latest/{code}"
+
+
+class Provider(abc.ABC):
+    """
+    Источник курсов. fetch возвращает таблицу в формате currency_rate.json
+    (base_code, rates, provider, time_*_unix/utc) с полем source — именем источника,
+    или None при ошибке.
+    """
+
+    name = "provider"
+
+    @abc.abstractmethod
+    def fetch(self, currency_code: str, session: requests.Session, timeout=REQUEST_TIMEOUT,
+              previous: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        ...
+
+    def accepts(self, previous: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Предыдущий ответ для условного запроса, если он получен от этого источника
+        """
+        if previous is not None and previous.get('source', ErApiProvider.name) == self.name:
+            return previous
+        return None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.name!r})"
+
+
+class ErApiProvider(Provider):
+    """
+    open.er-api.com (формат v6) — ответы уже в формате currency_rate.json
+    """
+
+    name = "er-api"
+
+    def __init__(self, base_url: str = API_URL, name: Optional[str] = None):
+        self.base_url = base_url
+        if name is not None:
+            self.name = name
+
+    def fetch(self, currency_code, session, timeout=REQUEST_TIMEOUT, previous=None):
+        data = get_currency_rate(currency_code, session=session, base_url=self.base_url, timeout=timeout,
+                                 previous=self.accepts(previous))
+        if data is None or data.get('result') == 'error' or 'rates' not in data:
+            return None
+        data['source'] = self.name
+        return data
+
+
+class ExchangeRateApiV4Provider(Provider):
+    """
+    api.exchangerate-api.com/v4 — те же курсы в другом формате:
+    base, date, time_last_updated и rates
+    """
+
+    name = "exchangerate-api-v4"
+
+    def __init__(self, base_url: str = V4_API_URL, name: Optional[str] = None):
+        self.base_url = base_url
+        if name is not None:
+            self.name = name
+
+    def fetch(self, currency_code, session, timeout=REQUEST_TIMEOUT, previous=None):
+        previous = self.accepts(previous)
+        data = get_currency_rate(currency_code, session=session, base_url=self.base_url, timeout=timeout,
+                                 previous=previous)
+        if data is None or 'rates' not in data:
+            return None
+        if data.get('source') == self.name:
+            # Ответ 304: предыдущая таблица (уже нормализованная) с продлённым сроком
+            return data
+
+        updated = int(data.get('time_last_updated') or time.time())
+        # Провайдер обновляет курсы раз в сутки
+        next_update = updated + 86400
+        payload = {
+            'result': 'success',
+            'provider': data.get('provider', "https://www.exchangerate-api.com"),
+            'time_last_update_unix': updated,
+            'time_last_update_utc': time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(updated)),
+            'time_next_update_unix': next_update,
+            'time_next_update_utc': time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(next_update)),
+            'base_code': data.get('base', currency_code),
+            'rates': data['rates'],
+            'source': self.name,
+        }
+        for key in ('etag', 'last_modified'):
+            if key in data:
+                payload[key] = data[key]
+        return payload
+
+
+# Источники по имени для настройки из командной строки
+PROVIDER_TYPES = {
+    ErApiProvider.name: ErApiProvider,
+    ExchangeRateApiV4Provider.name: ExchangeRateApiV4Provider,
+}
+DEFAULT_PROVIDERS = (ErApiProvider.name, ExchangeRateApiV4Provider.name)
+
+
+class ProviderStats:
+    """
+    Статистика источника: скользящее среднее задержки и ошибки
+    """
+
+    __slots__ = ("latency", "successes", "errors", "consecutive_errors")
+
+    def __init__(self):
+        self.latency: Optional[float] = None
+        self.successes = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        if ok:
+            self.successes += 1
+            self.consecutive_errors = 0
+            self.latency = elapsed if self.latency is None else \
+                self.latency + LATENCY_ALPHA * (elapsed - self.latency)
+        else:
+            self.errors += 1
+            self.consecutive_errors += 1
+
+    def score(self, unknown_latency: float = 0.0) -> float:
+        """
+        Оценка для порядка опроса: меньше — лучше.
+        unknown_latency — задержка, предполагаемая для ещё не ответившего источника.
+        """
+        latency = unknown_latency if self.latency is None else self.latency
+        return latency + self.consecutive_errors * ERROR_PENALTY
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"latency": self.latency, "successes": self.successes, "errors": self.errors,
+                "consecutive_errors": self.consecutive_errors}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ProviderStats":
+        stats = cls()
+        latency = data.get("latency")
+        stats.latency = None if latency is None else float(latency)
+        stats.successes = int(data.get("successes", 0))
+        stats.errors = int(data.get("errors", 0))
+        stats.consecutive_errors = int(data.get("consecutive_errors", 0))
+        return stats
+
+
+def stats_path(file_path: str) -> str:
+    """
+    Файл статистики источников рядом с файлом курсов: currency_rate.json -> currency_rate.providers.json
+    """
+    root, _ = os.path.splitext(file_path)
+    return root + ".providers.json"
+
+
+def _read_stats(file_path: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class ProviderPool:
+    """
+    Несколько источников курсов с дублированием запросов и переключением при ошибках.
+
+    Источники опрашиваются в порядке оценки (задержка и последние ошибки).
+    Если первый не ответил за hedge_after
+    секунд, тот же запрос отправляется следующему, и берётся первый успешный
+    ответ. Ошибка источника сразу передаёт запрос следующему.
+
+    Запросы выполняются в потоках-демонах: проигравший гонку запрос завершается
+    в фоне (и учитывается в статистике), но не задерживает выход из процесса.
+
+    Статистика переживает процесс через load_stats/save_stats, поэтому порядок
+    подстраивается и в разовых запусках CLI, а не только в serve.
+    """
+
+    def __init__(self, providers: Iterable[Provider], hedge_after: float = HEDGE_AFTER,
+                 session: Optional[requests.Session] = None, timeout=REQUEST_TIMEOUT):
+        self.providers = list(providers)
+        if not self.providers:
+            raise ValueError("Нужен хотя бы один источник курсов")
+        self.hedge_after = hedge_after
+        self.session = session
+        self.timeout = timeout
+        self.stats = {provider.name: ProviderStats() for provider in self.providers}
+        self._lock = threading.Lock()
+
+    def ordered(self) -> List[Provider]:
+        """
+        Источники в порядке опроса. Неопробованному источнику приписывается задержка
+        hedge_after: он идёт после быстрых, но раньше заведомо медленных.
+        """
+        with self._lock:
+            scores = {provider.name: self.stats[provider.name].score(self.hedge_after)
+                      for provider in self.providers}
+        # sorted устойчива: при равных оценках сохраняется порядок настройки
+        return sorted(self.providers, key=lambda provider: scores[provider.name])
+
+    def _call(self, provider: Provider, currency_code: str,
+              previous: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        start = time.perf_counter()
+        try:
+            result = provider.fetch(currency_code, self.session or get_session(), self.timeout, previous)
+        except Exception as e:
+            print(f"Ошибка источника {provider.name}: {e}")
+            result = None
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.stats[provider.name].record(elapsed, result is not None)
+        if metrics.ENABLED:
+            metrics.observe("provider_fetch_seconds", elapsed, provider=provider.name)
+            metrics.inc("provider_fetch_total", provider=provider.name,
+                        status="ok" if result is not None else "error")
+        return result
+
+    def _run(self, provider: Provider, currency_code: str, previous: Optional[Dict[str, Any]],
+             results: "queue.Queue[Optional[Dict[str, Any]]]") -> None:
+        results.put(self._call(provider, currency_code, previous))
+
+    def fetch(self, currency_code: str, previous: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Таблица курсов валюты от первого успешно ответившего источника; None, если ответа нет ни от кого
+        """
+        remaining = iter(self.ordered())
+        results: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        pending = 0
+
+        def launch() -> bool:
+            nonlocal pending
+            provider = next(remaining, None)
+            if provider is None:
+                return False
+            if pending and metrics.ENABLED:
+                metrics.inc("provider_hedged_total", provider=provider.name)
+            threading.Thread(target=self._run, args=(provider, currency_code, previous, results),
+                             name=f"provider-{provider.name}", daemon=True).start()
+            pending += 1
+            return True
+
+        launch()
+        while pending:
+            try:
+                result = results.get(timeout=self.hedge_after)
+            except queue.Empty:
+                # Источник медлит — дублируем запрос следующему
+                launch()
+                continue
+            pending -= 1
+            if result is not None:
+                return result
+            # Ошибка — сразу переключаемся на следующий источник
+            launch()
+        return None
+
+    def load_stats(self, file_path: str) -> bool:
+        """
+        Продолжает статистику, сохранённую прошлыми запусками (save_stats).
+        Применяется только к пулу, который ещё ничего не запрашивал: накопленная
+        в памяти статистика (например, в serve) не перезаписывается.
+        """
+        saved = _read_stats(file_path)
+        with self._lock:
+            if any(stat.successes or stat.errors for stat in self.stats.values()):
+                return False
+            loaded = False
+            for name in self.stats:
+                try:
+                    self.stats[name] = ProviderStats.from_dict(saved[name])
+                    loaded = True
+                except (KeyError, TypeError, ValueError, AttributeError):
+                    continue
+            return loaded
+
+    def save_stats(self, file_path: str) -> bool:
+        """
+        Сохраняет статистику для следующих запусков; записи других источников
+        в файле остаются. Ошибки записи не критичны.
+        """
+        data = _read_stats(file_path)
+        with self._lock:
+            data.update((name, stat.to_dict()) for name, stat in self.stats.items())
+        try:
+            with atomic_write(file_path, sync=False) as file:
+                json.dump(data, file, ensure_ascii=False, indent=2)
+            return True
+        except OSError:
+            return False
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Статистика источников в текущем порядке опроса
+        """
+        with self._lock:
+            stats = {name: stat.to_dict() for name, stat in self.stats.items()}
+        return {provider.name: stats[provider.name] for provider in self.ordered()}
+
+
+def create_pool(names: Iterable[str] = DEFAULT_PROVIDERS, hedge_after: float = HEDGE_AFTER) -> ProviderPool:
+    """
+    Создаёт пул источников по именам из PROVIDER_TYPES
+    """
+    providers = []
+    for name in names:
+        if name not in PROVIDER_TYPES:
+            raise ValueError(f"Неизвестный источник курсов: {name}. Доступные: {', '.join(PROVIDER_TYPES)}")
+        providers.append(PROVIDER_TYPES[name]())
+    return ProviderPool(providers, hedge_after)
+
+
+_pool: Optional[ProviderPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ProviderPool:
+    """
+    Общий для процесса пул источников по умолчанию: статистика накапливается между обновлениями,
+    а update_currency_rates сохраняет её рядом с файлом курсов для следующих запусков
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool()
+        return _pool
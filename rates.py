@@ -0,0 +1,390 @@
+import copy
+import math
+from array import array
+from collections import deque
+from typing import Dict, Any, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
+
+from constants import PATH_POLICIES
+from diff import SnapshotDiff
+from storage import RateData
+
+
+# Политика выбора пути по умолчанию (варианты — constants.PATH_POLICIES)
+PATH_POLICY = "hops"
+
+# Служебные значения матрицы маршрутов; неотрицательное значение — номер таблицы
+NO_ROUTE = -1
+MULTI_TABLE = -2
+SAME_CURRENCY = -3
+
+# Доля изменившихся котировок, при которой таблица строится заново, а не обновляется
+INCREMENTAL_LIMIT = 0.25
+
+
+class Hop(NamedTuple):
+    """
+    Шаг пути пересчёта: котировка to_currency за единицу from_currency из таблицы table
+    """
+    from_currency: str
+    to_currency: str
+    table: str
+    rate: float
+
+
+class RateTable:
+    """
+    Таблица кросс-курсов, построенная один раз для загруженного снимка.
+
+    Таблицы снимка образуют граф курсов: базовая валюта каждой таблицы связана
+    со всеми котируемыми в ней валютами. Для всех пар заранее выбирается лучший
+    путь по политике PATH_POLICY: прямая котировка, обратная котировка, пересчёт
+    внутри одной таблицы и, если ни одна таблица не содержит обе валюты, кратчайшая
+    цепочка через несколько таблиц. Курс любой пары — одно обращение к матрице,
+    а выбранный путь можно получить через path().
+    """
+
+    def __init__(self, data: Union[Dict[str, Any], RateData], policy: Optional[str] = None):
+        if policy is None:
+            policy = PATH_POLICY
+        if policy not in PATH_POLICIES:
+            raise ValueError(f"Неизвестная политика выбора пути: {policy}")
+        self.policy = policy
+
+        if not isinstance(data, RateData):
+            data = RateData.from_dict(data)
+        # Коды и индекс общие со снимком
+        self.codes: Tuple[str, ...] = data.codes
+        self.index: Dict[str, int] = data.index
+        self.main_currencies: List[str] = data.main_currencies
+
+        # Для каждой таблицы: базовая валюта, курсы по индексам валют и время публикации
+        self.tables: List[str] = []
+        self._bases: List[int] = []
+        self._rates: List[Dict[int, float]] = []
+        self._times: List[int] = []
+        for code, table in data.tables.items():
+            base = self.index[table.base_code]
+            rates = {i: rate for i, rate in enumerate(table.rates) if not math.isnan(rate)}
+            rates[base] = 1.0
+            self.tables.append(code)
+            self._bases.append(base)
+            self._rates.append(rates)
+            self._times.append(table.time_last_update_unix or 0)
+
+        n = len(self.codes)
+        self.matrix = array('d', [math.nan]) * (n * n)
+        self.route = array('i', [NO_ROUTE]) * (n * n)
+        self._long_paths: Dict[int, List[Tuple[int, int, int]]] = {}
+        # Пары (индексы матрицы), курс которых изменился при последнем updated();
+        # None — таблица построена заново
+        self.changed: Optional[Set[int]] = None
+        self._resolve()
+
+    def _order(self, times: List[int]) -> List[int]:
+        """
+        Таблицы от самой свежей к самой старой; при равном времени — по коду
+        """
+        return sorted(range(len(self.tables)), key=lambda t: (-times[t], self.tables[t]))
+
+    def _resolve(self) -> None:
+        """
+        Заполняет матрицы курсов и маршрутов для всех пар валют
+        """
+        n = len(self.codes)
+        matrix = self.matrix
+        route = self.route
+        for i in range(n):
+            matrix[i * n + i] = 1.0
+            route[i * n + i] = SAME_CURRENCY
+        unresolved = n * n - n
+        order = self._order(self._times)
+
+        if self.policy == "hops":
+            # Прямые котировки из таблицы исходной валюты
+            for t in order:
+                row = self._bases[t] * n
+                for j, rate in self._rates[t].items():
+                    k = row + j
+                    if route[k] == NO_ROUTE and rate:
+                        route[k] = t
+                        matrix[k] = rate
+                        unresolved -= 1
+            # Обратные котировки из таблицы целевой валюты
+            for t in order:
+                base = self._bases[t]
+                for i, rate in self._rates[t].items():
+                    k = i * n + base
+                    if route[k] == NO_ROUTE and rate:
+                        route[k] = t
+                        matrix[k] = 1 / rate
+                        unresolved -= 1
+
+        # Пересчёт внутри одной таблицы через её базовую валюту
+        for t in order:
+            if not unresolved:
+                break
+            quotes = [(i, rate) for i, rate in self._rates[t].items() if rate]
+            for i, from_rate in quotes:
+                row = i * n
+                for j, to_rate in quotes:
+                    k = row + j
+                    if route[k] == NO_ROUTE:
+                        route[k] = t
+                        matrix[k] = to_rate / from_rate
+                        unresolved -= 1
+
+        if unresolved:
+            self._resolve_long_paths()
+
+    def _resolve_long_paths(self) -> None:
+        """
+        Для пар, которых нет ни в одной таблице вместе, ищет кратчайшую
+        цепочку котировок через несколько таблиц (поиск в ширину)
+        """
+        n = len(self.codes)
+        adjacency: List[List[Tuple[int, int]]] = [[] for _ in range(n)]
+        for t, rates in enumerate(self._rates):
+            base = self._bases[t]
+            for j, rate in rates.items():
+                if j != base and rate:
+                    adjacency[base].append((j, t))
+                    adjacency[j].append((base, t))
+
+        for source in range(n):
+            row = source * n
+            if NO_ROUTE not in self.route[row:row + n]:
+                continue
+
+            parents: Dict[int, Tuple[int, int]] = {source: (source, NO_ROUTE)}
+            queue = deque([source])
+            while queue:
+                node = queue.popleft()
+                for neighbour, t in adjacency[node]:
+                    if neighbour not in parents:
+                        parents[neighbour] = (node, t)
+                        queue.append(neighbour)
+
+            for target in range(n):
+                k = row + target
+                if self.route[k] != NO_ROUTE or target not in parents:
+                    continue
+                steps = []
+                node = target
+                while node != source:
+                    previous, t = parents[node]
+                    steps.append((previous, node, t))
+                    node = previous
+                steps.reverse()
+                rate = 1.0
+                for from_i, to_i, t in steps:
+                    rate *= self._rates[t][to_i] / self._rates[t][from_i]
+                self.matrix[k] = rate
+                self.route[k] = MULTI_TABLE
+                self._long_paths[k] = steps
+
+    def updated(self, data: RateData, diff: SnapshotDiff) -> "RateTable":
+        """
+        Таблица для снимка data, отличающегося от текущего на diff.
+        Если граф курсов не изменился (те же валюты и таблицы, те же котировки
+        и порядок свежести таблиц), выбранные пути остаются прежними и пересчитываются
+        только пары, путь которых проходит через изменившиеся котировки.
+        Иначе, а также если изменилось больше INCREMENTAL_LIMIT котировок,
+        таблица строится заново.
+        """
+        if diff.structural or data.codes != self.codes or list(data.tables) != self.tables:
+            return RateTable(data, self.policy)
+        times = [data.tables[code].time_last_update_unix or 0 for code in self.tables]
+        if self._order(times) != self._order(self._times):
+            return RateTable(data, self.policy)
+        if len(diff) > INCREMENTAL_LIMIT * sum(len(rates) - 1 for rates in self._rates):
+            return RateTable(data, self.policy)
+
+        table = copy.copy(self)
+        table.matrix = array('d', self.matrix)
+        table._rates = list(self._rates)
+        table._times = times
+        table.changed = set()
+        if not diff.changes:
+            return table
+
+        n = len(self.codes)
+        index = self.index
+        matrix = table.matrix
+        route = self.route
+        positions = {code: t for t, code in enumerate(self.tables)}
+        changed_quotes: Dict[int, Set[int]] = {}
+        for base, quotes in diff.changes.items():
+            t = positions[base]
+            rates = dict(self._rates[t])
+            for code, (_, rate) in quotes.items():
+                rates[index[code]] = rate
+            table._rates[t] = rates
+            changed_quotes[t] = {index[code] for code in quotes}
+
+        # Курс внутри таблицы: rates[j] / rates[i]; прямые и обратные котировки —
+        # частные случаи с курсом базовой валюты 1.0
+        changed = table.changed
+        for t, quotes in changed_quotes.items():
+            rates = table._rates[t]
+            for i in quotes:
+                row = i * n
+                from_rate = rates[i]
+                for j, to_rate in rates.items():
+                    k = row + j
+                    if route[k] == t:
+                        matrix[k] = to_rate / from_rate
+                        changed.add(k)
+                    k = j * n + i
+                    if route[k] == t:
+                        matrix[k] = from_rate / to_rate
+                        changed.add(k)
+
+        for k, steps in self._long_paths.items():
+            if any(t in changed_quotes and (from_i in changed_quotes[t] or to_i in changed_quotes[t])
+                   for from_i, to_i, t in steps):
+                rate = 1.0
+                for from_i, to_i, t in steps:
+                    rate *= table._rates[t][to_i] / table._rates[t][from_i]
+                matrix[k] = rate
+                changed.add(k)
+        return table
+
+    def rate_changed(self, from_currency: str, to_currency: str) -> bool:
+        """
+        Изменился ли курс пары при последнем updated() (True, если таблица построена заново)
+        """
+        if self.changed is None:
+            return True
+        return self.index[from_currency] * len(self.codes) + self.index[to_currency] in self.changed
+
+    def __contains__(self, currency_code: str) -> bool:
+        return currency_code in self.index
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """
+        Возвращает курс: сколько единиц to_currency в одной единице from_currency.
+        None, если для пары нет пути пересчёта.
+        """
+        rate = self.matrix[self.index[from_currency] * len(self.codes) + self.index[to_currency]]
+        if math.isnan(rate):
+            return None
+        return rate
+
+    def path(self, from_currency: str, to_currency: str) -> Optional[List[Hop]]:
+        """
+        Возвращает выбранный путь пересчёта пары по шагам (пустой для одной и той же валюты).
+        None, если пути нет.
+        """
+        i = self.index[from_currency]
+        j = self.index[to_currency]
+        k = i * len(self.codes) + j
+        t = self.route[k]
+        if t == SAME_CURRENCY:
+            return []
+        if t == NO_ROUTE:
+            return None
+
+        codes = self.codes
+        if t == MULTI_TABLE:
+            return [Hop(codes[from_i], codes[to_i], self.tables[table],
+                        self._rates[table][to_i] / self._rates[table][from_i])
+                    for from_i, to_i, table in self._long_paths[k]]
+
+        base = self._bases[t]
+        table = self.tables[t]
+        if base in (i, j):
+            return [Hop(from_currency, to_currency, table, self.matrix[k])]
+        rates = self._rates[t]
+        return [Hop(from_currency, codes[base], table, 1 / rates[i]),
+                Hop(codes[base], to_currency, table, rates[j])]
+
+    def convert(self, from_currency: str, to_currency: str, amount: float) -> Optional[float]:
+        """
+        Конвертирует сумму из одной валюты в другую
+        """
+        if from_currency == to_currency:
+            return amount
+        rate = self.rate(from_currency, to_currency)
+        if rate is None:
+            return None
+        return amount * rate
+
+
+# Таблица для pair_rate: код, индекс базовой валюты, курсы по индексам валют (NaN — нет котировки), время публикации
+RouteTable = Tuple[str, int, Sequence[float], int]
+
+
+def pair_rate(tables: Sequence[RouteTable], i: int, j: int, policy: Optional[str] = None) -> Optional[float]:
+    """
+    Курс одной пары (индексы валют i и j) по тем же правилам выбора пути, что и RateTable,
+    но без матрицы всех пар: для разовых запросов к снимкам истории.
+    None, если для пары нет пути пересчёта.
+    """
+    if i == j:
+        return 1.0
+    if policy is None:
+        policy = PATH_POLICY
+
+    def quote(t: int, code: int) -> Optional[float]:
+        _, base, rates, _ = tables[t]
+        if code == base:
+            return 1.0
+        rate = rates[code]
+        return None if math.isnan(rate) or not rate else rate
+
+    order = sorted(range(len(tables)), key=lambda t: (-tables[t][3], tables[t][0]))
+    if policy == "hops":
+        # Прямая котировка из таблицы исходной валюты, затем обратная из таблицы целевой
+        for t in order:
+            if tables[t][1] == i:
+                rate = quote(t, j)
+                if rate is not None:
+                    return rate
+        for t in order:
+            if tables[t][1] == j:
+                rate = quote(t, i)
+                if rate is not None:
+                    return 1 / rate
+
+    # Пересчёт внутри одной таблицы через её базовую валюту
+    for t in order:
+        from_rate = quote(t, i)
+        to_rate = quote(t, j)
+        if from_rate is not None and to_rate is not None:
+            return to_rate / from_rate
+
+    # Цепочка через несколько таблиц: тот же поиск в ширину, что и в RateTable._resolve_long_paths
+    if not tables:
+        return None
+    n = len(tables[0][2])
+    adjacency: List[List[Tuple[int, int]]] = [[] for _ in range(n)]
+    for t, (_, base, _, _) in enumerate(tables):
+        for code in range(n):
+            if code != base and quote(t, code) is not None:
+                adjacency[base].append((code, t))
+                adjacency[code].append((base, t))
+
+    parents: Dict[int, Tuple[int, int]] = {i: (i, NO_ROUTE)}
+    queue = deque([i])
+    while queue and j not in parents:
+        node = queue.popleft()
+        for neighbour, t in adjacency[node]:
+            if neighbour not in parents:
+                parents[neighbour] = (node, t)
+                queue.append(neighbour)
+    if j not in parents:
+        return None
+
+    steps = []
+    node = j
+    while node != i:
+        previous, t = parents[node]
+        steps.append((previous, node, t))
+        node = previous
+    rate = 1.0
+    for from_i, to_i, t in reversed(steps):
+        rate *= quote(t, to_i) / quote(t, from_i)
+    return rate
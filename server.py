@@ -0,0 +1,294 @@
+import asyncio
+import json
+import math
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from converter import Converter, ConverterError, CurrencyNotFoundError, RatesUnavailableError
+from snapshot import Snapshot, SnapshotCache, get_cache, refresh_rates
+
+
+# Как часто проверять файл и свежесть курсов, в секундах
+CHECK_INTERVAL = 5
+MAX_BODY_SIZE = 64 * 1024 * 1024
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ApiError(Exception):
+    """
+    Ошибка запроса, возвращаемая клиенту с HTTP-статусом
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ConversionService:
+    """
+    Сервис конвертации: держит снимок курсов в памяти и отвечает на запросы
+    без обращения к файлу. Новый снимок подменяет текущий целиком.
+    """
+
+    def __init__(self, cache: SnapshotCache):
+        self.cache = cache
+        self.snapshot: Optional[Snapshot] = None
+        self.converter: Optional[Converter] = None
+
+    def reload(self) -> None:
+        """
+        Берёт актуальный снимок из кэша и запускает фоновое обновление устаревших курсов
+        """
+        file_path = self.cache.file_path
+        try:
+            snapshot = self.cache.get()
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Ошибка загрузки курсов: {e}")
+            if self.snapshot is None:
+                self.cache.refresh_async(lambda: refresh_rates(file_path))
+            return
+        if snapshot is not self.snapshot:
+            self.converter = Converter(snapshot, self.converter)
+            self.snapshot = snapshot
+        if not snapshot.is_fresh():
+            self.cache.refresh_async(lambda: refresh_rates(file_path))
+
+    def _converter(self) -> Converter:
+        converter = self.converter
+        if converter is None or not len(converter):
+            raise ApiError(503, "Нет данных о курсах валют")
+        return converter
+
+    def convert(self, from_currency: str, to_currency: str, amount: Any,
+                with_path: bool = False) -> Dict[str, Any]:
+        converter = self._converter()
+        rate = converter.rate(str(from_currency), str(to_currency))
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise ApiError(400, f"'{amount}' не является допустимым числом")
+        # nan и inf проходят float(), но в JSON-ответе недопустимы
+        if not math.isfinite(amount):
+            raise ApiError(400, f"'{amount}' не является допустимым числом")
+        result = amount * rate
+        if not math.isfinite(result):
+            raise ApiError(400, f"Сумма {amount} слишком велика")
+
+        response = {"from": str(from_currency).upper(), "to": str(to_currency).upper(), "amount": amount,
+                    "rate": rate, "result": result}
+        if with_path:
+            response["path"] = [hop._asdict() for hop in converter.path(str(from_currency), str(to_currency))]
+        return response
+
+    def convert_batch(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        self._converter()
+        results = []
+        for record in records:
+            try:
+                if not isinstance(record, dict):
+                    raise ApiError(400, "Запись должна быть объектом {from, to, amount}")
+                results.append(self.convert(record.get("from"), record.get("to"), record.get("amount")))
+            except ApiError as e:
+                results.append({"error": e.message})
+            except ConverterError as e:
+                results.append({"error": str(e)})
+        return results
+
+    def currency_info(self, currency_code: str) -> Dict[str, Any]:
+        return self._converter().currency_info(currency_code)._asdict()
+
+    def currencies(self) -> Dict[str, Any]:
+        currencies = self._converter().currencies
+        return {"currencies": currencies, "count": len(currencies)}
+
+    def health(self) -> Dict[str, Any]:
+        age = self.snapshot.age() if self.snapshot is not None else None
+        return {
+            "status": "ok" if self.snapshot is not None and len(self.snapshot.table) else "no-data",
+            "snapshot_age": age,
+            "fresh": self.snapshot.is_fresh() if self.snapshot is not None else False,
+            "refreshing": self.cache.refreshing,
+            "cache": self.cache.stats(),
+        }
+
+    def handle(self, method: str, target: str, body: bytes) -> Tuple[int, Any]:
+        """
+        Разбирает запрос и возвращает HTTP-статус и объект ответа
+        """
+        if not metrics.ENABLED:
+            return self._dispatch(method, target, body)
+
+        start = time.perf_counter()
+        status, payload = self._dispatch(method, target, body)
+        endpoint = urlsplit(target).path.rstrip("/")
+        if endpoint.startswith("/currency/"):
+            endpoint = "/currency"
+        elif endpoint not in ("/convert", "/currencies", "/health", "/metrics"):
+            endpoint = "other"
+        metrics.observe("http_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+        metrics.inc("http_requests_total", endpoint=endpoint, status=status)
+        return status, payload
+
+    def _dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, Any]:
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        try:
+            if path == "/convert" and method == "GET":
+                return 200, self.convert(query.get("from", ""), query.get("to", ""), query.get("amount", ""),
+                                         query.get("path") in ("1", "true"))
+            if path == "/convert" and method == "POST":
+                return 200, self.convert_batch(parse_records(body))
+            if path.startswith("/currency/") and method == "GET":
+                return 200, self.currency_info(path[len("/currency/"):])
+            if path == "/currencies" and method == "GET":
+                return 200, self.currencies()
+            if path == "/health" and method == "GET":
+                return 200, self.health()
+            if path == "/metrics" and method == "GET":
+                return 200, metrics.export_prometheus()
+            if path in ("/convert", "/currencies", "/health", "/metrics") or path.startswith("/currency/"):
+                raise ApiError(405, f"Метод {method} не поддерживается")
+            raise ApiError(404, f"Неизвестный путь {path}")
+        except ApiError as e:
+            return e.status, {"error": e.message}
+        except RatesUnavailableError as e:
+            return 503, {"error": str(e)}
+        except CurrencyNotFoundError as e:
+            return 404, {"error": str(e), "suggestions": e.suggestions}
+        except ConverterError as e:
+            return 404, {"error": str(e)}
+
+
+def parse_records(body: bytes) -> List[Any]:
+    """
+    Разбирает тело пакетного запроса: JSON-массив или JSONL
+    """
+    try:
+        text = body.decode("utf-8").strip()
+        if text.startswith("["):
+            return json.loads(text)
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    except ValueError:
+        raise ApiError(400, "Тело запроса должно быть JSON-массивом или JSONL")
+
+
+def encode_response(status: int, payload: Any, keep_alive: bool) -> bytes:
+    """
+    Кодирует ответ: строка отдаётся как текст (метрики Prometheus), остальное — как JSON
+    """
+    if isinstance(payload, str):
+        body = payload.encode("utf-8")
+        content_type = "text/plain; version=0.0.4"
+    else:
+        body = json.dumps(payload, ensure_ascii=False, allow_nan=False).encode("utf-8")
+        content_type = "application/json"
+    head = (
+        f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("ascii") + body
+
+
+async def handle_connection(service: ConversionService, reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter) -> None:
+    """
+    Обрабатывает соединение HTTP/1.1 с поддержкой keep-alive
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            try:
+                method, target, version = request_line.decode("latin-1").split()
+            except ValueError:
+                writer.write(encode_response(400, {"error": "Некорректный запрос"}, False))
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close") or \
+                headers.get("connection", "").lower() == "keep-alive"
+            try:
+                length = int(headers.get("content-length", "0") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                writer.write(encode_response(400, {"error": "Некорректный заголовок Content-Length"}, False))
+                break
+            if length > MAX_BODY_SIZE:
+                writer.write(encode_response(413, {"error": "Слишком большой запрос"}, False))
+                break
+            body = await reader.readexactly(length) if length else b""
+
+            try:
+                status, payload = service.handle(method.upper(), target, body)
+                response = encode_response(status, payload, keep_alive)
+            except Exception as e:
+                # Непредвиденная ошибка (в том числе ответ, не кодируемый в JSON)
+                # не должна обрывать соединение без ответа
+                print(f"Ошибка обработки запроса {method} {target}: {e!r}")
+                response = encode_response(500, {"error": "Внутренняя ошибка сервиса"}, keep_alive)
+            writer.write(response)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def watch_snapshot(service: ConversionService, interval: float) -> None:
+    """
+    Периодически подхватывает новый снимок (после обновления этим или другим процессом).
+    Чтение файла, разница и обновление таблицы выполняются в пуле потоков,
+    чтобы не задерживать обработку запросов.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        await loop.run_in_executor(None, service.reload)
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8080, unix_path: Optional[str] = None,
+                file_path: str = "currency_rate.json", check_interval: float = CHECK_INTERVAL) -> None:
+    """
+    Запускает сервис конвертации на TCP-порту или Unix-сокете
+    """
+    service = ConversionService(get_cache(file_path))
+    service.reload()
+    metrics.gauge_callback("snapshot_age_seconds",
+                           lambda: service.snapshot.age() if service.snapshot is not None else None)
+
+    def client_connected(reader, writer):
+        return handle_connection(service, reader, writer)
+
+    if unix_path:
+        server = await asyncio.start_unix_server(client_connected, path=unix_path)
+        print(f"Сервис конвертации запущен на {unix_path}")
+    else:
+        server = await asyncio.start_server(client_connected, host, port)
+        print(f"Сервис конвертации запущен на http://{host}:{port}")
+
+    watcher = asyncio.ensure_future(watch_snapshot(service, check_interval))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        watcher.cancel()
@@ -0,0 +1,357 @@
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import metrics
+from catalog import CurrencyCatalog, load_catalog, save_catalog
+from diff import SnapshotDiff, diff_snapshots
+from rates import RateTable
+from storage import FRESHNESS_GRACE_SECONDS, RateData, file_lock, is_data_fresh, last_update_time, read_snapshot
+
+
+_versions = itertools.count(1)
+
+
+class Snapshot:
+    """
+    Загруженный снимок курсов: компактная модель данных и построенная по ней таблица.
+    Если передан предыдущий снимок, вычисляется разница с ним (diff), а таблица
+    кросс-курсов обновляется по этой разнице, а не строится заново.
+    source — файл курсов и его ключ (mtime_ns, размер): справочник валют
+    читается из файла рядом с ним, а построенный заново сохраняется туда.
+    """
+
+    def __init__(self, data: Union[Dict[str, Any], RateData], mtime: Optional[float] = None,
+                 previous: Optional["Snapshot"] = None, source: Optional[Tuple[str, Tuple[int, int]]] = None):
+        if not isinstance(data, RateData):
+            data = RateData.from_dict(data)
+        self.data = data
+        self.version = next(_versions)
+        self.source = source
+        self._catalog: Optional[CurrencyCatalog] = None
+        # Разница с предыдущим снимком и его версия; сам предыдущий снимок не хранится
+        self.diff: Optional[SnapshotDiff] = None
+        self.diff_base: Optional[int] = None
+        if previous is not None:
+            self.diff = diff_snapshots(previous.data, data)
+            self.diff_base = previous.version
+            self.table = previous.table.updated(data, self.diff)
+            if not self.diff.structural:
+                # Набор валют и таблиц прежний — справочник тоже
+                self._catalog = previous._catalog
+        else:
+            self.table = RateTable(data)
+        self.loaded_at = time.time()
+        self.mtime = mtime
+
+    @property
+    def catalog(self) -> CurrencyCatalog:
+        """
+        Справочник валют снимка; строится (или читается из файла) при первом обращении
+        """
+        catalog = self._catalog
+        if catalog is None:
+            if self.source is not None:
+                catalog = load_catalog(*self.source)
+            if catalog is None:
+                catalog = CurrencyCatalog.from_data(self.data)
+                if self.source is not None:
+                    save_catalog(catalog, *self.source)
+            self._catalog = catalog
+        return catalog
+
+    def is_fresh(self, hours: int = 24, grace_seconds: int = FRESHNESS_GRACE_SECONDS) -> bool:
+        """
+        Проверяет свежесть снимка по расписанию провайдера,
+        а если его нет — по времени изменения файла
+        """
+        fresh = is_data_fresh(self.data, grace_seconds)
+        if fresh is not None:
+            return fresh
+        if self.mtime is None:
+            return False
+        return time.time() - self.mtime < hours * 3600
+
+    def age(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Возвращает возраст снимка в секундах: с момента публикации курсов
+        провайдером, а если это время неизвестно — с момента изменения файла
+        """
+        published = last_update_time(self.data) or self.mtime
+        if published is None:
+            return None
+        if now is None:
+            now = time.time()
+        return now - published
+
+
+class SnapshotCache:
+    """
+    Хранит разобранный снимок в памяти и перечитывает файл,
+    только если изменились его mtime или размер
+    """
+
+    def __init__(self, file_path: str = "currency_rate.json"):
+        self.file_path = file_path
+        self.hits = 0
+        self.misses = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._key: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._subscribers: List[Callable[[SnapshotDiff, Snapshot], Any]] = []
+
+    def subscribe(self, callback: Callable[[SnapshotDiff, Snapshot], Any]) -> None:
+        """
+        Вызывает callback(diff, snapshot) каждый раз, когда новый снимок
+        подменяет предыдущий, — только если курсы действительно изменились
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[SnapshotDiff, Snapshot], Any]) -> None:
+        self._subscribers.remove(callback)
+
+    def _notify(self, snapshot: Snapshot) -> None:
+        if not snapshot.diff:
+            return
+        for callback in list(self._subscribers):
+            try:
+                callback(snapshot.diff, snapshot)
+            except Exception as e:
+                print(f"Ошибка обработчика изменения курсов: {e}")
+
+    def get(self) -> Snapshot:
+        """
+        Возвращает снимок из памяти или перечитывает файл при его изменении.
+        Пока идёт фоновое обновление, отдаётся текущий снимок без обращения к файлу.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and self.refreshing:
+            self.hits += 1
+            if metrics.ENABLED:
+                metrics.inc("snapshot_cache_hits_total")
+            return snapshot
+        return self.latest()
+
+    def latest(self) -> Snapshot:
+        """
+        Снимок по текущему содержимому файла, в том числе во время фонового обновления:
+        файл перечитывается, только если он изменился
+        """
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Файл {self.file_path} не найден")
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            if self._snapshot is not None and self._key == key:
+                self.hits += 1
+                if metrics.ENABLED:
+                    metrics.inc("snapshot_cache_hits_total")
+                return self._snapshot
+
+            self.misses += 1
+            if metrics.ENABLED:
+                metrics.inc("snapshot_cache_misses_total")
+            snapshot = Snapshot(read_snapshot(self.file_path), stat.st_mtime, self._snapshot,
+                                (self.file_path, key))
+            self._snapshot = snapshot
+            self._key = key
+        self._notify(snapshot)
+        return snapshot
+
+    def reload(self) -> Snapshot:
+        """
+        Перечитывает файл и атомарно подменяет снимок в памяти
+        """
+        stat = os.stat(self.file_path)
+        data = read_snapshot(self.file_path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            snapshot = Snapshot(data, stat.st_mtime, self._snapshot, (self.file_path, key))
+            self._snapshot = snapshot
+            self._key = key
+        self._notify(snapshot)
+        return snapshot
+
+    @property
+    def refreshing(self) -> bool:
+        thread = self._refresh_thread
+        return thread is not None and thread.is_alive()
+
+    def refresh_async(self, refresh: Callable[[], Any]) -> bool:
+        """
+        Запускает обновление в фоновом потоке, если оно ещё не идёт.
+        После завершения refresh() новый снимок подменяет текущий;
+        при ошибке остаётся последний удачный снимок.
+        Поток — демон: он не держит сервис при остановке. Разовая команда перед выходом
+        дожидается его через wait_for_refreshes (не дольше REFRESH_WAIT_TIMEOUT).
+        Файл курсов записывается атомарно, поэтому прерванное обновление
+        оставляет прежний файл целым.
+        """
+        with self._lock:
+            if self.refreshing:
+                return False
+            thread = threading.Thread(target=self._run_refresh, args=(refresh,), name="snapshot-refresh",
+                                      daemon=True)
+            self._refresh_thread = thread
+        thread.start()
+        return True
+
+    def wait_refresh(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ждёт окончания фонового обновления; False, если оно не завершилось за timeout секунд
+        """
+        thread = self._refresh_thread
+        if thread is None:
+            return True
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def _run_refresh(self, refresh: Callable[[], Any]) -> None:
+        try:
+            refresh()
+            self.reload()
+        except Exception as e:
+            print(f"Ошибка фонового обновления курсов: {e}")
+
+    def invalidate(self) -> None:
+        """
+        Помечает снимок устаревшим: следующий вызов get() перечитает файл.
+        Текущий снимок остаётся основой для разницы с новым.
+        """
+        with self._lock:
+            self._key = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Возвращает счётчики попаданий и промахов
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+
+_caches: Dict[str, SnapshotCache] = {}
+
+# Сколько секунд разовая команда ждёт при выходе незавершённые фоновые обновления
+REFRESH_WAIT_TIMEOUT = 30.0
+
+
+def get_cache(file_path: str = "currency_rate.json") -> SnapshotCache:
+    """
+    Возвращает общий для процесса кэш снимка для указанного файла
+    """
+    cache = _caches.get(file_path)
+    if cache is None:
+        cache = _caches.setdefault(file_path, SnapshotCache(file_path))
+    return cache
+
+
+def wait_for_refreshes(timeout: float = REFRESH_WAIT_TIMEOUT) -> bool:
+    """
+    Дожидается фоновых обновлений всех кэшей, в сумме не дольше timeout секунд.
+    Нужна разовым командам: выход процесса прервал бы поток-демон посреди запроса,
+    и файл курсов так и остался бы устаревшим.
+    """
+    deadline = time.monotonic() + timeout
+    done = True
+    for cache in list(_caches.values()):
+        done = cache.wait_refresh(max(0.0, deadline - time.monotonic())) and done
+    return done
+
+
+def _record_load(snapshot: Snapshot, source: str) -> Snapshot:
+    """
+    Учитывает в метриках источник снимка (local, network, stale) и его возраст
+    """
+    if metrics.ENABLED:
+        metrics.inc("snapshot_loads_total", source=source)
+        age = snapshot.age()
+        if age is not None:
+            metrics.set_gauge("snapshot_age_seconds", age)
+    return snapshot
+
+
+# Отвечать из последнего удачного снимка, обновляя устаревшие курсы в фоне
+STALE_WHILE_REVALIDATE = False
+
+
+def refresh_rates(file_path: str = "currency_rate.json", wait: bool = True) -> bool:
+    """
+    Загружает свежие курсы через api_client.py.
+    Одновременно обновление выполняет только один процесс: остальные либо ждут
+    его окончания (wait=True), либо сразу возвращают False.
+    """
+    with file_lock(file_path + ".lock", blocking=False) as acquired:
+        if acquired:
+            # Другой процесс мог обновить файл, пока мы проверяли свежесть. latest(), а не get():
+            # при фоновом обновлении get() отдаёт снимок из памяти, не глядя на файл
+            try:
+                if get_cache(file_path).latest().is_fresh():
+                    return True
+            except (FileNotFoundError, json.JSONDecodeError):
+                pass
+            from api_client import update_currency_rates
+            update_currency_rates(file_path)
+            return True
+
+    if not wait:
+        return False
+    # Ждём, пока другой процесс закончит обновление
+    with file_lock(file_path + ".lock"):
+        return True
+
+
+def load_snapshot(stale_while_revalidate: Optional[bool] = None,
+                  file_path: str = "currency_rate.json") -> Snapshot:
+    """
+    Загружает снимок курсов из файла (по умолчанию currency_rate.json)
+    Если провайдер ещё не опубликовал новые курсы — берёт снимок из кэша в памяти
+    (файл перечитывается только при его изменении), иначе — обновляет.
+    В режиме stale_while_revalidate устаревший снимок возвращается сразу,
+    а обновление идёт в фоновом потоке.
+    """
+    if stale_while_revalidate is None:
+        stale_while_revalidate = STALE_WHILE_REVALIDATE
+    cache = get_cache(file_path)
+    snapshot = None
+
+    # Читаем из кэша или файла и проверяем свежесть по расписанию провайдера
+    try:
+        snapshot = cache.get()
+        if snapshot.is_fresh():
+            return _record_load(snapshot, "local")
+        if stale_while_revalidate and len(snapshot.table):
+            cache.refresh_async(lambda: refresh_rates(file_path))
+            return _record_load(snapshot, "stale")
+        print(f"Курсы в файле {file_path} устарели. Обновляем данные...")
+    except json.JSONDecodeError:
+        print(f"Ошибка: файл {file_path} содержит некорректные данные.")
+        print("Файл будет обновлен.")
+    except FileNotFoundError:
+        print(f"Файл {file_path} не найден. Обновляем данные...")
+
+    # Обновляем данные; если их уже обновляет другой процесс, а снимок есть — не ждём
+    try:
+        if not refresh_rates(file_path, wait=snapshot is None):
+            print("Курсы обновляет другой процесс. Используются последние сохранённые курсы.")
+            return _record_load(snapshot, "stale")
+
+        # После обновления читаем файл
+        cache.invalidate()
+        return _record_load(cache.get(), "network")
+    except ImportError:
+        print("Ошибка: не удалось импортировать функции обновления курсов валют из api_client.py")
+        print("Пожалуйста, убедитесь, что все необходимые модули установлены.")
+    except Exception as e:
+        print(f"Ошибка при обновлении данных: {str(e)}")
+        print("Пожалуйста, проверьте подключение к интернету и повторите попытку.")
+
+    # Без сети продолжаем работать с последними сохранёнными курсами
+    if snapshot is not None:
+        print("Используются последние сохранённые курсы.")
+        return _record_load(snapshot, "stale")
+    return Snapshot({})
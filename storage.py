@@ -1,15 +1,125 @@
+import contextlib
 import json
+import math
+import mmap
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any
+import struct
+import sys
+import time
+from array import array
+from typing import IO, Dict, Any, Iterator, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+import metrics
+import profiling
+
+
+# Запас времени после объявленной провайдером публикации, в секундах
+FRESHNESS_GRACE_SECONDS = 600
+
+
+@contextlib.contextmanager
+def file_lock(lock_path: str, blocking: bool = True) -> Iterator[bool]:
+    """
+    Межпроцессная блокировка на файле lock_path.
+    Возвращает True, если блокировка получена; без blocking не ждёт её освобождения.
+    """
+    with open(lock_path, "a+") as lock_file:
+        fd = lock_file.fileno()
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                acquired = True
+            except BlockingIOError:
+                acquired = False
+        else:
+            acquired = False
+            while not acquired:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    acquired = True
+                except OSError:
+                    if not blocking:
+                        break
+                    time.sleep(0.1)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _create_temp_file(file_path: str) -> Tuple[int, str]:
+    """
+    Создаёт временный файл рядом с file_path с правами 0666: umask к ним
+    применяет ядро, как при open(), а процессный umask не трогается
+    """
+    prefix = os.path.join(os.path.dirname(os.path.abspath(file_path)), os.path.basename(file_path) + ".")
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    while True:
+        temp_path = f"{prefix}{os.urandom(4).hex()}.tmp"
+        try:
+            return os.open(temp_path, flags, 0o666), temp_path
+        except FileExistsError:
+            continue
+
+
+@contextlib.contextmanager
+def atomic_write(file_path: str, mode: str = "w", encoding: Optional[str] = "utf-8",
+                 sync: bool = True) -> Iterator[IO]:
+    """
+    Атомарная запись файла: блок пишет во временный файл рядом, который затем
+    заменяет file_path, поэтому читатели всегда видят файл целиком.
+    Права файла сохраняются (у нового — по umask). При ошибке временный файл
+    удаляется, а file_path остаётся прежним. sync — сбросить данные на диск до замены.
+    """
+    if "b" in mode:
+        encoding = None
+    fd, temp_path = _create_temp_file(file_path)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as file:
+            yield file
+            if sync:
+                file.flush()
+                os.fsync(file.fileno())
+        try:
+            os.chmod(temp_path, os.stat(file_path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, file_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+def is_binary_path(file_path: str) -> bool:
+    """
+    Файл курсов в бинарном формате (encode_binary) выбирается расширением .bin;
+    остальные файлы — JSON
+    """
+    return file_path.endswith(BINARY_SUFFIX)
 
 
 def save_to_file(data: Dict[str, Any], file_path: str = "currency_rate.json") -> bool:
     """
-    Сохраняет данные в файл
+    Сохраняет данные в файл (в бинарном формате, если это файл .bin).
+    Запись идёт во временный файл рядом, который затем атомарно заменяет
+    исходный, поэтому читатели всегда видят полный снимок.
     """
+    if is_binary_path(file_path):
+        return save_binary(data, file_path)
     try:
-        with open(file_path, "w", encoding="utf-8") as file:
+        with atomic_write(file_path) as file:
             json.dump(data, file, indent=4, ensure_ascii=False)
         print(f"Данные сохранены в {file_path}")
         return True
@@ -20,29 +130,78 @@ def save_to_file(data: Dict[str, Any], file_path: str = "currency_rate.json") ->
 
 def read_from_file(file_path: str = "currency_rate.json") -> Dict[str, Any]:
     """
-    Читает данные из файла
+    Читает данные из файла (JSON или бинарного .bin) в словарь формата currency_rate.json
     """
+    if is_binary_path(file_path):
+        with _read_binary_file(file_path) as snapshot:
+            return snapshot.to_dict()
     try:
-        with open(file_path, "r", encoding="utf-8") as file:
-            return json.load(file)
+        with open(file_path, "r", encoding="utf-8") as file, profiling.phase("parse"):
+            if not metrics.ENABLED:
+                return json.load(file)
+            with metrics.timer("currency_parse_seconds", source="file"):
+                return json.load(file)
     except FileNotFoundError:
         raise FileNotFoundError(f"Файл {file_path} не найден")
     except json.JSONDecodeError:
         raise json.JSONDecodeError(f"Файл {file_path} содержит некорректные данные", "", 0)
 
 
-def is_file_fresh(file_path: str = "currency_rate.json", hours: int = 24) -> bool:
+def _table_times(data: Union[Dict[str, Any], "RateData"], field: str) -> List[int]:
+    if isinstance(data, RateData):
+        return [getattr(table, field) for table in data.tables.values() if getattr(table, field)]
+    return [payload[field] for payload in data.values() if isinstance(payload, dict) and payload.get(field)]
+
+
+def next_update_time(data: Union[Dict[str, Any], "RateData"]) -> Optional[int]:
+    """
+    Возвращает ближайшее время следующей публикации курсов (unix) по всем таблицам
+    """
+    times = _table_times(data, 'time_next_update_unix')
+    return min(times) if times else None
+
+
+def last_update_time(data: Union[Dict[str, Any], "RateData"]) -> Optional[int]:
+    """
+    Возвращает время публикации самой старой таблицы в данных (unix)
+    """
+    times = _table_times(data, 'time_last_update_unix')
+    return min(times) if times else None
+
+
+def is_data_fresh(data: Union[Dict[str, Any], "RateData"], grace_seconds: int = FRESHNESS_GRACE_SECONDS,
+                  now: Optional[float] = None) -> Optional[bool]:
+    """
+    Проверяет свежесть данных по расписанию провайдера: данные считаются
+    свежими до time_next_update_unix плюс grace_seconds на задержку публикации.
+    Возвращает None, если в данных нет расписания.
+    """
+    next_update = next_update_time(data)
+    if next_update is None:
+        return None
+    if now is None:
+        now = time.time()
+    return now < next_update + grace_seconds
+
+
+def is_file_fresh(file_path: str = "currency_rate.json", hours: int = 24,
+                  grace_seconds: int = FRESHNESS_GRACE_SECONDS) -> bool:
     """
-    Проверяет, является ли файл свежим (не старше указанного количества часов)
+    Проверяет, является ли файл свежим: по расписанию провайдера
+    (time_next_update_unix), а если его нет — не старше указанного количества часов
     """
     if not os.path.exists(file_path):
         return False
     
-    mod_time = os.path.getmtime(file_path)
-    mod_datetime = datetime.fromtimestamp(mod_time)
-    current_time = datetime.now()
+    try:
+        fresh = is_data_fresh(read_from_file(file_path), grace_seconds)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    if fresh is not None:
+        return fresh
     
-    return current_time - mod_datetime < timedelta(hours=hours)
+    mod_time = os.path.getmtime(file_path)
+    return time.time() - mod_time < hours * 3600
 
 
 def get_modification_time(file_path: str = "currency_rate.json") -> str:
@@ -51,7 +210,406 @@ def get_modification_time(file_path: str = "currency_rate.json") -> str:
     """
     if os.path.exists(file_path):
         mod_time = os.path.getmtime(file_path)
-        mod_datetime = datetime.fromtimestamp(mod_time)
-        return mod_datetime.strftime("%Y-%m-%d %H:%M:%S")
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mod_time))
     else:
-        return "Файл не найден"
\ No newline at end of file
+        return "Файл не найден"
+
+
+# Метаданные таблицы, которые хранятся в отдельных полях BaseTable
+TABLE_FIELDS = ("base_code", "provider", "time_last_update_unix", "time_last_update_utc",
+                "time_next_update_unix", "time_next_update_utc", "etag", "last_modified", "derived_from")
+
+# Индексы кодов, общие для всех снимков с одинаковым набором валют
+_code_indexes: Dict[Tuple[str, ...], Dict[str, int]] = {}
+
+
+def shared_code_index(codes: Tuple[str, ...]) -> Dict[str, int]:
+    """
+    Возвращает общий для процесса индекс код -> позиция для набора кодов
+    """
+    index = _code_indexes.get(codes)
+    if index is None:
+        index = _code_indexes.setdefault(codes, {code: i for i, code in enumerate(codes)})
+    return index
+
+
+class BaseTable:
+    """
+    Таблица курсов одной базовой валюты: курсы в array('d') по общему индексу
+    кодов снимка (NaN — нет котировки) и метаданные провайдера
+    """
+
+    __slots__ = ("codes", "index", "rates", "extra") + TABLE_FIELDS
+
+    def __init__(self, codes: Tuple[str, ...], index: Dict[str, int], rates: array,
+                 metadata: Dict[str, Any]):
+        self.codes = codes
+        self.index = index
+        self.rates = rates
+        for field in TABLE_FIELDS:
+            value = metadata.get(field)
+            setattr(self, field, sys.intern(value) if isinstance(value, str) else value)
+        # Прочие поля ответа провайдера (result, documentation и т.п.)
+        extra = {key: value for key, value in metadata.items() if key not in TABLE_FIELDS and key != 'rates'}
+        self.extra = extra or None
+
+    def __contains__(self, currency_code: str) -> bool:
+        i = self.index.get(currency_code)
+        return i is not None and not math.isnan(self.rates[i])
+
+    def rate(self, currency_code: str) -> Optional[float]:
+        """
+        Курс валюты к базовой; None, если котировки нет
+        """
+        i = self.index.get(currency_code)
+        if i is None:
+            return None
+        rate = self.rates[i]
+        return None if math.isnan(rate) else rate
+
+    def quotes(self) -> Dict[str, float]:
+        """
+        Котировки таблицы в виде словаря код -> курс
+        """
+        return {code: rate for code, rate in zip(self.codes, self.rates) if not math.isnan(rate)}
+
+    def to_dict(self) -> Dict[str, Any]:
+        payload = dict(self.extra or {})
+        for field in TABLE_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                payload[field] = value
+        payload['rates'] = self.quotes()
+        return payload
+
+
+class RateData:
+    """
+    Компактный снимок курсов: отсортированные коды всех валют, общий индекс кодов
+    и таблицы базовых валют с курсами в array('d')
+    """
+
+    __slots__ = ("codes", "index", "tables")
+
+    def __init__(self, codes: Tuple[str, ...], tables: Dict[str, BaseTable]):
+        self.codes = codes
+        self.index = shared_code_index(codes)
+        self.tables = tables
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RateData":
+        """
+        Строит снимок из словаря в формате currency_rate.json
+        """
+        payloads = {code: payload for code, payload in data.items()
+                    if isinstance(payload, dict) and 'rates' in payload}
+        all_currencies = set(data.keys())
+        for payload in payloads.values():
+            all_currencies.update(payload['rates'].keys())
+
+        codes = tuple(sorted(sys.intern(code) for code in all_currencies))
+        index = shared_code_index(codes)
+        empty = array('d', [math.nan]) * len(codes)
+        tables = {}
+        for code, payload in payloads.items():
+            rates = array('d', empty)
+            for rate_curr, rate in payload['rates'].items():
+                rates[index[rate_curr]] = rate
+            metadata = dict(payload)
+            metadata.setdefault('base_code', code)
+            tables[sys.intern(code)] = BaseTable(codes, index, rates, metadata)
+        return cls(codes, tables)
+
+    def __len__(self) -> int:
+        return len(self.tables)
+
+    def __contains__(self, base_code: str) -> bool:
+        return base_code in self.tables
+
+    def table(self, base_code: str) -> Optional[BaseTable]:
+        return self.tables.get(base_code)
+
+    @property
+    def main_currencies(self) -> List[str]:
+        return list(self.tables)
+
+    def rate(self, base_code: str, currency_code: str) -> Optional[float]:
+        """
+        Курс currency_code в таблице base_code; None, если его нет
+        """
+        table = self.tables.get(base_code)
+        return None if table is None else table.rate(currency_code)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Снимок в виде словаря в формате currency_rate.json
+        """
+        return {code: table.to_dict() for code, table in self.tables.items()}
+
+
+def read_snapshot(file_path: str = "currency_rate.json") -> RateData:
+    """
+    Читает файл курсов в компактную модель RateData. Бинарный файл (.bin)
+    не разбирается: массивы курсов копируются из mmap целиком.
+    """
+    if is_binary_path(file_path):
+        with _read_binary_file(file_path) as snapshot, profiling.phase("parse"):
+            return snapshot.to_rate_data()
+    return RateData.from_dict(read_from_file(file_path))
+
+
+BINARY_SUFFIX = ".bin"
+BINARY_MAGIC = b"CURSNAP\0"
+BINARY_VERSION = 1
+CODE_SIZE = 4
+# magic, версия, число валют, число таблиц, длина метаданных
+BINARY_HEADER = struct.Struct("<8sHxxIII")
+
+
+def encode_binary(data: Dict[str, Any]) -> bytes:
+    """
+    Кодирует данные в компактный бинарный формат:
+    заголовок, отсортированный индекс кодов, коды базовых валют,
+    метаданные таблиц (JSON) и непрерывные массивы курсов float64
+    (по одному на таблицу, NaN для отсутствующих валют)
+    """
+    tables = [(code, payload) for code, payload in data.items() if 'rates' in payload]
+    all_currencies = set(code for code, _ in tables)
+    for _, payload in tables:
+        all_currencies.update(payload['rates'].keys())
+    codes = sorted(all_currencies)
+    index = {code: i for i, code in enumerate(codes)}
+
+    metadata = json.dumps(
+        [{key: value for key, value in payload.items() if key != 'rates'} for _, payload in tables],
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+    rates = array('d', [math.nan]) * (len(codes) * len(tables))
+    for t, (_, payload) in enumerate(tables):
+        row = t * len(codes)
+        for code, rate in payload['rates'].items():
+            rates[row + index[code]] = rate
+    if sys.byteorder != "little":
+        rates.byteswap()
+
+    header = BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(codes), len(tables), len(metadata))
+    body = b"".join(code.encode("ascii").ljust(CODE_SIZE, b"\0") for code in codes)
+    body += b"".join(code.encode("ascii").ljust(CODE_SIZE, b"\0") for code, _ in tables)
+    body += metadata
+    padding = -(len(header) + len(body)) % 8
+    return header + body + b"\0" * padding + rates.tobytes()
+
+
+def save_binary(data: Dict[str, Any], file_path: str = "currency_rate.bin") -> bool:
+    """
+    Сохраняет данные в компактном бинарном формате (см. encode_binary)
+    """
+    try:
+        encoded = encode_binary(data)
+        with atomic_write(file_path, "wb") as file:
+            file.write(encoded)
+        print(f"Данные сохранены в {file_path}")
+        return True
+    except (IOError, UnicodeEncodeError) as e:
+        print(f"Ошибка при сохранении файла: {e}")
+        return False
+
+
+class BinarySnapshot:
+    """
+    Снимок курсов в бинарном формате поверх буфера (обычно mmap файла).
+    Курсы читаются прямо из буфера без разбора и создания объектов на каждую валюту.
+    """
+
+    def __init__(self, buffer, name: str = "currency_rate.bin"):
+        self.name = name
+        self._owner = buffer
+        self._buffer = memoryview(buffer)
+        try:
+            magic, version, n_codes, n_tables, metadata_len = BINARY_HEADER.unpack_from(self._buffer, 0)
+        except struct.error:
+            magic = version = None
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            # Буфер освобождается, чтобы вызывающий код мог закрыть mmap
+            self._buffer.release()
+            raise ValueError(f"Файл {name} содержит некорректные данные")
+
+        self.n_codes = n_codes
+        self.n_tables = n_tables
+        self._codes_offset = BINARY_HEADER.size
+        self._tables_offset = self._codes_offset + n_codes * CODE_SIZE
+        self._metadata_offset = self._tables_offset + n_tables * CODE_SIZE
+        rates_offset = self._metadata_offset + metadata_len
+        rates_offset += -rates_offset % 8
+        self._metadata_len = metadata_len
+        self._rates = self._buffer[rates_offset:rates_offset + 8 * n_codes * n_tables].cast('d')
+        # Представления курсов таблиц по номеру (одно на таблицу): close() освобождает их вместе с буфером
+        self._rows: Dict[int, memoryview] = {}
+        self._route_tables: Optional[List[Tuple[str, int, memoryview, int]]] = None
+
+    def close(self) -> None:
+        """
+        Освобождает буфер. Массивы из rates() и route_tables() после этого
+        недействительны (обращение к ним — ValueError).
+        """
+        for view in self._rows.values():
+            view.release()
+        self._rows.clear()
+        self._route_tables = None
+        self._rates.release()
+        self._buffer.release()
+        if isinstance(self._owner, mmap.mmap):
+            try:
+                self._owner.close()
+            except BufferError:
+                # Остались срезы выданных массивов: mmap закроется вместе с последним из них
+                pass
+
+    def __enter__(self) -> "BinarySnapshot":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _code_at(self, offset: int, i: int) -> bytes:
+        start = offset + i * CODE_SIZE
+        return self._buffer[start:start + CODE_SIZE].tobytes()
+
+    def code_index(self, currency_code: str) -> int:
+        """
+        Бинарный поиск кода валюты в отсортированном индексе; -1, если кода нет
+        """
+        key = currency_code.encode("ascii").ljust(CODE_SIZE, b"\0")
+        lo, hi = 0, self.n_codes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._code_at(self._codes_offset, mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_codes and self._code_at(self._codes_offset, lo) == key:
+            return lo
+        return -1
+
+    def table_index(self, base_code: str) -> int:
+        """
+        Номер таблицы базовой валюты; -1, если такой таблицы нет
+        """
+        key = base_code.encode("ascii").ljust(CODE_SIZE, b"\0")
+        for t in range(self.n_tables):
+            if self._code_at(self._tables_offset, t) == key:
+                return t
+        return -1
+
+    @property
+    def codes(self) -> List[str]:
+        return [self._code_at(self._codes_offset, i).rstrip(b"\0").decode("ascii") for i in range(self.n_codes)]
+
+    @property
+    def base_codes(self) -> List[str]:
+        return [self._code_at(self._tables_offset, t).rstrip(b"\0").decode("ascii") for t in range(self.n_tables)]
+
+    def rate(self, base_code: str, currency_code: str) -> Optional[float]:
+        """
+        Курс валюты в таблице базовой валюты; None, если курса нет
+        """
+        t = self.table_index(base_code)
+        i = self.code_index(currency_code)
+        if t < 0 or i < 0:
+            return None
+        rate = self._rates[t * self.n_codes + i]
+        return None if math.isnan(rate) else rate
+
+    def _row(self, t: int) -> memoryview:
+        view = self._rows.get(t)
+        if view is None:
+            view = self._rows[t] = self._rates[t * self.n_codes:(t + 1) * self.n_codes]
+        return view
+
+    def route_tables(self) -> List[Tuple[str, int, memoryview, int]]:
+        """
+        Таблицы снимка для rates.pair_rate: базовая валюта, её индекс в codes,
+        курсы без копирования и время публикации. Строятся один раз на снимок.
+        """
+        if self._route_tables is None:
+            self._route_tables = [
+                (base_code, self.code_index(metadata.get('base_code', base_code)), self._row(t),
+                 metadata.get('time_last_update_unix') or 0)
+                for t, (base_code, metadata) in enumerate(zip(self.base_codes, self.metadata()))
+            ]
+        return self._route_tables
+
+    def to_rate_data(self) -> RateData:
+        """
+        Снимок в компактной модели RateData: курсы таблиц копируются из буфера
+        целиком, без словарей по валютам
+        """
+        codes = tuple(sys.intern(code) for code in self.codes)
+        index = shared_code_index(codes)
+        tables = {}
+        for t, (base_code, metadata) in enumerate(zip(self.base_codes, self.metadata())):
+            rates = array('d')
+            rates.frombytes(self._rates[t * self.n_codes:(t + 1) * self.n_codes].cast('B'))
+            metadata.setdefault('base_code', base_code)
+            tables[sys.intern(base_code)] = BaseTable(codes, index, rates, metadata)
+        return RateData(codes, tables)
+
+    def rates(self, base_code: str) -> Optional[memoryview]:
+        """
+        Массив курсов таблицы (float64, по порядку codes) без копирования.
+        Массив действителен до close() снимка: close() освобождает его.
+        """
+        t = self.table_index(base_code)
+        if t < 0:
+            return None
+        return self._row(t)
+
+    def metadata(self) -> List[Dict[str, Any]]:
+        """
+        Метаданные таблиц в порядке base_codes
+        """
+        start = self._metadata_offset
+        return json.loads(self._buffer[start:start + self._metadata_len].tobytes().decode("utf-8"))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Преобразует снимок в словарь того же вида, что и currency_rate.json
+        """
+        codes = self.codes
+        data = {}
+        for t, (base_code, payload) in enumerate(zip(self.base_codes, self.metadata())):
+            row = self._rates[t * self.n_codes:(t + 1) * self.n_codes]
+            payload['rates'] = {code: rate for code, rate in zip(codes, row) if not math.isnan(rate)}
+            row.release()
+            data[base_code] = payload
+        return data
+
+
+def read_binary(file_path: str = "currency_rate.bin") -> BinarySnapshot:
+    """
+    Открывает бинарный снимок через mmap
+    """
+    try:
+        with open(file_path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Файл {file_path} не найден")
+    except ValueError:  # пустой файл нельзя отобразить в память
+        raise ValueError(f"Файл {file_path} содержит некорректные данные")
+    try:
+        return BinarySnapshot(buffer, file_path)
+    except ValueError:
+        buffer.close()
+        raise
+
+
+def _read_binary_file(file_path: str) -> BinarySnapshot:
+    """
+    read_binary для чтения файла курсов: некорректные данные сообщаются тем же
+    json.JSONDecodeError, что и для JSON, чтобы вызывающий код обрабатывал оба формата одинаково
+    """
+    try:
+        return read_binary(file_path)
+    except ValueError:
+        raise json.JSONDecodeError(f"Файл {file_path} содержит некорректные данные", "", 0)
@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+# Модули проекта лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Курсы к USD для небольших тестовых снимков
+USD_RATES = {"USD": 1.0, "EUR": 0.92, "GBP": 0.79, "RUB": 90.5, "JPY": 151.3, "KWD": 0.307, "CHF": 0.88}
+
+
+def make_table(base, rates, updated, next_update):
+    return {
+        "result": "success",
+        "provider": "https://www.exchangerate-api.com",
+        "time_last_update_unix": updated,
+        "time_last_update_utc": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(updated)),
+        "time_next_update_unix": next_update,
+        "time_next_update_utc": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(next_update)),
+        "base_code": base,
+        "rates": rates,
+    }
+
+
+@pytest.fixture
+def make_rates():
+    """
+    Фабрика снимков в формате currency_rate.json: таблицы USD, EUR и GBP,
+    выведенные из USD_RATES; fresh — расписание провайдера ещё не наступило
+    """
+    def factory(fresh=True, scale=1.0):
+        now = int(time.time())
+        updated, next_update = (now - 3600, now + 3600) if fresh else (now - 3 * 86400, now - 2 * 86400)
+        usd = {code: rate * scale if code != "USD" else rate for code, rate in USD_RATES.items()}
+        return {base: make_table(base, {code: rate / usd[base] for code, rate in usd.items()}, updated, next_update)
+                for base in ("USD", "EUR", "GBP")}
+    return factory
+
+
+@pytest.fixture
+def write_rates(tmp_path):
+    """
+    Записывает снимок в currency_rate.json во временном каталоге и возвращает путь
+    """
+    path = str(tmp_path / "currency_rate.json")
+
+    def write(data):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        return path
+    return write
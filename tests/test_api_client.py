@@ -0,0 +1,175 @@
+import contextlib
+import io
+import os
+import time
+from email.utils import formatdate
+
+import pytest
+
+import api_client
+from benchmarks import FakeProvider
+from storage import is_file_fresh, read_from_file
+
+
+@pytest.fixture
+def make_provider(make_rates):
+    """
+    Локальный поддельный провайдер (benchmarks.FakeProvider) с курсами make_rates()
+    """
+    with contextlib.ExitStack() as stack:
+        def factory(**kwargs):
+            return stack.enter_context(FakeProvider(make_rates(), **kwargs))
+        yield factory
+
+
+def quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def test_repeated_update_uses_conditional_requests(make_provider, tmp_path):
+    provider = make_provider()
+    path = str(tmp_path / "currency_rate.json")
+    currencies = ["USD", "EUR", "GBP"]
+
+    quiet(api_client.update_currency_rates, path, currencies, base_url=provider.url, history_dir=None)
+    first = read_from_file(path)
+    assert provider.requests == 3 and provider.not_modified == 0
+    assert all(first[code].get("etag") for code in currencies)
+
+    diff = quiet(api_client.update_currency_rates, path, currencies, base_url=provider.url, history_dir=None)
+
+    assert provider.requests == 6 and provider.not_modified == 3
+    assert not diff
+    assert read_from_file(path)["USD"]["rates"] == first["USD"]["rates"]
+
+
+def test_retries_server_errors(make_provider):
+    provider = make_provider(failures=2)
+    session = api_client.create_session(backoff_factor=0)
+
+    data = quiet(api_client.get_currency_rate, "USD", session=session, base_url=provider.url)
+
+    assert data["base_code"] == "USD"
+    assert provider.requests == 3
+
+
+def test_gives_up_after_max_retries(make_provider):
+    provider = make_provider(failures=api_client.MAX_RETRIES + 1)
+    session = api_client.create_session(backoff_factor=0)
+
+    assert quiet(api_client.get_currency_rate, "USD", session=session, base_url=provider.url) is None
+    assert provider.requests == api_client.MAX_RETRIES + 1
+
+
+def test_session_reuses_connections(make_provider):
+    provider = make_provider()
+    session = api_client.create_session(max_workers=2)
+
+    for _ in range(3):
+        results = api_client.fetch_currency_rates(["USD", "EUR", "GBP"], session=session,
+                                                  base_url=provider.url, max_workers=2)
+        assert all(results.values())
+
+    assert provider.requests == 9
+    assert len(provider.connections) <= 2
+
+
+def test_not_modified_until():
+    now = 1_700_000_000
+    assert api_client.not_modified_until({"Cache-Control": "public, max-age=300"}, now) == now + 300
+    assert api_client.not_modified_until({"Expires": "Tue, 14 Nov 2023 22:16:40 GMT"}, now) == now + 200
+    assert api_client.not_modified_until({"Expires": "0"}, now) == now + api_client.NOT_MODIFIED_TTL
+    assert api_client.not_modified_until({}, now) == now + api_client.NOT_MODIFIED_TTL
+
+
+def test_not_modified_extends_freshness(make_rates, tmp_path):
+    path = str(tmp_path / "currency_rate.json")
+    with FakeProvider(make_rates(fresh=False), headers={"Cache-Control": "max-age=3600"}) as provider:
+        quiet(api_client.update_currency_rates, path, ["USD", "EUR"], base_url=provider.url, history_dir=None)
+        assert not is_file_fresh(path)
+
+        quiet(api_client.update_currency_rates, path, ["USD", "EUR"], base_url=provider.url, history_dir=None)
+
+    assert provider.not_modified == 2
+    assert is_file_fresh(path)
+    assert read_from_file(path)["USD"]["time_next_update_unix"] >= time.time() + 3000
+
+
+def test_unchanged_data_is_not_rewritten(make_rates, tmp_path):
+    path = str(tmp_path / "currency_rate.json")
+    expires = formatdate(time.time() + 3600, usegmt=True)
+    with FakeProvider(make_rates(fresh=False), headers={"Expires": expires}) as provider:
+        for _ in range(2):
+            quiet(api_client.update_currency_rates, path, ["USD", "EUR"], base_url=provider.url, history_dir=None)
+        mtime = os.stat(path).st_mtime_ns
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            diff = api_client.update_currency_rates(path, ["USD", "EUR"], base_url=provider.url, history_dir=None)
+
+    assert provider.not_modified == 4
+    assert not diff
+    assert os.stat(path).st_mtime_ns == mtime
+    assert "не изменились" in output.getvalue()
+
+
+def test_late_publication_extends_freshness_on_200(make_rates, write_rates):
+    # Файл без ETag: запрос не условный, провайдер отвечает 200 прежними курсами
+    stale = make_rates(fresh=False)
+    path = write_rates(stale)
+    with FakeProvider(stale) as provider:
+        quiet(api_client.update_currency_rates, path, ["USD", "EUR"], base_url=provider.url, history_dir=None)
+
+    assert provider.not_modified == 0
+    assert is_file_fresh(path)
+    data = read_from_file(path)
+    assert data["USD"]["time_next_update_unix"] >= time.time() + api_client.NOT_MODIFIED_TTL - 60
+    assert data["USD"]["time_last_update_unix"] == stale["USD"]["time_last_update_unix"]
+
+
+def test_extend_if_unchanged():
+    previous = {"time_last_update_unix": 100, "time_next_update_unix": 200}
+
+    extended = api_client.extend_if_unchanged(dict(previous), previous, now=1000)
+    assert extended["time_next_update_unix"] == 1000 + api_client.NOT_MODIFIED_TTL
+    # Новая публикация и ещё не наступивший срок не продлеваются
+    published = {"time_last_update_unix": 900, "time_next_update_unix": 990}
+    assert api_client.extend_if_unchanged(published, previous, now=1000) is published
+    scheduled = {"time_last_update_unix": 100, "time_next_update_unix": 2000}
+    assert api_client.extend_if_unchanged(scheduled, previous, now=1000) is scheduled
+    assert api_client.extend_if_unchanged(previous, None, now=1000) is previous
+
+
+def test_single_fetch_derives_tables_from_one_request(make_rates, tmp_path):
+    path = str(tmp_path / "currency_rate.json")
+    data = make_rates()
+    with FakeProvider(data) as provider:
+        quiet(api_client.update_currency_rates, path, ["USD", "EUR", "JPY"], base_url=provider.url,
+              single_fetch=True, history_dir=None)
+
+    assert provider.requests == 1
+    saved = read_from_file(path)
+    usd = data["USD"]["rates"]
+    assert saved["USD"]["etag"] and "derived_from" not in saved["USD"]
+    for base in ("EUR", "JPY"):
+        table = saved[base]
+        assert table["derived_from"] == "USD"
+        assert table["base_code"] == base
+        assert "etag" not in table and "last_modified" not in table and "source" not in table
+        assert table["rates"][base] == 1.0 and isinstance(table["rates"][base], float)
+        assert table["rates"]["USD"] == pytest.approx(1 / usd[base])
+        assert table["rates"]["GBP"] == pytest.approx(usd["GBP"] / usd[base])
+
+
+def test_single_fetch_all_currencies(make_rates, tmp_path):
+    path = str(tmp_path / "currency_rate.json")
+    data = make_rates()
+    with FakeProvider(data) as provider:
+        quiet(api_client.update_currency_rates, path, api_client.ALL_CURRENCIES, base_url=provider.url,
+              single_fetch=True, history_dir=None)
+
+    assert provider.requests == 1
+    saved = read_from_file(path)
+    assert sorted(saved) == sorted(data["USD"]["rates"])
+    assert all(saved[code]["rates"][code] == 1.0 for code in saved)
@@ -0,0 +1,125 @@
+import io
+
+import pytest
+
+from batch import convert_batch
+from rates import RateTable
+
+
+@pytest.fixture
+def table(make_rates):
+    return RateTable(make_rates())
+
+
+def run(table, text, fmt="csv", **kwargs):
+    output = io.StringIO()
+    counts = convert_batch(table, io.StringIO(text), output, fmt, **kwargs)
+    return output.getvalue(), counts
+
+
+@pytest.mark.parametrize("header", ["from,to,amount", "From, To, Amount", "source,target,sum"])
+def test_header_is_kept(table, header):
+    output, counts = run(table, f"{header}\nUSD,EUR,10\n")
+
+    assert output.splitlines()[0] == f"{header},result,error"
+    assert output.splitlines()[1] == "USD,EUR,10,9.2000,"
+    assert counts == (1, 0)
+
+
+def test_first_record_with_bad_amount_is_not_a_header(table):
+    output, counts = run(table, "USD,EUR,abc\nUSD,EUR,10\n")
+
+    lines = output.splitlines()
+    assert lines[0].startswith("USD,EUR,abc,,")
+    assert "не является допустимым числом" in lines[0]
+    assert lines[1] == "USD,EUR,10,9.2000,"
+    assert counts == (2, 1)
+
+
+@pytest.mark.parametrize("amount", ["nan", "inf", "-Infinity", "1e308"])
+def test_non_finite_amounts_are_errors(table, amount):
+    output, counts = run(table, f"USD,RUB,{amount}\n")
+
+    assert counts == (1, 1)
+    assert "не является допустимым числом" in output
+    assert "nan" not in output.split(",")[3] and "inf" not in output.split(",")[3]
+
+
+@pytest.mark.parametrize("amount", ["nan", "inf"])
+def test_non_finite_amounts_are_errors_in_exact_mode(table, amount):
+    output, counts = run(table, f'{{"from": "USD", "to": "EUR", "amount": "{amount}"}}\n', "jsonl", exact=True)
+
+    assert counts == (1, 1)
+    assert '"result": null' in output
+
+
+def sample_csv(rows=200, multiline_at=(6, 50)):
+    codes = ["USD", "EUR", "GBP", "RUB", "JPY", "KWD", "CHF", "XXX"]
+    lines = ["from,to,amount\n"]
+    for i in range(rows):
+        if i in multiline_at:
+            # Запись с переводом строки внутри кавычек занимает две строки файла
+            lines.append(f'"{codes[i % 8]}",EUR,"1\n{i}"\n')
+        else:
+            lines.append(f"{codes[i % 8]},{codes[(i * 3) % 8]},{i * 7.25 - 300:.2f}\n")
+    return "".join(lines)
+
+
+def test_iter_line_chunks_keeps_quoted_records_whole():
+    from batch import iter_line_chunks
+
+    text = 'a,b,1\n"c",d,"2\n3"\ne,f,4\n'
+    chunks = list(iter_line_chunks(io.StringIO(text), 2))
+
+    assert chunks == [['a,b,1\n', '"c",d,"2\n', '3"\n'], ['e,f,4\n']]
+
+
+@pytest.mark.parametrize("exact", [False, True])
+def test_parallel_output_matches_serial(table, exact):
+    from batch import convert_batch_parallel
+
+    text = sample_csv()
+    serial, serial_counts = run(table, text, chunk_size=7, exact=exact)
+    output = io.StringIO()
+    counts = convert_batch_parallel(table, io.StringIO(text), output, "csv", 7, exact, workers=2)
+
+    assert output.getvalue() == serial
+    # XXX недоступна (по 25 записей в колонках from и to), две многострочные записи — с ошибочной суммой
+    assert counts == serial_counts == (200, 52)
+    assert serial.startswith("from,to,amount,result,error\n")
+
+
+def test_parallel_without_header_and_jsonl(table):
+    from batch import convert_batch_parallel
+
+    text = "".join(f'{{"from": "USD", "to": "GBP", "amount": {i}}}\n' for i in range(50))
+    serial, _ = run(table, text, "jsonl", chunk_size=4)
+    output = io.StringIO()
+    convert_batch_parallel(table, io.StringIO(text), output, "jsonl", 4, workers=2)
+    assert output.getvalue() == serial
+
+    text = sample_csv(30).split("\n", 1)[1]
+    serial, _ = run(table, text, chunk_size=4)
+    output = io.StringIO()
+    convert_batch_parallel(table, io.StringIO(text), output, "csv", 4, workers=2)
+    assert output.getvalue() == serial
+
+
+def test_parallel_unlinks_shared_memory(table, monkeypatch):
+    from multiprocessing import shared_memory
+    from batch import convert_batch_parallel
+
+    names = []
+
+    class Recording(shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if kwargs.get("create"):
+                names.append(self.name)
+
+    monkeypatch.setattr(shared_memory, "SharedMemory", Recording)
+    convert_batch_parallel(table, io.StringIO(sample_csv(20)), io.StringIO(), "csv", 4, workers=2)
+
+    assert len(names) == 1
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=names[0])
@@ -0,0 +1,85 @@
+import json
+import os
+
+import catalog
+import snapshot
+from catalog import CurrencyCatalog, catalog_path, load_catalog, save_catalog
+from storage import RateData
+
+
+def build(make_rates):
+    return CurrencyCatalog.from_data(RateData.from_dict(make_rates()))
+
+
+def test_from_data_lists_tables_containing_code(make_rates):
+    currencies = build(make_rates)
+
+    assert currencies.codes == tuple(sorted(currencies.codes))
+    assert "KWD" in currencies and "XXX" not in currencies
+    # Валюта с собственной таблицей идёт первой
+    assert currencies.containing("EUR")[0] == "EUR"
+    assert set(currencies.containing("JPY")) == {"USD", "EUR", "GBP"}
+    assert currencies.containing("XXX") == ()
+
+
+def test_suggest_uses_longest_matching_prefix():
+    currencies = CurrencyCatalog(["EUR", "GBP", "GEL", "UAH", "USD", "UZS"], {})
+
+    assert currencies.suggest("eux") == ["EUR"]
+    assert currencies.suggest("GBX") == ["GBP"]
+    assert currencies.suggest("GXX") == ["GBP", "GEL"]
+    assert currencies.suggest(" u ") == ["UAH", "USD", "UZS"]
+    assert currencies.suggest("U", limit=2) == ["UAH", "USD"]
+    assert currencies.suggest("QQQ") == []
+    assert currencies.suggest("") == []
+
+
+def test_save_and_load_round_trip(make_rates, tmp_path):
+    path = str(tmp_path / "currency_rate.json")
+    currencies = build(make_rates)
+
+    assert save_catalog(currencies, path, (1, 2))
+    assert catalog_path(path) == str(tmp_path / "currency_rate.catalog.json")
+
+    loaded = load_catalog(path, (1, 2))
+    assert loaded.codes == currencies.codes
+    assert loaded.tables == currencies.tables
+    assert loaded.prefixes == currencies.prefixes
+
+
+def test_load_rejects_other_source_version_or_damaged_file(make_rates, tmp_path, monkeypatch):
+    path = str(tmp_path / "currency_rate.json")
+    assert load_catalog(path, (1, 2)) is None
+
+    save_catalog(build(make_rates), path, (1, 2))
+    assert load_catalog(path, (1, 3)) is None
+    assert load_catalog(path, (2, 2)) is None
+
+    monkeypatch.setattr(catalog, "CATALOG_VERSION", catalog.CATALOG_VERSION + 1)
+    assert load_catalog(path, (1, 2)) is None
+    monkeypatch.undo()
+
+    with open(catalog_path(path), "w", encoding="utf-8") as file:
+        file.write('{"version": 1, "source": [1, 2]')
+    assert load_catalog(path, (1, 2)) is None
+
+
+def test_snapshot_persists_catalog_and_invalidates_it_when_rates_change(make_rates, write_rates):
+    path = write_rates(make_rates())
+    cache = snapshot.SnapshotCache(path)
+    assert "KWD" in cache.get().catalog
+
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with open(catalog_path(path), "r", encoding="utf-8") as file:
+        assert json.load(file)["source"] == list(key)
+
+    # Справочник текущей версии файла читается с диска, а не строится заново
+    save_catalog(CurrencyCatalog(["USD"], {"USD": ("USD",)}), path, key)
+    assert snapshot.SnapshotCache(path).get().catalog.codes == ("USD",)
+
+    data = make_rates()
+    data["USD"]["rates"]["XAU"] = 0.0005
+    write_rates(data)
+    assert "XAU" in snapshot.SnapshotCache(path).get().catalog
+    assert "XAU" in cache.get().catalog
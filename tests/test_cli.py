@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import api_client
+import cli
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_update_fails_when_nothing_fetched(monkeypatch, capsys):
+    monkeypatch.setattr(api_client, "update_currency_rates", lambda **kwargs: None)
+
+    assert cli.main(["update", "--providers", "er-api"]) == 1
+    assert "успешно" not in capsys.readouterr().out
+
+
+def test_parser_does_not_import_batch_modules():
+    script = ("import sys, cli; cli.build_parser().parse_args(['convert', 'USD', 'EUR', '1']); "
+              "print(','.join(name for name in ('batch', 'ledger', 'money', 'decimal', 'csv') if name in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+
+    assert output.strip() == ""
+
+
+@pytest.mark.parametrize("value", ["0", "-5", "abc"])
+def test_chunk_size_must_be_positive(value, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        cli.build_parser().parse_args(["convert-batch", "--chunk-size", value])
+
+    assert exit_info.value.code == 2
+    assert "--chunk-size" in capsys.readouterr().err
+
+
+def test_chunk_size_accepts_positive():
+    assert cli.build_parser().parse_args(["convert-batch", "--chunk-size", "3"]).chunk_size == 3
+
+
+def test_load_currency_data_kept_for_compatibility(make_rates, write_rates, tmp_path, monkeypatch):
+    import snapshot
+
+    write_rates(make_rates())
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(snapshot, "_caches", {})
+
+    data = cli.load_currency_data()
+
+    assert set(data) == {"USD", "EUR", "GBP"}
+    assert data["USD"]["rates"]["EUR"] == pytest.approx(0.92)
@@ -0,0 +1,83 @@
+import pytest
+
+from converter import (ConversionPathError, Converter, ConverterError, CurrencyNotFoundError, RatesUnavailableError,
+                       historical_rate)
+from snapshot import Snapshot
+
+
+@pytest.fixture
+def converter(make_rates):
+    data = make_rates()
+    # Валюта без котировок в других таблицах: пути к ней нет
+    data["ZZZ"] = {"base_code": "ZZZ", "rates": {"ZZZ": 1.0}, "time_last_update_unix": 1, "time_next_update_unix": 2}
+    return Converter(Snapshot(data))
+
+
+def test_convert(converter):
+    assert converter.convert("usd", "eur", 10) == pytest.approx(9.2)
+    assert converter.rate("EUR", "EUR") == 1.0
+
+
+def test_unknown_currency_has_suggestions(converter):
+    with pytest.raises(CurrencyNotFoundError) as error:
+        converter.rate("USD", "eux")
+
+    assert error.value.currency_code == "EUX"
+    assert error.value.suggestions[0] == "EUR"
+    assert error.value.available == converter.currencies
+    assert str(error.value) == "Валюта EUX недоступна"
+    assert isinstance(error.value, KeyError) and isinstance(error.value, ConverterError)
+
+
+def test_unknown_currency_without_similar_codes(converter):
+    with pytest.raises(CurrencyNotFoundError) as error:
+        converter.currency_info("QQQ")
+
+    assert error.value.suggestions == []
+
+
+def test_no_path_is_conversion_path_error(converter):
+    with pytest.raises(ConversionPathError) as error:
+        converter.convert("USD", "ZZZ", 1)
+
+    assert (error.value.from_currency, error.value.to_currency) == ("USD", "ZZZ")
+    assert "Не удалось найти путь" in str(error.value)
+    with pytest.raises(ConversionPathError):
+        converter.path("ZZZ", "GBP")
+
+
+def test_empty_snapshot_is_rates_unavailable():
+    converter = Converter(Snapshot({}))
+
+    with pytest.raises(RatesUnavailableError):
+        converter.rate("USD", "EUR")
+
+
+def test_history_errors(make_rates, tmp_path):
+    from history import RateHistory
+
+    path = str(tmp_path / "currency_rate.json")
+    with pytest.raises(RatesUnavailableError):
+        historical_rate("USD", "EUR", "2020-01-01", file_path=path)
+
+    data = make_rates()
+    RateHistory(str(tmp_path / "history")).append(data)
+    as_of = data["USD"]["time_last_update_unix"]
+    assert historical_rate("USD", "EUR", as_of, file_path=path) == pytest.approx(0.92)
+    with pytest.raises(RatesUnavailableError):
+        historical_rate("USD", "EUR", as_of - 1, file_path=path)
+    with pytest.raises(CurrencyNotFoundError) as error:
+        historical_rate("USD", "EUX", as_of, file_path=path)
+    assert "EUR" in error.value.suggestions
+
+
+def test_cli_prints_suggestions(converter, capsys):
+    import cli
+
+    with pytest.raises(CurrencyNotFoundError) as error:
+        converter.rate("GPB", "USD")
+    cli.print_error(error.value)
+
+    output = capsys.readouterr().out
+    assert "Валюта GPB недоступна." in output
+    assert "Возможно, вы имели в виду: GBP" in output
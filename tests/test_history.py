@@ -0,0 +1,107 @@
+import contextlib
+import io
+import os
+import random
+
+import pytest
+
+import api_client
+import rates
+from benchmarks import FakeProvider
+from converter import historical_rate
+from history import RateHistory, get_history, history_path, snapshot_rate
+from rates import RateTable
+from storage import BinarySnapshot, encode_binary
+from test_rates import random_rates
+
+
+UPDATED = 1_700_000_000
+
+
+def table(base, rates):
+    return {"base_code": base, "rates": {base: 1.0, **rates}, "time_last_update_unix": UPDATED,
+            "time_next_update_unix": UPDATED + 86400}
+
+
+# B и E не встречаются вместе ни в одной таблице; EUR есть в обеих таблицах с разными курсами
+CHAINED = {
+    "AAA": table("AAA", {"BBB": 2.0, "CCC": 4.0, "EUR": 0.5}),
+    "DDD": table("DDD", {"CCC": 8.0, "EEE": 3.0, "EUR": 0.26}),
+}
+
+
+def test_history_path_is_next_to_rates_file(tmp_path):
+    rates_path = str(tmp_path / "data" / "currency_rate.json")
+
+    assert history_path(rates_path) == str(tmp_path / "data" / "history")
+    assert history_path(rates_path, "/var/history") == "/var/history"
+
+
+def test_multi_table_pairs_use_rate_table_routing(tmp_path):
+    history = RateHistory(str(tmp_path / "history"))
+    assert history.append(CHAINED)
+    expected = RateTable(CHAINED)
+
+    for pair in (("BBB", "EEE"), ("EEE", "BBB"), ("BBB", "EUR"), ("EUR", "DDD"), ("AAA", "AAA")):
+        assert history.rate(*pair, UPDATED) == pytest.approx(expected.rate(*pair))
+    assert history.rates_as_of("BBB", "EEE", [UPDATED - 1, UPDATED]) == [None, pytest.approx(expected.rate("BBB", "EEE"))]
+    assert history.rate("BBB", "XXX", UPDATED) is None
+
+
+def test_as_of_finds_history_next_to_rates_file_from_other_directory(make_rates, tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    path = str(data_dir / "currency_rate.json")
+    data = make_rates()
+    with FakeProvider(data) as provider, contextlib.redirect_stdout(io.StringIO()):
+        api_client.update_currency_rates(path, ["USD", "EUR"], base_url=provider.url)
+
+    assert os.path.isdir(data_dir / "history")
+    other = tmp_path / "elsewhere"
+    other.mkdir()
+    monkeypatch.chdir(other)
+
+    rate = historical_rate("EUR", "GBP", data["USD"]["time_last_update_unix"], file_path=path)
+
+    assert rate == pytest.approx(data["EUR"]["rates"]["GBP"])
+    assert not os.path.exists(other / "history")
+
+
+@pytest.mark.parametrize("policy", rates.PATH_POLICIES)
+@pytest.mark.parametrize("seed", range(5))
+def test_snapshot_rate_matches_rate_table_for_every_pair(policy, seed, monkeypatch):
+    monkeypatch.setattr(rates, "PATH_POLICY", policy)
+    data = random_rates(random.Random(seed))
+    table = RateTable(data, policy)
+    assert table._long_paths
+    snapshot = BinarySnapshot(encode_binary(data))
+
+    for source in table.codes:
+        for target in table.codes:
+            expected = table.rate(source, target)
+            actual = snapshot_rate(snapshot, source, target)
+            if expected is None:
+                assert actual is None
+            else:
+                assert actual == pytest.approx(expected, rel=1e-12), (source, target)
+    snapshot.close()
+
+
+def test_history_is_shared_per_directory(tmp_path):
+    directory = str(tmp_path / "history")
+
+    assert get_history(directory) is get_history(os.path.join(directory, "."))
+    assert get_history(directory) is not get_history(str(tmp_path / "other"))
+
+
+def test_appended_snapshot_is_seen_by_shared_history(tmp_path):
+    history = get_history(str(tmp_path / "history"))
+    assert history.append(CHAINED)
+    assert history.rate("BBB", "EEE", UPDATED) is not None
+    later = {base: dict(table, time_last_update_unix=UPDATED + 86400,
+                        rates=dict(table["rates"], CCC=table["rates"]["CCC"] * 2)) for base, table in CHAINED.items()}
+
+    assert RateHistory(history.directory).append(later)
+
+    assert history.rate("AAA", "CCC", UPDATED + 86400) == pytest.approx(8.0)
+    assert history.rate("AAA", "CCC", UPDATED) == pytest.approx(4.0)
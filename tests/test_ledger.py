@@ -0,0 +1,140 @@
+import io
+import json
+import random
+
+import pytest
+
+import cli
+import snapshot
+from diff import diff_snapshots
+from ledger import Ledger, LedgerTotal, aggregate, read_entries, write_totals
+from money import RoundingRule
+from rates import RateTable
+from storage import RateData
+from test_rates import CODES, perturb, random_rates
+
+
+def random_entries(rng, count):
+    return [(f"acc{rng.randrange(40)}", rng.choice(CODES), f"{rng.uniform(-1000, 1000):.2f}")
+            for _ in range(count)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_revalue_after_update_matches_full_recompute(seed):
+    rng = random.Random(seed)
+    old = random_rates(rng)
+    old_table = table = RateTable(old)
+    entries = random_entries(rng, 500)
+    ledger = Ledger().add_entries(entries)
+    first = {total.key: total for total in ledger.revalue(table, "A00")}
+
+    new = perturb(old, rng, 0.03)
+    table = table.updated(RateData.from_dict(new), diff_snapshots(old, new))
+    changed = {code for code in CODES if old_table.rate(code, "A00") != table.rate(code, "A00")}
+    more = random_entries(rng, 20)
+    ledger.add_entries(more)
+    second = list(ledger.revalue(table, "A00"))
+
+    assert second == list(Ledger().add_entries(entries + more).revalue(RateTable(new), "A00"))
+    # Итоги ключей без новых проводок и изменившихся курсов берутся из прошлого пересчёта
+    touched_keys = {key for key, _, _ in more}
+    for total in second:
+        if total.key not in touched_keys and not changed & set(ledger.groups[total.key]):
+            assert first[total.key] is total
+    assert any(first[total.key] is total for total in second)
+
+
+def test_revalue_reuses_totals_when_rates_unchanged():
+    rng = random.Random(7)
+    data = random_rates(rng)
+    ledger = Ledger().add_entries(random_entries(rng, 200))
+    first = list(ledger.revalue(RateTable(data), "A01"))
+
+    second = list(ledger.revalue(RateTable(data), "A01"))
+
+    assert all(a is b for a, b in zip(first, second))
+
+
+def test_aggregate_sums_exactly_and_reports_unknown_currency(make_rates):
+    table = RateTable(make_rates())
+    entries = [("acc1", "USD", "10.00"), ("acc1", "eur", "1.5"), ("acc2", "XXX", "5"),
+               ("acc2", "USD", "1"), ("acc3", "USD", "abc"), ("acc4", "GBP", "0.1"), ("acc4", "GBP", "0.2")]
+
+    totals = aggregate(table, entries, "eur")
+
+    assert totals == [
+        LedgerTotal("acc1", "EUR", "10.70", 2, ""),
+        LedgerTotal("acc2", "EUR", None, 2, "Валюта XXX недоступна"),
+        LedgerTotal("acc4", "EUR", f"{0.3 * 0.92 / 0.79:.2f}", 2, ""),
+    ]
+
+
+def test_aggregate_rounds_by_rules(make_rates):
+    table = RateTable(make_rates())
+
+    assert aggregate(table, [("", "USD", "1.005")], "JPY")[0].total == "152"
+    assert aggregate(table, [("", "USD", "1.005")], "USD")[0].total == "1.00"
+    assert aggregate(table, [("", "USD", "1.005")], "USD", {"USD": RoundingRule(3)})[0].total == "1.005"
+
+
+def test_read_entries_csv_and_jsonl():
+    csv_input = io.StringIO("account,currency,amount\nacc1,USD,1.10\n,EUR,2\n")
+    jsonl_input = io.StringIO('{"account": "acc1", "currency": "USD", "amount": 1.10}\n\nnot json\n')
+
+    assert list(read_entries(csv_input)) == [("acc1", "USD", "1.10"), ("", "EUR", "2")]
+    assert list(read_entries(jsonl_input, "jsonl")) == [("acc1", "USD", "1.10"), ("", "", "not json")]
+
+
+def test_write_totals_csv_and_jsonl():
+    totals = [LedgerTotal("a", "EUR", "1.50", 2, ""), LedgerTotal("b", "EUR", None, 1, "Валюта XXX недоступна")]
+
+    output = io.StringIO()
+    write_totals(totals, output, key_column="client")
+    assert output.getvalue() == ("client,currency,total,rows,error\n"
+                                 "a,EUR,1.50,2,\n"
+                                 "b,EUR,,1,Валюта XXX недоступна\n")
+
+    output = io.StringIO()
+    write_totals(totals, output, "jsonl")
+    assert [json.loads(line) for line in output.getvalue().splitlines()] == [
+        {"account": "a", "currency": "EUR", "total": "1.50", "rows": 2},
+        {"account": "b", "currency": "EUR", "total": None, "rows": 1, "error": "Валюта XXX недоступна"},
+    ]
+
+
+@pytest.fixture
+def rates_in_cwd(make_rates, write_rates, tmp_path, monkeypatch):
+    write_rates(make_rates())
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(snapshot, "_caches", {})
+    return tmp_path
+
+
+def test_cli_aggregate(rates_in_cwd, capsys):
+    (rates_in_cwd / "entries.csv").write_text(
+        "client,cur,sum\nacc1,USD,10.00\nacc1,EUR,1.5\nacc2,XXX,5\nacc2,USD,abc\n", encoding="utf-8")
+
+    assert cli.main(["aggregate", "entries.csv", "--to", "EUR", "-o", "totals.csv", "--key", "client",
+                     "--currency-column", "cur", "--amount-column", "sum"]) == 0
+
+    assert (rates_in_cwd / "totals.csv").read_text(encoding="utf-8") == (
+        "client,currency,total,rows,error\n"
+        "acc1,EUR,10.70,2,\n"
+        "acc2,EUR,,1,Валюта XXX недоступна\n")
+    assert "Обработано проводок: 3, с ошибками: 1, ключей: 2" in capsys.readouterr().err
+
+
+def test_cli_aggregate_jsonl_to_stdout(rates_in_cwd, capsys):
+    (rates_in_cwd / "entries.jsonl").write_text('{"account": "a", "currency": "GBP", "amount": "7.9"}\n',
+                                                encoding="utf-8")
+
+    assert cli.main(["aggregate", "entries.jsonl", "--to", "usd"]) == 0
+
+    assert json.loads(capsys.readouterr().out) == {"account": "a", "currency": "USD", "total": "10.00", "rows": 1}
+
+
+def test_cli_aggregate_rejects_unknown_target(rates_in_cwd, capsys):
+    (rates_in_cwd / "entries.csv").write_text("account,currency,amount\na,USD,1\n", encoding="utf-8")
+
+    assert cli.main(["aggregate", "entries.csv", "--to", "XXX"]) == 1
+    assert "Валюта XXX недоступна." in capsys.readouterr().err
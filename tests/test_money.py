@@ -0,0 +1,76 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+from money import (CURRENCY_DECIMALS, ROUNDING_MODES, PairConverter, RoundingRule, decimal_reference,
+                   default_rule, format_units, parse_amount, round_div)
+
+
+RULES = [default_rule(code) for code in ("USD", "JPY", "KWD", "CLF")]
+
+
+def random_amount(rng):
+    decimals = rng.randrange(0, 7)
+    mantissa = rng.randrange(0, 10 ** rng.randrange(1, 16))
+    text = format_units(mantissa if rng.random() < 0.7 else -mantissa, decimals)
+    if rng.random() < 0.1:
+        # Экспоненциальная запись разбирается через Decimal
+        text = f"{Decimal(text):E}"
+    return text
+
+
+def random_rate(rng):
+    return rng.choice([rng.uniform(0.0001, 0.01), rng.uniform(0.5, 2.0), rng.uniform(10, 30000)])
+
+
+@pytest.mark.parametrize("rounding", ROUNDING_MODES)
+def test_convert_matches_decimal_reference(rounding):
+    rng = random.Random(rounding)
+    for _ in range(2000):
+        amount = random_amount(rng)
+        rate = random_rate(rng)
+        rule = RoundingRule(rng.choice(RULES).decimals, rounding)
+
+        result = PairConverter(rate, rule).convert(amount)
+
+        assert Decimal(result) == decimal_reference(amount, rate, rule), (amount, rate, rule)
+
+
+@pytest.mark.parametrize("rounding", ROUNDING_MODES)
+@pytest.mark.parametrize("code", ["JPY", "KWD", "USD"])
+def test_half_way_cases_match_decimal_reference(code, rounding):
+    # Курс 0.5 с нечётной последней цифрой суммы даёт ровно половину младшей единицы
+    rule = RoundingRule(CURRENCY_DECIMALS.get(code, 2), rounding)
+    for mantissa in (1, 3, 5, 7, 25, 1001):
+        for sign in (1, -1):
+            amount = format_units(sign * mantissa, rule.decimals)
+            for rate in (0.5, 1.5, 2.5):
+                result = PairConverter(rate, rule).convert(amount)
+                assert Decimal(result) == decimal_reference(amount, rate, rule), (amount, rate, rule)
+
+
+def test_result_has_currency_decimals():
+    assert PairConverter(151.3, default_rule("JPY")).convert("10.00") == "1513"
+    assert PairConverter(0.307, default_rule("KWD")).convert("10") == "3.070"
+    assert PairConverter(0.5, default_rule("USD")).convert("0.05") == "0.02"
+
+
+def test_parse_amount():
+    assert parse_amount("-12.340") == (-12340, 3)
+    assert parse_amount("1.5E+3") == (1500, 0)
+    assert parse_amount("2e-3") == (2, 3)
+    with pytest.raises(ValueError):
+        parse_amount("abc")
+    with pytest.raises(ValueError):
+        parse_amount("nan")
+
+
+@pytest.mark.parametrize("rounding", ROUNDING_MODES)
+def test_round_div_matches_decimal(rounding):
+    rng = random.Random(0)
+    for _ in range(2000):
+        numerator = rng.randrange(-10 ** 6, 10 ** 6)
+        divisor = 10 ** rng.randrange(0, 4)
+        expected = (Decimal(numerator) / divisor).quantize(Decimal(1), rounding)
+        assert round_div(numerator, divisor, rounding) == expected
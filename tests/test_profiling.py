@@ -0,0 +1,28 @@
+import threading
+
+import profiling
+
+
+def test_phases_from_threads_are_all_counted():
+    threads_count, calls = 8, 2000
+    barrier = threading.Barrier(threads_count)
+
+    def work():
+        barrier.wait()
+        for _ in range(calls):
+            with profiling.phase("parse"):
+                pass
+
+    profiling.start()
+    try:
+        threads = [threading.Thread(target=work) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        report = profiling.stop()
+
+    assert report["phases"][0]["phase"] == "parse"
+    assert report["phases"][0]["calls"] == threads_count * calls
+    assert not profiling.ENABLED
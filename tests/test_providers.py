@@ -0,0 +1,223 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+import providers
+from providers import Provider, ProviderPool, ProviderStats
+
+
+class FakeProvider(Provider):
+    """
+    Источник без сети: отвечает через delay секунд, None при fail
+    """
+
+    def __init__(self, name, delay=0.0, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.finished = threading.Event()
+
+    def fetch(self, currency_code, session, timeout=None, previous=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        self.finished.set()
+        if self.fail:
+            return None
+        return {"base_code": currency_code, "rates": {currency_code: 1.0}, "source": self.name}
+
+
+def make_pool(*fakes, hedge_after=0.05):
+    return ProviderPool(fakes, hedge_after=hedge_after, session=object())
+
+
+def test_provider_is_abstract():
+    with pytest.raises(TypeError):
+        Provider()
+
+
+def test_hedges_slow_provider_after_hedge_after():
+    slow = FakeProvider("slow", delay=1.0)
+    fast = FakeProvider("fast")
+    pool = make_pool(slow, fast)
+
+    start = time.perf_counter()
+    result = pool.fetch("USD")
+    elapsed = time.perf_counter() - start
+
+    assert result["source"] == "fast"
+    assert slow.calls == 1 and fast.calls == 1
+    assert 0.05 <= elapsed < 0.5
+
+
+def test_no_hedge_when_primary_answers_in_time():
+    first = FakeProvider("first")
+    second = FakeProvider("second")
+    pool = make_pool(first, second, hedge_after=1.0)
+
+    assert pool.fetch("USD")["source"] == "first"
+    assert second.calls == 0
+
+
+def test_fails_over_immediately_on_error():
+    broken = FakeProvider("broken", fail=True)
+    backup = FakeProvider("backup")
+    pool = make_pool(broken, backup, hedge_after=5.0)
+
+    start = time.perf_counter()
+    result = pool.fetch("USD")
+
+    assert result["source"] == "backup"
+    assert time.perf_counter() - start < 1.0
+
+
+def test_exception_counts_as_error():
+    class Raising(FakeProvider):
+        def fetch(self, *args, **kwargs):
+            raise RuntimeError("boom")
+
+    pool = make_pool(Raising("raising"), FakeProvider("backup"), hedge_after=5.0)
+
+    assert pool.fetch("USD")["source"] == "backup"
+    assert pool.stats["raising"].errors == 1
+
+
+def test_returns_none_when_all_fail():
+    pool = make_pool(FakeProvider("a", fail=True), FakeProvider("b", fail=True))
+
+    assert pool.fetch("USD") is None
+    assert [pool.stats[name].consecutive_errors for name in ("a", "b")] == [1, 1]
+
+
+def test_reorders_by_latency():
+    slow = FakeProvider("slow", delay=0.3)
+    fast = FakeProvider("fast")
+    pool = make_pool(slow, fast)
+
+    pool.fetch("USD")
+    # Проигравший запрос тоже попадает в статистику
+    assert slow.finished.wait(2.0)
+    time.sleep(0.05)
+
+    assert [provider.name for provider in pool.ordered()] == ["fast", "slow"]
+    assert pool.fetch("USD")["source"] == "fast"
+
+
+def test_untried_provider_goes_after_fast_and_before_slow():
+    fast = FakeProvider("fast")
+    untried = FakeProvider("untried")
+    slow = FakeProvider("slow")
+    pool = make_pool(slow, untried, fast, hedge_after=0.1)
+    pool.stats["fast"].record(0.01, True)
+    pool.stats["slow"].record(0.5, True)
+
+    assert [provider.name for provider in pool.ordered()] == ["fast", "untried", "slow"]
+
+
+def test_errors_push_provider_down_until_it_recovers():
+    first = FakeProvider("first")
+    second = FakeProvider("second")
+    pool = make_pool(first, second)
+    pool.stats["first"].record(0.01, True)
+    pool.stats["second"].record(0.2, True)
+    assert pool.ordered()[0] is first
+
+    pool.stats["first"].record(0.01, False)
+    assert pool.ordered()[0] is second
+
+    pool.stats["first"].record(0.01, True)
+    assert pool.ordered()[0] is first
+
+
+def test_stats_latency_is_ewma():
+    stats = ProviderStats()
+    stats.record(1.0, True)
+    stats.record(2.0, True)
+
+    assert stats.latency == pytest.approx(1.0 + providers.LATENCY_ALPHA * 1.0)
+    # Ошибки не меняют задержку, но добавляют штраф
+    stats.record(10.0, False)
+    assert stats.latency == pytest.approx(1.0 + providers.LATENCY_ALPHA)
+    assert stats.score() == pytest.approx(stats.latency + providers.ERROR_PENALTY)
+
+
+def test_stats_survive_between_pools(tmp_path):
+    path = str(tmp_path / "currency_rate.providers.json")
+    first = make_pool(FakeProvider("slow"), FakeProvider("fast"))
+    first.stats["slow"].record(0.5, True)
+    first.stats["fast"].record(0.01, True)
+    first.stats["fast"].record(0.01, False)
+    assert first.save_stats(path)
+
+    pool = make_pool(FakeProvider("slow"), FakeProvider("fast"), FakeProvider("new"))
+    assert pool.load_stats(path)
+    assert pool.report() == {name: first.stats[name].to_dict() for name in ("fast", "slow")} | \
+        {"new": ProviderStats().to_dict()}
+
+    # Пул, который уже что-то запрашивал, сохранённой статистикой не перезаписывается
+    pool.stats["new"].record(0.02, True)
+    pool.stats["fast"].record(0.01, True)
+    assert not pool.load_stats(path)
+    assert pool.stats["fast"].consecutive_errors == 0
+
+    # Записи источников, которых нет в пуле, в файле остаются
+    assert make_pool(FakeProvider("other")).save_stats(path)
+    assert make_pool(FakeProvider("slow")).load_stats(path)
+
+
+def test_load_stats_ignores_missing_or_damaged_file(tmp_path):
+    path = tmp_path / "currency_rate.providers.json"
+    pool = make_pool(FakeProvider("fast"))
+    assert not pool.load_stats(str(path))
+
+    path.write_text('{"fast": {"latency": "x"}}', encoding="utf-8")
+    assert not pool.load_stats(str(path))
+    path.write_text("[1, 2]", encoding="utf-8")
+    assert not pool.load_stats(str(path))
+    assert pool.stats["fast"].latency is None
+
+
+def test_one_shot_updates_reorder_providers(tmp_path):
+    import api_client
+
+    path = str(tmp_path / "currency_rate.json")
+    runs = []
+    for _ in range(2):
+        # Каждый запуск CLI создаёт новый пул с исходным порядком источников
+        slow = FakeProvider("slow", delay=0.3)
+        fast = FakeProvider("fast")
+        pool = make_pool(slow, fast)
+        assert api_client.update_currency_rates(path, ["USD"], history_dir=None, pool=pool) is not None
+        runs.append((slow.calls, fast.calls))
+
+    assert runs == [(1, 1), (0, 1)]
+    assert os.path.exists(providers.stats_path(path))
+
+
+def test_losing_request_does_not_delay_exit():
+    script = textwrap.dedent("""
+        import time
+        from providers import Provider, ProviderPool
+
+        class Fake(Provider):
+            def __init__(self, name, delay):
+                self.name = name
+                self.delay = delay
+
+            def fetch(self, currency_code, session, timeout=None, previous=None):
+                time.sleep(self.delay)
+                return {"base_code": currency_code, "rates": {}, "source": self.name}
+
+        pool = ProviderPool([Fake("slow", 5.0), Fake("fast", 0.0)], hedge_after=0.05, session=object())
+        assert pool.fetch("USD")["source"] == "fast"
+    """)
+    root = os.path.dirname(os.path.abspath(providers.__file__))
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", script], cwd=root, check=True, timeout=30)
+
+    assert time.perf_counter() - start < 3.0
@@ -0,0 +1,210 @@
+import copy
+import math
+import random
+
+import pytest
+
+import rates
+from diff import diff_snapshots
+from rates import RateTable
+from storage import RateData
+
+
+CODES = ["A%02d" % i for i in range(30)]
+
+
+def random_rates(rng):
+    """
+    Несогласованные таблицы с частично пересекающимися валютами: часть пар есть
+    в нескольких таблицах (выбор зависит от политики), часть — только через цепочку таблиц
+    """
+    value = {code: rng.uniform(0.01, 200) for code in CODES}
+    data = {}
+    bases = CODES[:6]
+    for position, base in enumerate(bases):
+        # Соседние таблицы пересекаются, поэтому граф связен, но не полон
+        quoted = set(CODES[6 + position * 4:6 + position * 4 + 8]) | {bases[(position + 1) % len(bases)]}
+        # sorted: порядок множества зависит от PYTHONHASHSEED, а данные должны зависеть только от rng
+        table_rates = {code: value[code] / value[base] * rng.uniform(0.98, 1.02) for code in sorted(quoted)}
+        table_rates[base] = 1.0
+        updated = 1_700_000_000 + rng.randrange(0, 86400)
+        data[base] = {"base_code": base, "rates": table_rates, "time_last_update_unix": updated,
+                      "time_next_update_unix": updated + 86400}
+    return data
+
+
+def perturb(data, rng, fraction):
+    """
+    Новый снимок: доля fraction котировок изменена, время публикации таблиц то же
+    """
+    new = copy.deepcopy(data)
+    quotes = [(base, code) for base, payload in new.items() for code in payload["rates"] if code != base]
+    for base, code in rng.sample(quotes, max(1, int(len(quotes) * fraction))):
+        new[base]["rates"][code] *= rng.uniform(0.9, 1.1)
+    return new
+
+
+def assert_same_table(actual, expected):
+    assert actual.codes == expected.codes
+    assert list(actual.route) == list(expected.route)
+    for a, b in zip(actual.matrix, expected.matrix):
+        assert (math.isnan(a) and math.isnan(b)) or a == pytest.approx(b, rel=1e-12)
+    for source in actual.codes:
+        for target in actual.codes:
+            path = actual.path(source, target)
+            expected_path = expected.path(source, target)
+            if expected_path is None:
+                assert path is None
+                continue
+            assert [hop[:3] for hop in path] == [hop[:3] for hop in expected_path]
+            assert [hop.rate for hop in path] == pytest.approx([hop.rate for hop in expected_path], rel=1e-12)
+
+
+@pytest.mark.parametrize("policy", rates.PATH_POLICIES)
+@pytest.mark.parametrize("seed", range(10))
+def test_incremental_update_matches_rebuild(policy, seed):
+    rng = random.Random(seed)
+    old = random_rates(rng)
+    table = RateTable(old, policy)
+    assert table._long_paths, "в тестовых данных должны быть пути через несколько таблиц"
+
+    for _ in range(3):
+        new = perturb(old, rng, rng.uniform(0.01, 0.2))
+        updated = table.updated(RateData.from_dict(new), diff_snapshots(old, new))
+        rebuilt = RateTable(new, policy)
+
+        assert updated.changed is not None
+        assert_same_table(updated, rebuilt)
+        # Все пары с изменившимся курсом помечены как изменившиеся
+        for k, (before, after) in enumerate(zip(table.matrix, updated.matrix)):
+            if not (math.isnan(before) and math.isnan(after)) and before != after:
+                assert k in updated.changed
+        old, table = new, updated
+
+
+@pytest.mark.parametrize("policy", rates.PATH_POLICIES)
+def test_too_many_changes_rebuild(policy):
+    rng = random.Random(1)
+    old = random_rates(rng)
+    new = perturb(old, rng, rates.INCREMENTAL_LIMIT + 0.2)
+
+    updated = RateTable(old, policy).updated(RateData.from_dict(new), diff_snapshots(old, new))
+
+    assert updated.changed is None
+    assert_same_table(updated, RateTable(new, policy))
+
+
+@pytest.mark.parametrize("policy", rates.PATH_POLICIES)
+def test_structural_and_order_changes_rebuild(policy):
+    rng = random.Random(2)
+    old = random_rates(rng)
+    table = RateTable(old, policy)
+
+    removed = copy.deepcopy(old)
+    base = next(iter(removed))
+    del removed[base]["rates"][next(code for code in removed[base]["rates"] if code != base)]
+    reordered = copy.deepcopy(old)
+    newest = max(payload["time_last_update_unix"] for payload in old.values())
+    oldest = min(old, key=lambda code: old[code]["time_last_update_unix"])
+    reordered[oldest]["time_last_update_unix"] = newest + 1
+
+    for new in (removed, reordered):
+        updated = table.updated(RateData.from_dict(new), diff_snapshots(old, new))
+        assert updated.changed is None
+        assert_same_table(updated, RateTable(new, policy))
+
+
+def test_unchanged_snapshot_changes_nothing():
+    old = random_rates(random.Random(3))
+    table = RateTable(old)
+
+    updated = table.updated(RateData.from_dict(old), diff_snapshots(old, old))
+
+    assert updated.changed == set()
+    assert list(updated.matrix) == pytest.approx(list(table.matrix), nan_ok=True)
+
+
+def routed_table(base, rates, updated):
+    return {"base_code": base, "rates": {base: 1.0, **rates}, "time_last_update_unix": updated,
+            "time_next_update_unix": updated + 86400}
+
+
+# USD старше EUR; JPY есть только в USD, KWD — только в CHF, а связывает их цепочка через EUR;
+# ZZZ не связана ни с одной другой валютой
+ROUTED = {
+    "USD": routed_table("USD", {"EUR": 0.9, "GBP": 0.8, "JPY": 150.0}, 1_700_000_000),
+    "EUR": routed_table("EUR", {"USD": 1.12, "GBP": 0.88, "CHF": 0.95}, 1_700_003_600),
+    "CHF": routed_table("CHF", {"KWD": 0.35}, 1_700_000_000),
+    "ZZZ": routed_table("ZZZ", {}, 1_700_000_000),
+}
+
+
+def hops(path):
+    return [(hop.from_currency, hop.to_currency, hop.table, pytest.approx(hop.rate)) for hop in path]
+
+
+@pytest.mark.parametrize("policy, pair, expected_path", [
+    # Прямая котировка из таблицы исходной валюты; fresh берёт более свежую таблицу EUR
+    ("hops", ("USD", "EUR"), [("USD", "EUR", "USD", 0.9)]),
+    ("fresh", ("USD", "EUR"), [("USD", "EUR", "EUR", 1 / 1.12)]),
+    # Обратная котировка из таблицы целевой валюты; fresh пересчитывает внутри таблицы EUR
+    ("hops", ("GBP", "USD"), [("GBP", "USD", "USD", 1 / 0.8)]),
+    ("fresh", ("GBP", "USD"), [("GBP", "EUR", "EUR", 1 / 0.88), ("EUR", "USD", "EUR", 1.12)]),
+    # Пересчёт внутри единственной таблицы, где есть обе валюты
+    ("hops", ("GBP", "JPY"), [("GBP", "USD", "USD", 1 / 0.8), ("USD", "JPY", "USD", 150.0)]),
+    ("fresh", ("GBP", "JPY"), [("GBP", "USD", "USD", 1 / 0.8), ("USD", "JPY", "USD", 150.0)]),
+])
+def test_route_by_policy(policy, pair, expected_path):
+    table = RateTable(ROUTED, policy)
+
+    path = table.path(*pair)
+
+    assert hops(path) == [(*hop[:3], pytest.approx(hop[3])) for hop in expected_path]
+    expected_rate = 1.0
+    for hop in expected_path:
+        expected_rate *= hop[3]
+    assert table.rate(*pair) == pytest.approx(expected_rate)
+
+
+@pytest.mark.parametrize("policy", rates.PATH_POLICIES)
+def test_chained_route_through_several_tables(policy):
+    table = RateTable(ROUTED, policy)
+
+    path = table.path("JPY", "KWD")
+
+    assert [hop[:3] for hop in path] == [("JPY", "USD", "USD"), ("USD", "EUR", "USD"),
+                                         ("EUR", "CHF", "EUR"), ("CHF", "KWD", "CHF")]
+    assert table.rate("JPY", "KWD") == pytest.approx(1 / 150 * 0.9 * 0.95 * 0.35)
+    assert table.route[table.index["JPY"] * len(table.codes) + table.index["KWD"]] == rates.MULTI_TABLE
+    # Обратный путь — та же цепочка в обратную сторону
+    assert table.rate("KWD", "JPY") == pytest.approx(1 / table.rate("JPY", "KWD"))
+
+
+def test_same_and_unreachable_pairs():
+    table = RateTable(ROUTED)
+
+    assert table.path("EUR", "EUR") == []
+    assert table.rate("EUR", "EUR") == 1.0
+    assert table.path("USD", "ZZZ") is None
+    assert table.rate("USD", "ZZZ") is None
+
+
+def test_pair_missing_from_source_tables_now_resolves():
+    from converter import ConversionPathError, Converter
+    from snapshot import Snapshot
+
+    # Прежний алгоритм сравнивал только таблицы CHF и USD: в них нет ни прямого курса,
+    # ни общей валюты, и он сообщал «Не удалось найти путь для конвертации CHF в USD».
+    # Теперь курс берётся из третьей таблицы (EUR), где есть обе валюты
+    converter = Converter(Snapshot(ROUTED))
+
+    assert [hop[:3] for hop in converter.path("CHF", "USD")] == [("CHF", "EUR", "EUR"), ("EUR", "USD", "EUR")]
+    assert converter.convert("CHF", "USD", 100) == pytest.approx(100 / 0.95 * 1.12)
+    assert converter.convert("JPY", "KWD", 15000) == pytest.approx(15000 / 150 * 0.9 * 0.95 * 0.35)
+    with pytest.raises(ConversionPathError):
+        converter.rate("USD", "ZZZ")
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        RateTable(ROUTED, "cheapest")
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+from server import ConversionService, handle_connection, watch_snapshot
+from snapshot import SnapshotCache
+
+
+@pytest.fixture
+def service(make_rates, write_rates):
+    service = ConversionService(SnapshotCache(write_rates(make_rates())))
+    service.reload()
+    return service
+
+
+def request(service, raw: bytes):
+    """
+    Отправляет сырой запрос сервису на локальном порту и возвращает статус и тело ответа
+    """
+    async def run():
+        listener = await asyncio.start_server(lambda r, w: handle_connection(service, r, w), "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(raw)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+        return response
+
+    response = asyncio.run(run())
+    head, _, body = response.partition(b"\r\n\r\n")
+    if not head:
+        return None, None
+    return int(head.split()[1]), json.loads(body)
+
+
+def test_convert(service):
+    status, body = request(service, b"GET /convert?from=USD&to=EUR&amount=10 HTTP/1.1\r\nConnection: close\r\n\r\n")
+
+    assert status == 200
+    assert body["result"] == pytest.approx(9.2)
+
+
+@pytest.mark.parametrize("length", [b"abc", b"-5"])
+def test_bad_content_length_is_400(service, length):
+    status, body = request(service, b"POST /convert HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n[]")
+
+    assert status == 400
+    assert "Content-Length" in body["error"]
+
+
+def test_unexpected_error_is_500(service, monkeypatch):
+    def broken(*args):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(service, "handle", broken)
+
+    status, body = request(service, b"GET /health HTTP/1.1\r\nConnection: close\r\n\r\n")
+
+    assert status == 500
+    assert "error" in body
+
+
+def test_watch_snapshot_reloads_off_the_event_loop(service, monkeypatch):
+    threads = []
+    monkeypatch.setattr(service, "reload", lambda: threads.append(threading.current_thread()))
+
+    async def run():
+        watcher = asyncio.ensure_future(watch_snapshot(service, 0.01))
+        while not threads:
+            await asyncio.sleep(0.01)
+        watcher.cancel()
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(run())
+
+    assert threads and threads[0] is not loop_thread
+
+
+@pytest.mark.parametrize("amount", [b"nan", b"inf", b"-Infinity", b"1e308"])
+def test_non_finite_amount_is_400(service, amount):
+    raw = b"GET /convert?from=EUR&to=RUB&amount=" + amount + b" HTTP/1.1\r\nConnection: close\r\n\r\n"
+    status, body = request(service, raw)
+
+    assert status == 400
+    assert "error" in body
+
+
+def test_non_finite_amount_in_batch_is_row_error(service):
+    body = b'{"from": "USD", "to": "EUR", "amount": "nan"}\n{"from": "USD", "to": "EUR", "amount": 1}\n'
+    raw = b"POST /convert HTTP/1.1\r\nConnection: close\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body)
+    status, results = request(service, raw)
+
+    assert status == 200
+    assert "error" in results[0]
+    assert results[1]["result"] == pytest.approx(0.92)
+
+
+def test_payload_that_is_not_valid_json_is_500(service, monkeypatch):
+    monkeypatch.setattr(service, "health", lambda: {"snapshot_age": float("nan")})
+
+    status, body = request(service, b"GET /health HTTP/1.1\r\nConnection: close\r\n\r\n")
+
+    assert status == 500
+    assert "error" in body
@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+import api_client
+import snapshot
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_single_flight_recheck_sees_file_written_during_background_refresh(make_rates, write_rates, monkeypatch):
+    path = write_rates(make_rates(fresh=False))
+    cache = snapshot.SnapshotCache(path)
+    monkeypatch.setitem(snapshot._caches, path, cache)
+    assert not cache.get().is_fresh()
+
+    fetches = []
+    monkeypatch.setattr(api_client, "update_currency_rates", lambda *args, **kwargs: fetches.append(args))
+
+    def refresh():
+        # Пока этот процесс ждал, другой уже записал свежие курсы
+        write_rates(make_rates(fresh=True, scale=1.01))
+        snapshot.refresh_rates(path)
+
+    assert cache.refresh_async(refresh)
+    cache._refresh_thread.join(5)
+
+    assert fetches == []
+    assert cache.get().is_fresh()
+
+
+def test_refresh_fetches_when_file_is_stale(make_rates, write_rates, monkeypatch):
+    path = write_rates(make_rates(fresh=False))
+    monkeypatch.setitem(snapshot._caches, path, snapshot.SnapshotCache(path))
+    fetches = []
+    monkeypatch.setattr(api_client, "update_currency_rates", lambda *args, **kwargs: fetches.append(args))
+
+    assert snapshot.refresh_rates(path)
+    assert fetches == [(path,)]
+
+
+def test_background_refresh_does_not_delay_exit(make_rates, write_rates):
+    path = write_rates(make_rates(fresh=False))
+    script = textwrap.dedent(f"""
+        import time
+        import snapshot
+
+        cache = snapshot.SnapshotCache({path!r})
+        cache.get()
+        assert cache.refresh_async(lambda: time.sleep(5))
+    """)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True, timeout=30)
+
+    assert time.perf_counter() - start < 3.0
+
+
+def test_stale_while_revalidate_cli_run_refreshes_file(make_rates, write_rates, tmp_path):
+    from benchmarks import FakeProvider
+
+    path = write_rates(make_rates(fresh=False))
+    fresh = make_rates(fresh=True, scale=1.01)
+    script = textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {ROOT!r})
+        import cli
+        import providers
+
+        providers._pool = providers.ProviderPool([providers.ErApiProvider({{url!r}})])
+        sys.exit(cli.main(["--stale-while-revalidate", "list"]))
+    """)
+    with FakeProvider(fresh, latency=0.3) as provider:
+        result = subprocess.run([sys.executable, "-c", script.format(url=provider.url)], cwd=str(tmp_path),
+                                capture_output=True, text=True, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    assert data["USD"]["time_next_update_unix"] == fresh["USD"]["time_next_update_unix"]
+    assert data["EUR"]["rates"]["GBP"] == fresh["EUR"]["rates"]["GBP"]
@@ -0,0 +1,154 @@
+import os
+import stat
+
+import pytest
+
+import storage
+from catalog import CurrencyCatalog, catalog_path, save_catalog
+from storage import RateData, atomic_write, read_from_file, save_binary, save_to_file
+
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def current_umask():
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def test_save_keeps_existing_mode(tmp_path, make_rates):
+    path = str(tmp_path / "currency_rate.json")
+    save_to_file(make_rates(), path)
+    os.chmod(path, 0o644)
+
+    save_to_file(make_rates(scale=1.1), path)
+
+    assert mode(path) == 0o644
+    assert read_from_file(path)["USD"]["rates"]["EUR"] == pytest.approx(0.92 * 1.1)
+
+
+def test_new_file_gets_umask_mode(tmp_path, make_rates):
+    path = str(tmp_path / "currency_rate.json")
+    save_to_file(make_rates(), path)
+
+    assert mode(path) == 0o666 & ~current_umask()
+
+
+def test_binary_and_catalog_keep_readable_modes(tmp_path, make_rates):
+    data = make_rates()
+    binary_path = str(tmp_path / "currency_rate.bin")
+    save_binary(data, binary_path)
+    os.chmod(binary_path, 0o640)
+    save_binary(data, binary_path)
+    assert mode(binary_path) == 0o640
+
+    rates_path = str(tmp_path / "currency_rate.json")
+    assert save_catalog(CurrencyCatalog.from_data(RateData.from_dict(data)), rates_path, (1, 2))
+    assert mode(catalog_path(rates_path)) == 0o666 & ~current_umask()
+
+
+def test_failed_write_keeps_original_and_removes_temp(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("old")
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as file:
+            file.write("new")
+            raise RuntimeError
+
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["file.txt"]
+
+
+def test_new_file_mode_does_not_touch_process_umask(tmp_path, monkeypatch):
+    before = os.umask(0o027)
+    try:
+        # Другие потоки не должны увидеть подменённый umask даже на мгновение
+        monkeypatch.setattr(os, "umask", lambda mask: pytest.fail("atomic_write changed the umask"))
+        with atomic_write(str(tmp_path / "new.txt")) as file:
+            file.write("x")
+        with atomic_write(str(tmp_path / "new.bin"), "wb") as file:
+            file.write(b"x")
+    finally:
+        monkeypatch.undo()
+        os.umask(before)
+
+    assert mode(str(tmp_path / "new.txt")) == 0o640
+    assert mode(str(tmp_path / "new.bin")) == 0o640
+    assert sorted(os.listdir(tmp_path)) == ["new.bin", "new.txt"]
+
+
+def test_binary_round_trip_and_lookups(make_rates):
+    data = make_rates()
+    del data["GBP"]["rates"]["JPY"]
+    snapshot = storage.BinarySnapshot(storage.encode_binary(data))
+
+    assert snapshot.to_dict() == data
+    assert snapshot.codes == sorted(storage.RateData.from_dict(data).codes)
+    assert snapshot.base_codes == ["USD", "EUR", "GBP"]
+    assert snapshot.rate("EUR", "RUB") == data["EUR"]["rates"]["RUB"]
+    assert snapshot.rate("GBP", "JPY") is None
+    assert snapshot.rate("RUB", "USD") is None
+    assert snapshot.code_index("XXX") == -1
+    assert snapshot.code_index("CHF") == snapshot.codes.index("CHF")
+    assert snapshot.to_rate_data().to_dict() == storage.RateData.from_dict(data).to_dict()
+
+
+def test_binary_file_round_trip(tmp_path, make_rates):
+    data = make_rates()
+    path = str(tmp_path / "currency_rate.bin")
+    save_binary(data, path)
+
+    with storage.read_binary(path) as snapshot:
+        assert snapshot.to_dict() == data
+
+
+def test_close_releases_rate_views(tmp_path, make_rates):
+    path = str(tmp_path / "currency_rate.bin")
+    save_binary(make_rates(), path)
+
+    with storage.read_binary(path) as snapshot:
+        rates = snapshot.rates("EUR")
+        assert rates[snapshot.code_index("EUR")] == 1.0
+        assert snapshot.rates("EUR") is rates
+
+    with pytest.raises(ValueError):
+        rates[0]
+
+
+def test_close_with_sliced_view_does_not_raise(tmp_path, make_rates):
+    path = str(tmp_path / "currency_rate.bin")
+    save_binary(make_rates(), path)
+
+    with storage.read_binary(path) as snapshot:
+        part = snapshot.rates("USD")[:2]
+
+    assert len(part) == 2
+
+
+def test_bin_extension_selects_binary_backend(tmp_path, make_rates):
+    import snapshot
+
+    data = make_rates()
+    path = str(tmp_path / "currency_rate.bin")
+    assert save_to_file(data, path)
+
+    with open(path, "rb") as file:
+        assert file.read(len(storage.BINARY_MAGIC)) == storage.BINARY_MAGIC
+    assert read_from_file(path) == data
+    assert storage.is_file_fresh(path)
+    assert snapshot.SnapshotCache(path).get().table.rate("EUR", "GBP") == pytest.approx(0.79 / 0.92)
+
+
+def test_corrupt_binary_reports_decode_error(tmp_path):
+    import json
+
+    path = tmp_path / "currency_rate.bin"
+    path.write_bytes(b"not a snapshot")
+
+    with pytest.raises(json.JSONDecodeError):
+        read_from_file(str(path))
+    with pytest.raises(json.JSONDecodeError):
+        storage.read_snapshot(str(path))